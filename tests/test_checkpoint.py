@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from usergrid_tools.migration.checkpoint import WatermarkTracker, FileCheckpointStore, checkpoint_key, \
+    watermark_predicate, mark_complete
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+def scan(tracker, count, batch_size=10):
+    """
+    Adds count entities with created = 1000 + their position to the tracker, sent in batches of batch_size
+    """
+    for i in xrange(count):
+        tracker.add({'created': 1000 + i + 1})
+
+        if (i + 1) % batch_size == 0 or i + 1 == count:
+            tracker.sent(i / batch_size, i + 1)
+
+
+class WatermarkTrackerTest(unittest.TestCase):
+    def test_out_of_order_acks_wait_for_earlier_batches(self):
+        tracker = WatermarkTracker('created', sample_interval=5)
+        scan(tracker, 30)
+
+        # the entity workers finish batches 2 and 1 before batch 0
+        tracker.acknowledge(2)
+        self.assertEqual(tracker.committed(), None)
+
+        tracker.acknowledge(1)
+        self.assertEqual(tracker.committed(), None)
+
+        tracker.acknowledge(0)
+        self.assertEqual(tracker.committed(), 1030)
+
+    def test_a_gap_holds_back_the_watermark(self):
+        tracker = WatermarkTracker('created', sample_interval=5)
+        scan(tracker, 30)
+
+        tracker.acknowledge(0)
+        tracker.acknowledge(2)
+        self.assertEqual(tracker.committed(), 1010)
+
+        tracker.acknowledge(1)
+        self.assertEqual(tracker.committed(), 1030)
+
+    def test_an_ack_before_the_batch_is_sent(self):
+        tracker = WatermarkTracker('created', sample_interval=5)
+        tracker.acknowledge(0)
+
+        for i in xrange(10):
+            tracker.add({'created': 1000 + i + 1})
+
+        self.assertEqual(tracker.committed(), None)
+
+        tracker.sent(0, 10)
+        self.assertEqual(tracker.committed(), 1010)
+
+    def test_a_resumed_scan_keeps_its_watermark_until_a_batch_is_committed(self):
+        tracker = WatermarkTracker('created', sample_interval=5, watermark=1010)
+
+        for i in xrange(10):
+            tracker.add({'created': 1010 + i + 1})
+
+        tracker.sent(0, 10)
+
+        self.assertEqual(tracker.checkpoint()['watermark'], 1010)
+
+        tracker.acknowledge(0)
+        self.assertEqual(tracker.checkpoint()['watermark'], 1020)
+
+
+class FileCheckpointStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FileCheckpointStore(os.path.join(self.directory, 'checkpoints'))
+        self.key = checkpoint_key('v1', 'org', 'data', 'app', 'pets')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_resume(self):
+        self.assertEqual(self.store.load(self.key), None)
+
+        tracker = WatermarkTracker('created', sample_interval=5)
+        scan(tracker, 20)
+        tracker.acknowledge(0)
+        self.store.save(self.key, tracker.checkpoint())
+
+        # a new run resumes the scan from the watermark of the checkpoint
+        checkpoint = self.store.load(self.key)
+
+        self.assertFalse(checkpoint['complete'])
+        self.assertEqual(watermark_predicate(checkpoint['field'], checkpoint['watermark']), 'created >= 1010')
+
+        resumed = WatermarkTracker(checkpoint['field'], watermark=checkpoint['watermark'])
+        self.assertEqual(resumed.committed(), 1010)
+
+    def test_save_complete(self):
+        tracker = WatermarkTracker('created', sample_interval=5)
+        scan(tracker, 20)
+        tracker.acknowledge(0)
+        tracker.acknowledge(1)
+        tracker.finish()
+
+        self.store.save(self.key, mark_complete(tracker.checkpoint()))
+
+        checkpoint = self.store.load(self.key)
+
+        self.assertTrue(checkpoint['complete'])
+        self.assertEqual(checkpoint['watermark'], 1020)
+        self.assertEqual(os.listdir(self.store.directory), [os.path.basename(self.store._path(self.key))])
+
+    def test_time_slices_have_their_own_checkpoints(self):
+        time_slice = {'field': 'created', 'start': 1000, 'end': 2000, 'index': 0, 'count': 2}
+        slice_key = checkpoint_key('v1', 'org', 'data', 'app', 'pets', time_slice)
+
+        self.store.save(self.key, {'watermark': 1})
+        self.store.save(slice_key, {'watermark': 2})
+
+        self.assertEqual(self.store.load(self.key), {'watermark': 1})
+        self.assertEqual(self.store.load(slice_key), {'watermark': 2})
+
+
+class MarkCompleteTest(unittest.TestCase):
+    def test_a_finished_scan_is_completed(self):
+        tracker = WatermarkTracker('created', sample_interval=5)
+        scan(tracker, 20)
+        tracker.finish()
+
+        completed = mark_complete(tracker.checkpoint())
+
+        self.assertTrue(completed['complete'])
+
+    def test_a_stalled_scan_is_not_completed(self):
+        # a scan stopped by a drain or a stall checkpoints what was acknowledged and breaks out without finishing
+        tracker = WatermarkTracker('created', sample_interval=5)
+        scan(tracker, 20)
+        tracker.acknowledge(0)
+
+        checkpoint = tracker.checkpoint()
+
+        self.assertEqual(checkpoint['watermark'], 1010)
+        self.assertFalse(checkpoint['finished'])
+        self.assertEqual(mark_complete(checkpoint), None)
+
+    def test_a_checkpoint_without_the_flag_is_not_completed(self):
+        self.assertEqual(mark_complete({'field': 'created', 'watermark': 1000, 'complete': False}), None)
+        self.assertEqual(mark_complete(None), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
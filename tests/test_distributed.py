@@ -0,0 +1,294 @@
+import json
+import os
+import threading
+import time
+import unittest
+from Queue import Empty
+
+from usergrid_tools.migration import distributed
+from usergrid_tools.migration.distributed import RedisWorkQueue, RedisStatusBoard, RunSeeder, run_key
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class FakeRedis(object):
+    """
+    An in-process stand-in for the subset of the redis client used by the distributed module.  The Lua scripts are
+    run by Python equivalents, so these tests cover the queue and seeding logic but not the scripts themselves, which
+    are covered by RedisIntegrationTest when a Redis server is available.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.lists = {}
+        self.zsets = {}
+        self.values = {}
+        self.hashes = {}
+
+    def register_script(self, script):
+        scripts = {
+            distributed.LEASE_SCRIPT: self._lease,
+            distributed.RENEW_SCRIPT: self._renew,
+            distributed.RECLAIM_SCRIPT: self._reclaim
+        }
+
+        return scripts[script]
+
+    def _lease(self, keys, args):
+        with self.lock:
+            pending = self.lists.setdefault(keys[0], [])
+
+            if len(pending) == 0:
+                return None
+
+            item = pending.pop()
+            self.zsets.setdefault(keys[1], {})[item] = args[0]
+            return item
+
+    def _renew(self, keys, args):
+        with self.lock:
+            leases = self.zsets.setdefault(keys[0], {})
+            renewed = [item for item in args[1:] if item in leases]
+
+            for item in renewed:
+                leases[item] = args[0]
+
+            return len(renewed)
+
+    def _reclaim(self, keys, args):
+        with self.lock:
+            leases = self.zsets.setdefault(keys[1], {})
+            expired = sorted([item for item, score in leases.iteritems() if score <= args[0]],
+                             key=lambda item: leases[item])
+
+            for item in expired:
+                del leases[item]
+                self.lists.setdefault(keys[0], []).append(item)
+
+            return len(expired)
+
+    def lpush(self, key, value):
+        with self.lock:
+            self.lists.setdefault(key, []).insert(0, value)
+
+    def rpush(self, key, value):
+        with self.lock:
+            self.lists.setdefault(key, []).append(value)
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def zrem(self, key, member):
+        with self.lock:
+            return 1 if self.zsets.setdefault(key, {}).pop(member, None) is not None else 0
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            if nx and self.exists(key):
+                return None
+
+            self.values[key] = (value, time.time() + ex if ex is not None else None)
+            return True
+
+    def exists(self, key):
+        value, expires_at = self.values.get(key, (None, None))
+
+        return value is not None and (expires_at is None or expires_at > time.time())
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def hmset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        with self.client.lock:
+            return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class WorkQueueTests(object):
+    """
+    The tests of RedisWorkQueue and RunSeeder, run against the client returned by create_client
+    """
+
+    def create_client(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.client = self.create_client()
+        self.name = 'test:%s:%s' % (os.getpid(), time.time())
+
+    def create_queue(self, lease_time=30):
+        return RedisWorkQueue(self.client, self.name, lease_time=lease_time, poll_interval=0.01)
+
+    def test_items_are_taken_in_order(self):
+        queue = self.create_queue()
+
+        for item in [['app', 'users'], ['app', 'pets']]:
+            queue.put(item)
+
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.get(timeout=0), ['app', 'users'])
+        self.assertEqual(queue.get(timeout=0), ['app', 'pets'])
+        self.assertEqual(queue.qsize(), 0)
+
+        self.assertRaises(Empty, queue.get, timeout=0)
+
+    def test_an_item_is_leased_until_done(self):
+        queue = self.create_queue()
+        queue.put(['app', 'users'])
+
+        queue.get(timeout=0)
+        self.assertEqual(queue.leased(), 1)
+
+        queue.done()
+        self.assertEqual(queue.leased(), 0)
+
+    def test_the_next_get_releases_the_previous_item(self):
+        queue = self.create_queue()
+        queue.put(['app', 'users'])
+        queue.put(['app', 'pets'])
+
+        queue.get(timeout=0)
+        queue.get(timeout=0)
+
+        self.assertEqual(queue.leased(), 1)
+
+    def test_equal_items_are_leased_separately(self):
+        queue = self.create_queue()
+        queue.put(['app', 'users'])
+        queue.put(['app', 'users'])
+
+        other = self.create_queue()
+        queue.get(timeout=0)
+        other.get(timeout=0)
+
+        self.assertEqual(queue.leased(), 2)
+
+    def test_an_expired_lease_is_reclaimed(self):
+        queue = self.create_queue(lease_time=0.3)
+        queue.put(['app', 'users'])
+
+        self.assertEqual(queue.get(timeout=0), ['app', 'users'])
+
+        # stop the heartbeat as if the process holding the lease had died
+        queue._pid = None
+        time.sleep(0.5)
+
+        other = self.create_queue(lease_time=0.3)
+        self.assertEqual(other.get(timeout=0), ['app', 'users'])
+
+    def test_a_held_lease_is_renewed(self):
+        queue = self.create_queue(lease_time=0.6)
+        queue.put(['app', 'users'])
+        queue.get(timeout=0)
+
+        time.sleep(1.0)
+
+        other = self.create_queue(lease_time=0.6)
+        self.assertRaises(Empty, other.get, timeout=0)
+        self.assertEqual(queue.leased(), 1)
+
+        queue._pid = None
+
+    def test_a_reclaimed_lease_is_not_renewed(self):
+        queue = self.create_queue()
+        queue.put(['app', 'users'])
+        queue.get(timeout=0)
+
+        raw = queue.held.values()[0]
+        self.client.zrem(queue.leases_key, raw)
+
+        self.assertEqual(queue.renew_script(keys=[queue.leases_key], args=[time.time() + 30, raw]), 0)
+        self.assertEqual(queue.leased(), 0)
+
+    def test_release_returns_the_items_to_the_queue(self):
+        queue = self.create_queue()
+        queue.put(['app', 'users'])
+        queue.get(timeout=0)
+
+        queue.release()
+
+        self.assertEqual(queue.leased(), 0)
+        self.assertEqual(self.create_queue().get(timeout=0), ['app', 'users'])
+
+    def test_one_host_seeds_the_run(self):
+        queue = self.create_queue()
+        key = run_key('v1', 'org', 'data', self.name, 'seeded')
+        items = [['app', 'users', None], ['app', 'pets', None]]
+
+        self.assertTrue(RunSeeder(self.client, key, poll_interval=0.01).seed(queue, items))
+        self.assertFalse(RunSeeder(self.client, key, poll_interval=0.01).seed(queue, items))
+
+        self.assertEqual(queue.qsize(), 2)
+
+    def test_an_abandoned_claim_is_taken_over(self):
+        queue = self.create_queue()
+        key = run_key('v1', 'org', 'data', self.name, 'seeded')
+
+        # the host which claimed the seeding dies before publishing
+        self.assertTrue(RunSeeder(self.client, key, timeout=1).claim())
+
+        seeder = RunSeeder(self.client, key, timeout=1, poll_interval=0.1)
+        self.assertFalse(seeder.claim())
+
+        self.assertTrue(seeder.seed(queue, [['app', 'users', None]]))
+        self.assertTrue(seeder.is_complete())
+        self.assertEqual(queue.get(timeout=0), ['app', 'users', None])
+
+
+class FakeRedisWorkQueueTest(WorkQueueTests, unittest.TestCase):
+    def create_client(self):
+        return FakeRedis()
+
+
+@unittest.skipUnless(redis is not None and os.environ.get('REDIS_HOST'),
+                     'set REDIS_HOST to run the tests against a Redis server')
+class RedisIntegrationTest(WorkQueueTests, unittest.TestCase):
+    def create_client(self):
+        return redis.StrictRedis(host=os.environ.get('REDIS_HOST'), port=int(os.environ.get('REDIS_PORT', 6379)))
+
+    def tearDown(self):
+        for key in self.client.keys('*%s*' % self.name):
+            self.client.delete(key)
+
+
+class RedisStatusBoardTest(unittest.TestCase):
+    def test_aggregates_the_status_of_all_hosts(self):
+        client = FakeRedis()
+
+        RedisStatusBoard(client, 'status').update('app', {'users': {'count': 3, 'bytes': 30}})
+        RedisStatusBoard(client, 'status').update('app', {'pets': {'count': 2, 'bytes': 20}})
+        RedisStatusBoard(client, 'status').update('app', {'users': {'count': 5, 'bytes': 50}})
+
+        status = RedisStatusBoard(client, 'status').aggregate('org')
+
+        self.assertEqual(status.org_results['summary']['count'], 7)
+        self.assertEqual(json.loads(status.to_json())['apps']['app']['collections']['users']['count'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
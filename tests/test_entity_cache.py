@@ -0,0 +1,58 @@
+import unittest
+
+from usergrid_tools.migration.entity_cache import content_hash, cache_value, parse_cache_value, is_cached_unchanged
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+class EntityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.entity = {'uuid': 'a1', 'type': 'pet', 'name': 'fido', 'modified': 2000, 'metadata': {'path': '/pets/a1'}}
+
+    def test_parses_cache_values(self):
+        self.assertEqual(parse_cache_value(None), (None, None))
+        self.assertEqual(parse_cache_value('None'), (None, None))
+        self.assertEqual(parse_cache_value('2000'), (2000, None))
+        self.assertEqual(parse_cache_value(cache_value(self.entity, with_hash=True)),
+                         (2000, content_hash(self.entity)))
+
+    def test_an_unmodified_entity_is_unchanged(self):
+        self.assertTrue(is_cached_unchanged(cache_value(self.entity), self.entity))
+
+    def test_a_modified_entity_is_migrated(self):
+        # as selected by a delta scan, the entity was modified after it was migrated
+        modified = dict(self.entity, name='rex', modified=3000)
+
+        self.assertFalse(is_cached_unchanged(cache_value(self.entity), modified))
+
+    def test_an_entity_older_than_the_cache_is_unchanged(self):
+        self.assertTrue(is_cached_unchanged(cache_value(dict(self.entity, modified=3000)), self.entity))
+
+    def test_a_touched_entity_is_unchanged_by_hash(self):
+        touched = dict(self.entity, modified=3000)
+
+        self.assertFalse(is_cached_unchanged(cache_value(self.entity, with_hash=True), touched))
+        self.assertTrue(is_cached_unchanged(cache_value(self.entity, with_hash=True), touched, use_hash=True))
+
+    def test_the_hash_decides_before_the_modified_timestamp(self):
+        value = cache_value(dict(self.entity, modified=3000), with_hash=True)
+
+        self.assertTrue(is_cached_unchanged(value, dict(self.entity, name='rex')))
+        self.assertFalse(is_cached_unchanged(value, dict(self.entity, name='rex'), use_hash=True))
+
+    def test_without_a_cached_hash_the_modified_timestamp_decides(self):
+        self.assertTrue(is_cached_unchanged(cache_value(self.entity), self.entity, use_hash=True))
+        self.assertFalse(is_cached_unchanged(cache_value(self.entity), dict(self.entity, modified=3000), use_hash=True))
+
+    def test_an_uncached_entity_is_migrated(self):
+        self.assertFalse(is_cached_unchanged(None, self.entity))
+
+    def test_content_hash_ignores_target_fields(self):
+        target = dict(self.entity, type='dog', modified=5000, metadata={'path': '/dogs/a1'})
+
+        self.assertEqual(content_hash(target), content_hash(self.entity))
+        self.assertNotEqual(content_hash(dict(self.entity, name='rex')), content_hash(self.entity))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import json
+import unittest
+from Queue import Queue
+
+from usergrid_tools.migration.entity_transport import CollectionTable, EntityBatchSender, BatchAcknowledger, \
+    decode_batch
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+def drain(queue):
+    messages = []
+
+    while not queue.empty():
+        messages.append(queue.get_nowait())
+
+    return messages
+
+
+class CollectionTableTest(unittest.TestCase):
+    def test_encodes_known_pairs_as_ids(self):
+        table = CollectionTable()
+
+        self.assertEqual(table.add('app', 'users'), 0)
+        self.assertEqual(table.add('app', 'pets'), 1)
+        self.assertEqual(table.add('app', 'users'), 0)
+        self.assertEqual(len(table), 2)
+
+        self.assertEqual(table.encode('app', 'pets'), 1)
+        self.assertEqual(table.decode(1), ('app', 'pets'))
+
+    def test_sends_unknown_pairs_whole(self):
+        table = CollectionTable()
+
+        self.assertEqual(table.encode('app', 'roles'), ('app', 'roles'))
+        self.assertEqual(table.decode(('app', 'roles')), ('app', 'roles'))
+
+        # as decoded from JSON when sent through Redis
+        self.assertEqual(table.decode(['app', 'roles']), ('app', 'roles'))
+
+
+class EntityBatchSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = Queue()
+        self.table = CollectionTable()
+        self.table.add('app', 'users')
+        self.table.add('app', 'pets')
+
+    def test_round_trip(self):
+        sender = EntityBatchSender(self.queue, self.table, batch_size=2)
+        entities = [{'uuid': str(i), 'name': u'n\xe9%s' % i} for i in xrange(5)]
+
+        for entity in entities:
+            sender.add('app', 'users', sender.encode(entity))
+
+        self.assertEqual(len(sender), 1)
+        sender.flush()
+
+        received = []
+
+        for message in drain(self.queue):
+            app, collection_name, batch, tag = decode_batch(message, self.table)
+
+            self.assertEqual((app, collection_name, tag), ('app', 'users', None))
+            self.assertTrue(len(batch) <= 2)
+            received += batch
+
+        self.assertEqual(received, entities)
+
+    def test_flushes_when_the_collection_changes(self):
+        sender = EntityBatchSender(self.queue, self.table, batch_size=10)
+
+        sender.add('app', 'users', sender.encode({'uuid': '1'}))
+        sender.add('app', 'pets', sender.encode({'uuid': '2'}))
+        sender.flush()
+
+        decoded = [decode_batch(message, self.table) for message in drain(self.queue)]
+
+        self.assertEqual([(app, collection_name, [e['uuid'] for e in batch])
+                          for app, collection_name, batch, tag in decoded],
+                         [('app', 'users', ['1']), ('app', 'pets', ['2'])])
+
+    def test_strips_fields(self):
+        sender = EntityBatchSender(self.queue, self.table, strip_fields=['metadata'])
+
+        self.assertEqual(json.loads(sender.encode({'uuid': '1', 'metadata': {'path': '/users/1'}})), {'uuid': '1'})
+
+    def test_tags_the_batches_of_a_scan(self):
+        sender = EntityBatchSender(self.queue, self.table, batch_size=2)
+        sender.start_scan('channel', 'scan')
+
+        for i in xrange(5):
+            sender.add('app', 'users', sender.encode({'uuid': str(i)}))
+
+        sender.flush()
+
+        self.assertEqual([message[2] for message in drain(self.queue)],
+                         [('channel', 'scan', 0), ('channel', 'scan', 1), ('channel', 'scan', 2)])
+
+        # the end of each batch is the number of entities of the scan up to its last entity
+        self.assertEqual(sender.take_sent(), [(0, 2), (1, 4), (2, 5)])
+        self.assertEqual(sender.take_sent(), [])
+
+        # a new scan flushes the previous one and numbers its batches from 0
+        sender.add('app', 'users', sender.encode({'uuid': '5'}))
+        sender.start_scan()
+        sender.add('app', 'users', sender.encode({'uuid': '6'}))
+        sender.flush()
+
+        self.assertEqual([message[2] for message in drain(self.queue)], [('channel', 'scan', 3), None])
+
+
+class BatchAcknowledgerTest(unittest.TestCase):
+    def setUp(self):
+        self.acks = []
+        self.acknowledger = BatchAcknowledger(self.acks.append)
+
+    def test_acknowledges_once_all_entities_are_done(self):
+        entities = [{'uuid': '1'}, {'uuid': '2'}]
+
+        # as decoded from JSON when sent through Redis
+        self.acknowledger.receive(['channel', 'scan', 0], entities)
+        self.assertEqual(len(self.acknowledger), 1)
+
+        self.acknowledger.done(entities[1])
+        self.assertEqual(self.acks, [])
+
+        self.acknowledger.done(entities[0])
+        self.assertEqual(self.acks, [('channel', 'scan', 0)])
+        self.assertEqual(len(self.acknowledger), 0)
+
+        # an entity which is done again is not counted twice
+        self.acknowledger.done(entities[0])
+        self.assertEqual(len(self.acks), 1)
+
+    def test_acknowledges_empty_batches(self):
+        self.acknowledger.receive(('channel', 'scan', 1), [])
+
+        self.assertEqual(self.acks, [('channel', 'scan', 1)])
+
+    def test_ignores_untagged_batches(self):
+        entity = {'uuid': '1'}
+
+        self.acknowledger.receive(None, [entity])
+        self.acknowledger.done(entity)
+
+        self.assertEqual(self.acks, [])
+        self.assertEqual(len(self.acknowledger), 0)
+
+    def test_identifies_equal_entities_separately(self):
+        first, second = {'uuid': '1'}, {'uuid': '1'}
+
+        self.acknowledger.receive(('channel', 'scan', 0), [first])
+        self.acknowledger.receive(('channel', 'scan', 1), [second])
+
+        self.acknowledger.done(second)
+        self.assertEqual(self.acks, [('channel', 'scan', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
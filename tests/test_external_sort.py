@@ -0,0 +1,62 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from usergrid_tools.migration.external_sort import external_sort, unique_by_key
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+class ExternalSortTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_sorts_in_memory(self):
+        items = [('b', '2'), ('a', '1'), ('c', '3')]
+
+        self.assertEqual(list(external_sort(items, buffer_size=10, temp_dir=self.temp_dir)),
+                         [('a', '1'), ('b', '2'), ('c', '3')])
+
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_spills_and_merges_runs(self):
+        items = [('%05d' % i, 'value-%s' % i) for i in xrange(1000)]
+        shuffled = list(items)
+        random.Random(42).shuffle(shuffled)
+
+        sorted_items = external_sort(shuffled, buffer_size=64, temp_dir=self.temp_dir)
+
+        # the runs are written once the input has been read
+        first = next(sorted_items)
+        self.assertEqual(len(os.listdir(self.temp_dir)), 16)
+
+        self.assertEqual([first] + list(sorted_items), items)
+
+    def test_removes_runs_when_abandoned(self):
+        items = [('%05d' % i, 'value') for i in xrange(100, 0, -1)]
+
+        sorted_items = external_sort(items, buffer_size=10, temp_dir=self.temp_dir)
+        self.assertEqual(next(sorted_items), ('00001', 'value'))
+
+        sorted_items.close()
+
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_orders_equal_keys_by_value(self):
+        items = [('a', '2'), ('b', '1'), ('a', '1'), ('a', '3')]
+
+        self.assertEqual(list(external_sort(items, buffer_size=2, temp_dir=self.temp_dir)),
+                         [('a', '1'), ('a', '2'), ('a', '3'), ('b', '1')])
+
+    def test_unique_by_key(self):
+        self.assertEqual(list(unique_by_key([('a', '1'), ('a', '2'), ('b', '1'), ('c', '1'), ('c', '2')])),
+                         [('a', '1'), ('b', '1'), ('c', '1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
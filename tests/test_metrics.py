@@ -0,0 +1,67 @@
+import os
+import signal
+import unittest
+
+from usergrid_tools.general.metrics import MetricsRegistry
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+class ListQueue(object):
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = ListQueue()
+        self.registry = MetricsRegistry()
+        self.registry.configure(self.queue, flush_interval=3600)
+
+    def test_flush_sends_the_deltas(self):
+        self.registry.inc('requests', status='200')
+        self.registry.inc('requests', 2, status='200')
+        self.registry.observe('seconds', 0.02)
+        self.registry.flush()
+
+        counters, histograms = self.queue.items[0]
+
+        self.assertEqual(counters, {('requests', (('status', '200'),)): 3})
+        self.assertEqual(histograms[('seconds', ())][-1], 1)
+
+        self.registry.flush()
+        self.assertEqual(len(self.queue.items), 1)
+
+    def test_a_fork_while_the_lock_is_held_does_not_deadlock(self):
+        self.registry.inc('requests')
+
+        # as if the flusher thread held the lock when a worker process was forked
+        with self.registry.lock:
+            pid = os.fork()
+
+            if pid == 0:
+                signal.alarm(5)
+                status = 1
+
+                try:
+                    self.registry.flush()
+                    self.registry.inc('requests', 5)
+                    self.registry.flush()
+
+                    # the deltas copied from the parent are not sent by the child
+                    if self.queue.items == [({('requests', ()): 5}, {})]:
+                        status = 0
+                finally:
+                    os._exit(status)
+
+        status = os.waitpid(pid, 0)[1]
+
+        self.assertTrue(os.WIFEXITED(status), 'the child process did not exit')
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from usergrid_tools.migration.retry_queue import RetryScheduler, get_backoff
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+class RetrySchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RetryScheduler(backoff_base=1.0, backoff_max=8.0)
+
+    def test_backoff_is_bounded(self):
+        for attempts in xrange(1, 10):
+            backoff = get_backoff(attempts, base=1.0, max_backoff=8.0)
+
+            self.assertTrue(0 <= backoff <= min(8.0, 2 ** (attempts - 1)))
+
+    def test_items_are_due_after_their_backoff(self):
+        delay = self.scheduler.schedule('a', 1, key=1)
+
+        self.assertTrue(0 <= delay <= 1.0)
+        self.assertTrue(self.scheduler.is_scheduled(1))
+        self.assertEqual(self.scheduler.pop_due(now=time.time() - 1), [])
+        self.assertEqual(len(self.scheduler), 1)
+
+        self.assertEqual(self.scheduler.pop_due(now=time.time() + 1.0), ['a'])
+        self.assertFalse(self.scheduler.is_scheduled(1))
+        self.assertEqual(self.scheduler.next_due_in(), None)
+
+    def test_items_are_popped_in_due_order(self):
+        delays = dict([(item, self.scheduler.schedule(item, 4)) for item in ['a', 'b', 'c', 'd']])
+
+        self.assertEqual(self.scheduler.pop_all(), sorted(delays.keys(), key=lambda item: delays[item]))
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_a_key_is_scheduled_until_its_last_retry_is_popped(self):
+        self.scheduler.schedule('a', 1, key=1)
+        self.scheduler.schedule('b', 1, key=1)
+
+        self.assertEqual(len(self.scheduler.pop_due(now=time.time() + 1.0)), 2)
+        self.assertFalse(self.scheduler.is_scheduled(1))
+
+        self.scheduler.schedule('c', 1, key=1)
+        self.scheduler.schedule('d', 4, key=1)
+
+        # pops the retry which is due first
+        self.assertEqual(len(self.scheduler.pop_due(now=self.scheduler.heap[0][0])), 1)
+        self.assertTrue(self.scheduler.is_scheduled(1))
+        self.assertTrue(0 <= self.scheduler.next_due_in() <= 8.0)
+
+        self.assertEqual(len(self.scheduler.pop_all()), 1)
+        self.assertFalse(self.scheduler.is_scheduled(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
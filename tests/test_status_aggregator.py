@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from usergrid_tools.migration.status_aggregator import StatusAggregator
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+def collection_status(count, bytes, min_created=None, max_created=-1):
+    status = {
+        'count': count,
+        'bytes': bytes,
+        'max_created': max_created,
+        'max_modified': -1
+    }
+
+    if min_created is not None:
+        status['min_created'] = min_created
+
+    return status
+
+
+class StatusAggregatorTest(unittest.TestCase):
+    def test_applies_the_change_of_a_collection(self):
+        status = StatusAggregator('org')
+
+        status.update('app', {'users': collection_status(10, 100)})
+        status.update('app', {'users': collection_status(25, 250)})
+
+        summary = status.org_results['apps']['app']['summary']
+        self.assertEqual((summary['count'], summary['bytes']), (25, 250))
+        self.assertEqual(status.org_results['summary']['count'], 25)
+
+    def test_sums_collections_and_apps(self):
+        status = StatusAggregator('org')
+
+        status.update('app1', {'users': collection_status(10, 100), 'pets': collection_status(5, 50)})
+        status.update('app2', {'users': collection_status(1, 10)})
+        status.update('app1', {'pets': collection_status(7, 70)})
+
+        self.assertEqual(status.org_results['apps']['app1']['summary']['count'], 17)
+        self.assertEqual(status.org_results['apps']['app2']['summary']['count'], 1)
+        self.assertEqual(status.org_results['summary']['count'], 18)
+        self.assertEqual(status.org_results['summary']['bytes'], 180)
+
+    def test_matches_recomputing_the_summaries(self):
+        status = StatusAggregator('org')
+        latest = {}
+
+        for i in xrange(1, 50):
+            app = 'app%s' % (i % 3)
+            status_key = 'collection%s' % (i % 5)
+            latest[(app, status_key)] = collection_status(i, i * 10)
+
+            status.update(app, {status_key: latest[(app, status_key)]})
+
+        self.assertEqual(status.org_results['summary']['count'], sum([s['count'] for s in latest.values()]))
+        self.assertEqual(status.org_results['summary']['bytes'], sum([s['bytes'] for s in latest.values()]))
+
+    def test_widens_the_ranges(self):
+        status = StatusAggregator('org')
+
+        status.update('app', {'users': collection_status(1, 1, min_created=2000, max_created=3000)})
+        status.update('app', {'pets': collection_status(1, 1, min_created=1000, max_created=2500)})
+
+        # a status without a minimum, such as one sent before the first entity, does not narrow the range
+        status.update('app', {'roles': collection_status(0, 0)})
+
+        summary = status.org_results['summary']
+        self.assertEqual((summary['min_created'], summary['max_created']), (1000, 3000))
+
+    def test_write_replaces_the_file(self):
+        temp_dir = tempfile.mkdtemp()
+
+        try:
+            file_name = os.path.join(temp_dir, 'status.json')
+            status = StatusAggregator('org')
+
+            status.update('app', {'users': collection_status(3, 30)})
+            self.assertTrue(status.dirty)
+
+            status.write(file_name)
+            self.assertFalse(status.dirty)
+
+            with open(file_name) as f:
+                self.assertEqual(json.load(f)['summary']['count'], 3)
+
+            self.assertEqual(os.listdir(temp_dir), ['status.json'])
+            self.assertEqual(json.loads(status.to_json())['name'], 'org')
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from usergrid_tools.migration.time_slices import build_time_slices, time_slice_predicate, parse_ql, is_scan_order, \
+    scan_ql
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+class ScanQlTest(unittest.TestCase):
+    def test_parses_ql(self):
+        self.assertEqual(parse_ql('select * order by created asc'), (None, 'created asc'))
+        self.assertEqual(parse_ql("select * where name = 'fido' order by modified desc"),
+                         ("name = 'fido'", 'modified desc'))
+        self.assertEqual(parse_ql("where name = 'fido'"), ("name = 'fido'", None))
+        self.assertEqual(parse_ql('select *'), (None, None))
+
+        # the query URL prefixes --ql with select *
+        self.assertEqual(parse_ql('select * select * order by created asc'), (None, 'created asc'))
+
+    def test_rejects_unsupported_ql(self):
+        self.assertRaises(ValueError, parse_ql, 'select name, age where age > 3')
+
+    def test_the_where_clause_is_kept(self):
+        ql = "select * where type = 'dog' or type = 'cat' order by created asc"
+
+        self.assertEqual(scan_ql(ql, ['created >= 1000'], 'created'),
+                         "select * where (type = 'dog' or type = 'cat') and created >= 1000 order by created asc")
+
+    def test_a_scan_is_ordered_by_its_field(self):
+        time_slice = build_time_slices(1000, 2000, 2, 'modified')[0]
+
+        self.assertEqual(scan_ql('select * order by created asc', [time_slice_predicate(time_slice)], 'modified'),
+                         'select * where modified >= 1000 and modified < 1500 order by modified asc')
+
+    def test_the_order_is_kept_without_a_field(self):
+        self.assertEqual(scan_ql('select * order by name desc', ['modified > 5'], None),
+                         'select * where modified > 5 order by name desc')
+
+    def test_scan_order(self):
+        self.assertTrue(is_scan_order('select * order by created asc', 'modified'))
+        self.assertTrue(is_scan_order("select * where name = 'fido'", 'created'))
+        self.assertTrue(is_scan_order('select * order by  Modified', 'modified'))
+        self.assertFalse(is_scan_order('select * order by created desc', 'created'))
+        self.assertFalse(is_scan_order('select * order by name asc', 'created'))
@@ -0,0 +1,46 @@
+import unittest
+
+from usergrid_tools.migration.usergrid_export_diff import merge_join, changed_fields
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+class MergeJoinTest(unittest.TestCase):
+    def test_joins_matching_keys(self):
+        self.assertEqual(list(merge_join([('a', 1), ('b', 2)], [('a', 10), ('b', 20)])),
+                         [('a', 1, 10), ('b', 2, 20)])
+
+    def test_reports_keys_on_one_side(self):
+        source = [('a', 1), ('c', 3), ('d', 4)]
+        target = [('b', 20), ('c', 30), ('e', 50)]
+
+        self.assertEqual(list(merge_join(source, target)), [
+            ('a', 1, None),
+            ('b', None, 20),
+            ('c', 3, 30),
+            ('d', 4, None),
+            ('e', None, 50)
+        ])
+
+    def test_empty_sides(self):
+        self.assertEqual(list(merge_join([], [])), [])
+        self.assertEqual(list(merge_join([('a', 1)], [])), [('a', 1, None)])
+        self.assertEqual(list(merge_join([], [('a', 1)])), [('a', None, 1)])
+
+    def test_accepts_generators(self):
+        source = ((key, key.upper()) for key in ['a', 'b'])
+        target = ((key, key.upper()) for key in ['b', 'c'])
+
+        self.assertEqual(list(merge_join(source, target)), [('a', 'A', None), ('b', 'B', 'B'), ('c', None, 'C')])
+
+
+class ChangedFieldsTest(unittest.TestCase):
+    def test_ignores_fields(self):
+        source = {'uuid': '1', 'name': 'a', 'color': 'red', 'modified': 1}
+        target = {'uuid': '1', 'name': 'a', 'color': 'blue', 'modified': 2, 'size': 3}
+
+        self.assertEqual(changed_fields(source, target, set(['modified'])), ['color', 'size'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import time
+import unittest
+
+from usergrid_tools.migration.visit_cache import VisitCache
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+
+    def set(self, name, value, ex=None):
+        self.client.values[name] = value
+
+    def delete(self, name):
+        self.client.values.pop(name, None)
+
+    def execute(self):
+        pass
+
+
+class FakeRedis(object):
+    """
+    An in-process stand-in for the get/mget/pipeline subset of the redis client used by VisitCache, which counts reads
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.reads = 0
+
+    def get(self, name):
+        self.reads += 1
+        return self.values.get(name)
+
+    def mget(self, names):
+        self.reads += 1
+        return [self.values.get(name) for name in names]
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class VisitCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeRedis()
+        self.cache = VisitCache(self.client, write_batch_size=1, remote_ttl=0.2)
+
+    def test_remote_reads_are_held_locally(self):
+        self.client.values['a'] = '1'
+
+        self.assertEqual(self.cache.get('a'), '1')
+        self.assertEqual(self.cache.get('a'), '1')
+        self.assertEqual(self.client.reads, 1)
+
+    def test_remote_reads_expire(self):
+        self.client.values['a'] = '1'
+        self.client.values['b'] = '2'
+
+        self.assertEqual(self.cache.get('a'), '1')
+        self.assertEqual(self.cache.get_many(['b']), {'b': '2'})
+
+        # the keys expired in Redis, or were changed by another worker
+        del self.client.values['a']
+        self.client.values['b'] = '3'
+        time.sleep(0.3)
+
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.get_many(['b']), {'b': '3'})
+
+    def test_set_expiry_is_kept(self):
+        self.cache.set('a', 1, ex=0.2)
+        self.assertEqual(self.cache.get('a'), '1')
+
+        del self.client.values['a']
+        time.sleep(0.3)
+
+        self.assertEqual(self.cache.get('a'), None)
+
+    def test_pending_writes_are_read_locally(self):
+        cache = VisitCache(self.client, write_batch_size=10)
+        cache.set('a', 1)
+        cache.delete('b')
+
+        self.assertEqual(cache.get_many(['a', 'b']), {'a': '1', 'b': None})
+        self.assertEqual(self.client.reads, 0)
+
+        cache.flush()
+        self.assertEqual(self.client.values, {'a': '1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
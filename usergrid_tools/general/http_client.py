@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('HttpClient')
+
+DEFAULT_POOL_SIZE = 10
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, keep_alive=True, gzip=True):
+    """
+    Creates a requests.Session with a connection pool sized for pool_size concurrent requests to each host
+
+    :param pool_size: the maximum number of connections kept open to each host
+    :param keep_alive: whether connections are reused between requests, if False each request opens a new connection
+    :param gzip: whether to ask for gzip compressed responses
+    :return: the requests.Session
+    """
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+
+    return session
+
+
+class ProcessLocalSession(object):
+    """
+    A proxy for a requests.Session which is created on first use in each process.  Pooled connections must not be
+    shared across a fork since the parent and the child would read and write the same sockets, so a module-level
+    instance of this class can be created before worker processes are started and each worker will get its own pool
+    which is then reused for every request made by that worker.  It is safe to share between the threads of a process.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, keep_alive=True, gzip=True):
+        self.options = {
+            'pool_size': pool_size,
+            'keep_alive': keep_alive,
+            'gzip': gzip
+        }
+
+        self.lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def configure(self, **options):
+        """
+        Changes the pool_size, keep_alive and/or gzip options.  The session of the current process is replaced on its
+        next use, which should be before the process starts making concurrent requests.
+        """
+        with self.lock:
+            self.options.update(options)
+            self._session = None
+            self._pid = None
+
+    @property
+    def session(self):
+        pid = os.getpid()
+
+        with self.lock:
+            if self._session is None or self._pid != pid:
+                logger.debug('Creating HTTP session in process [%s] with options %s' % (pid, self.options))
+
+                self._session = create_session(**self.options)
+                self._pid = pid
+
+            return self._session
+
+    def __getattr__(self, name):
+        # get/put/post/delete/etc are delegated to the session of the current process
+        return getattr(self.session, name)
+
+
+# the session shared by the modules which are not given one explicitly
+default_session = ProcessLocalSession()
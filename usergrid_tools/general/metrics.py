@@ -0,0 +1,347 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from Queue import Empty
+from SocketServer import ThreadingMixIn
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('Metrics')
+
+# the upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class MetricsRegistry(object):
+    """
+    Counts and latency histograms recorded by the current process.  A module-level instance is configured with a
+    multiprocessing.Queue before the worker processes are started, then each process sends the changes since its last
+    flush to that queue from a background thread every flush_interval seconds, where they are summed by a
+    MetricsAggregator.  Recording is a no-op until the registry is configured, and it is safe to share between the
+    threads of a process.
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._pid = None
+        self._process_locks = {}
+
+    def configure(self, queue, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.queue = queue
+        self.flush_interval = flush_interval
+
+    def enabled(self):
+        return self.queue is not None
+
+    def _check_process(self):
+        # called before taking the lock, since a lock held by another thread of the parent on fork, such as the
+        # flusher, is never released in the child.  The deltas copied from the parent on fork belong to the parent
+        pid = os.getpid()
+
+        if self._pid == pid:
+            return
+
+        # setdefault is atomic, so the threads of a process agree on its lock
+        lock = self._process_locks.setdefault(pid, threading.Lock())
+
+        with lock:
+            if self._pid != pid:
+                self.lock = lock
+                self.counters = {}
+                self.histograms = {}
+                self._pid = pid
+
+                flusher = threading.Thread(target=self._flush_loop, name='MetricsFlusher')
+                flusher.daemon = True
+                flusher.start()
+
+    def inc(self, name, value=1, **labels):
+        if self.queue is None:
+            return
+
+        key = _key(name, labels)
+        self._check_process()
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if self.queue is None:
+            return
+
+        key = _key(name, labels)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        self._check_process()
+
+        with self.lock:
+            # the bucket counts, then the sum and the count
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+
+            histogram[bucket] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def timer(self, name, **labels):
+        return MetricsTimer(self, name, labels)
+
+    def flush(self):
+        """
+        Sends the changes recorded by the current process since its last flush.  The flusher is a daemon thread, so a
+        worker process should call this before it exits
+        """
+        # the deltas copied from the parent on fork are flushed by the parent, and its lock may be held
+        if self._pid != os.getpid():
+            return
+
+        with self.lock:
+            if len(self.counters) == 0 and len(self.histograms) == 0:
+                return
+
+            counters = self.counters
+            histograms = self.histograms
+            self.counters = {}
+            self.histograms = {}
+
+        try:
+            self.queue.put((counters, histograms))
+        except Exception:
+            logger.exception('Error sending metrics')
+
+    def _flush_loop(self):
+        pid = os.getpid()
+
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+class MetricsTimer(object):
+    """
+    Records the time taken by a with block in a latency histogram
+    """
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.registry.observe(self.name, time.time() - self.start_time, **self.labels)
+        return False
+
+
+class InstrumentedSession(object):
+    """
+    Wraps a requests.Session (or ProcessLocalSession/RateLimitedSession) so that the latency and status of each request
+    are recorded as usergrid_http_request_seconds and usergrid_http_requests_total, labelled by the client (source or
+    target) and the method.  Other attributes are delegated to the wrapped session.
+    """
+
+    def __init__(self, session, client_name, metrics_registry=None):
+        self.wrapped_session = session
+        self.client_name = client_name
+        self.registry = metrics_registry if metrics_registry is not None else registry
+
+    def request(self, method, url, **kwargs):
+        start_time = time.time()
+        status = 'error'
+
+        try:
+            r = self.wrapped_session.request(method, url, **kwargs)
+            status = str(r.status_code)
+            return r
+
+        finally:
+            self.registry.observe('usergrid_http_request_seconds', time.time() - start_time,
+                                  client=self.client_name, method=method)
+            self.registry.inc('usergrid_http_requests_total', client=self.client_name, method=method, status=status)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped_session, name)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    labels = list(labels) + (extra or [])
+
+    if len(labels) == 0:
+        return ''
+
+    return '{%s}' % ','.join(['%s="%s"' % (name, _escape(value)) for name, value in labels])
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+
+class MetricsAggregator(object):
+    """
+    Sums the deltas sent by the registries of all processes and renders the totals in the Prometheus text exposition
+    format.  Gauges are read from callbacks when the metrics are rendered, which suits values the main process can
+    read directly such as queue depths.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def add_gauge(self, name, callback, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = callback
+
+    def start(self):
+        reader = threading.Thread(target=self._read_loop, name='MetricsAggregator')
+        reader.daemon = True
+        reader.start()
+
+    def _read_loop(self):
+        while True:
+            try:
+                counters, histograms = self.queue.get(timeout=5)
+            except Empty:
+                continue
+            except Exception:
+                logger.exception('Error reading metrics')
+                time.sleep(1)
+                continue
+
+            self.add(counters, histograms)
+
+    def add(self, counters, histograms):
+        with self.lock:
+            for key, value in counters.iteritems():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+            for key, histogram in histograms.iteritems():
+                total = self.histograms.get(key)
+
+                if total is None:
+                    self.histograms[key] = list(histogram)
+                else:
+                    for i in xrange(len(histogram)):
+                        total[i] += histogram[i]
+
+    def render(self):
+        with self.lock:
+            counters = self.counters.copy()
+            histograms = dict([(key, list(value)) for key, value in self.histograms.iteritems()])
+            gauges = self.gauges.copy()
+
+        lines = []
+
+        for metric_type, metrics in [('counter', counters), ('gauge', gauges)]:
+            for name in sorted(set([key[0] for key in metrics])):
+                lines.append('# TYPE %s %s' % (name, metric_type))
+
+                for key in sorted([key for key in metrics if key[0] == name]):
+                    value = metrics[key]
+
+                    if metric_type == 'gauge':
+                        try:
+                            value = value()
+                        except Exception:
+                            continue
+
+                    lines.append('%s%s %s' % (name, _format_labels(key[1]), _format_value(value)))
+
+        for name in sorted(set([key[0] for key in histograms])):
+            lines.append('# TYPE %s histogram' % name)
+
+            for key in sorted([key for key in histograms if key[0] == name]):
+                histogram = histograms[key]
+                cumulative = 0
+
+                for bucket, upper_bound in enumerate(LATENCY_BUCKETS + ['+Inf']):
+                    cumulative += histogram[bucket]
+                    lines.append('%s_bucket%s %s' % (name, _format_labels(key[1], [('le', upper_bound)]), cumulative))
+
+                lines.append('%s_sum%s %s' % (name, _format_labels(key[1]), _format_value(histogram[-2])))
+                lines.append('%s_count%s %s' % (name, _format_labels(key[1]), histogram[-1]))
+
+        return '\n'.join(lines) + '\n'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port, aggregator, host=''):
+    """
+    Serves the metrics of the aggregator at http://host:port/metrics from a daemon thread of the current process
+
+    :return: the HTTPServer
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ['/', '/metrics']:
+                self.send_error(404)
+                return
+
+            body = aggregator.render()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = _ThreadingHTTPServer((host, port), MetricsHandler)
+
+    server_thread = threading.Thread(target=server.serve_forever, name='MetricsServer')
+    server_thread.daemon = True
+    server_thread.start()
+
+    logger.warning('Serving metrics at http://%s:%s/metrics' % (host or '0.0.0.0', port))
+
+    return server
+
+
+# the registry shared by the modules of the current process
+registry = MetricsRegistry()
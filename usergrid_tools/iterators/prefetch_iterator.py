@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+import requests
+
+from usergrid_tools.general.http_client import default_session
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('PrefetchingQueryIterator')
+
+
+class QueryPageError(Exception):
+    pass
+
+
+class PrefetchingQueryIterator(object):
+    """
+    Iterates the entities of a Usergrid collection or connection URL page by page, following the cursor.  When
+    read_ahead > 0 the following pages are requested by a background thread while the entities of the current page are
+    being consumed, keeping at most read_ahead pages in memory.  The retry and page delay behavior matches the
+    UsergridQueryIterator from the Usergrid Python SDK: page_delay is the time to wait between page requests and
+    sleep_time is the time to wait before retrying a failed page request, which is retried indefinitely unless
+    max_attempts is set.
+    """
+
+    def __init__(self,
+                 url,
+                 sleep_time=10,
+                 page_delay=0,
+                 read_ahead=2,
+                 session=None,
+                 max_attempts=None,
+                 start_cursor=None):
+        """
+        :param url: the URL of the collection or connection query, including any credentials and QL
+        :param sleep_time: the number of seconds to wait before retrying a page after an error
+        :param page_delay: the number of seconds to wait between page requests
+        :param read_ahead: the maximum number of pages to request ahead of the consumer, 0 fetches each page on demand
+        :param session: the requests.Session to use, if not specified the shared process-local session is used
+        :param max_attempts: the maximum number of attempts to retrieve a page before raising a QueryPageError.  When
+        set, a client (4xx) error raises a QueryPageError without retrying.  None retries every error indefinitely
+        :param start_cursor: the cursor of the first page to retrieve
+        """
+        self.url = url
+        self.sleep_time = sleep_time
+        self.page_delay = page_delay
+        self.read_ahead = read_ahead
+        self.session = session if session is not None else default_session
+        self.max_attempts = max_attempts
+
+        # the cursor which was used to retrieve the page currently being consumed
+        self.cursor = start_cursor
+        self.next_cursor = start_cursor
+
+        self.entities = []
+        self._pos = 0
+        self._done = False
+        self._started = False
+        self._fetcher = None
+        self._pages = Queue(maxsize=max(read_ahead, 1))
+        self._stopped = threading.Event()
+
+        self.total_retrieved = 0
+        self.count_pages = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while self._pos >= len(self.entities):
+            if self._done:
+                raise StopIteration
+
+            self._load_next_page()
+
+        entity = self.entities[self._pos]
+        self._pos += 1
+
+        return entity
+
+    def close(self):
+        """
+        Stops the background page requests if the iterator is abandoned before the last page
+        """
+        self._stopped.set()
+
+    def __del__(self):
+        self.close()
+
+    def _page_url(self, cursor):
+        if cursor is None:
+            return self.url
+
+        return '%s%scursor=%s' % (self.url, '&' if '?' in self.url else '?', cursor)
+
+    def _get_page(self, cursor):
+        url = self._page_url(cursor)
+        attempts = 0
+
+        while True:
+            attempts += 1
+
+            try:
+                r = self.session.get(url)
+
+                if r.status_code == 200:
+                    response = r.json()
+                    return response.get('entities', []), response.get('cursor')
+
+                message = 'HTTP [%s] on attempt [%s] retrieving page at URL=[%s]: %s' % (
+                    r.status_code, attempts, url, r.text)
+
+                # client errors will not succeed on retry, unless they are caused by the server such as an expired token
+                if self.max_attempts is not None and r.status_code / 100 == 4:
+                    raise QueryPageError(message)
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ValueError), e:
+                message = 'Error [%s] on attempt [%s] retrieving page at URL=[%s]' % (e, attempts, url)
+
+            if self.max_attempts is not None and attempts >= self.max_attempts:
+                raise QueryPageError(message)
+
+            logger.warning('%s - will retry in [%s]s' % (message, self.sleep_time))
+            time.sleep(self.sleep_time)
+
+    def _fetch_pages(self):
+        cursor = self.next_cursor
+
+        try:
+            while not self._stopped.is_set():
+                entities, next_cursor = self._get_page(cursor)
+
+                if not self._put(('page', cursor, entities, next_cursor)):
+                    return
+
+                if next_cursor is None:
+                    return
+
+                cursor = next_cursor
+
+                if self.page_delay > 0:
+                    time.sleep(self.page_delay)
+
+        except Exception, e:
+            self._put(('error', cursor, e, None))
+
+    def _put(self, item):
+        # waits for the consumer to make room, giving up if the iterator is closed
+        while not self._stopped.is_set():
+            try:
+                self._pages.put(item, timeout=1)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def _load_next_page(self):
+        if self.read_ahead <= 0:
+            if self._started and self.page_delay > 0:
+                time.sleep(self.page_delay)
+
+            self._started = True
+            cursor = self.next_cursor
+            entities, next_cursor = self._get_page(cursor)
+
+        else:
+            if self._fetcher is None:
+                self._fetcher = threading.Thread(target=self._fetch_pages, name='PageFetcher')
+                self._fetcher.daemon = True
+                self._fetcher.start()
+
+            # poll with a timeout so that a KeyboardInterrupt is not blocked
+            while True:
+                try:
+                    kind, cursor, entities, next_cursor = self._pages.get(timeout=1)
+                    break
+                except Empty:
+                    pass
+
+            if kind == 'error':
+                self._done = True
+                raise entities
+
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.entities = entities
+        self._pos = 0
+        self.count_pages += 1
+        self.total_retrieved += len(entities)
+
+        if next_cursor is None:
+            self._done = True
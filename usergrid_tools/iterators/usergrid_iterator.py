@@ -11,10 +11,14 @@ import argparse
 
 from usergrid import UsergridClient, UsergridError
 
+from usergrid_tools.iterators.prefetch_iterator import PrefetchingQueryIterator
+
 __author__ = 'Jeff West @ ApigeeCorporation'
 
 logger = logging.getLogger('UsergridIterator')
 
+collection_query_url_template = "{api_url}/{org}/{app}/{collection}?ql={ql}&limit={limit}&client_id={client_id}&client_secret={client_secret}"
+
 # SAMPLE CONFIG FILE for source and target
 sample_config = {
     "endpoint": {
@@ -287,6 +291,12 @@ def parse_args():
                         type=int,
                         default=10)
 
+    parser.add_argument('--read_ahead',
+                        help='The number of collection pages to request in the background while the current page is '
+                             'published, 0 to use the query of the Usergrid SDK',
+                        type=int,
+                        default=0)
+
     parser.add_argument('--map_app',
                         help="A colon-separated string such as 'apples:oranges' which indicates to put data from the app named 'apples' from the source endpoint into app named 'oranges' in the target endpoint",
                         default=[],
@@ -455,9 +465,19 @@ class UsergridIterator:
 
                 counter = 0
 
+                limit = config.get('source_endpoint', {}).get('limit', 100)
+
+                if config.get('read_ahead', 0) > 0:
+                    url_args = config.get('source_endpoint').copy()
+                    url_args.update(org=source_org, app=app, collection=collection_name, ql=config.get('ql'), limit=limit)
+
+                    entities = PrefetchingQueryIterator(collection_query_url_template.format(**url_args),
+                                                        read_ahead=config.get('read_ahead'))
+                else:
+                    entities = collection.query(ql=config.get('ql'), limit=limit)
+
                 try:
-                    for entity in collection.query(ql=config.get('ql'),
-                                                   limit=config.get('source_endpoint', {}).get('limit', 100)):
+                    for entity in entities:
                         counter += 1
                         queue.put((config.get('org'), app, collection_name, entity))
 
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import re
+import time
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('Checkpoint')
+
+watermark_predicate_template = '{field} >= {watermark}'
+
+
+def checkpoint_key(key_version, org, operation, app, collection_name, time_slice=None):
+    """
+    :return: the key under which the checkpoint of the scan of a collection (or one time slice of it) is stored
+    """
+    key = '%s:checkpoint:%s:%s:%s:%s' % (key_version, org, operation, app, collection_name)
+
+    if time_slice is not None:
+        key += ':%s:%s-%s' % (time_slice.get('field'), time_slice.get('start'), time_slice.get('end'))
+
+    return key
+
+
+def watermark_predicate(field, watermark):
+    return watermark_predicate_template.format(field=field, watermark=watermark)
+
+
+class RedisCheckpointStore(object):
+    """
+    Stores checkpoints as JSON strings in Redis.  Writes are not buffered so that a checkpoint is durable as soon as it
+    is saved.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def load(self, key):
+        value = self.client.get(key)
+
+        if value in [None, 'None']:
+            return None
+
+        return json.loads(value)
+
+    def save(self, key, checkpoint):
+        self.client.set(key, json.dumps(checkpoint))
+
+
+class FileCheckpointStore(object):
+    """
+    Stores each checkpoint as a JSON file in a local directory.  Files are written to a temporary name and renamed so
+    that a crash never leaves a partial checkpoint behind.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.json' % re.sub(r'[^A-Za-z0-9_.-]', '_', key))
+
+    def load(self, key):
+        path = self._path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save(self, key, checkpoint):
+        path = self._path(key)
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+
+        os.rename(temp_path, path)
+
+
+class WatermarkTracker(object):
+    """
+    Tracks the highest value of the ordering field of a collection scan for which all entities have been processed.
+    The scan sends its entities to the entity workers in numbered batches, and a batch is committed once it and every
+    batch before it have been acknowledged by the entity workers, so the watermark lags the scan by the entities which
+    are queued or still being processed.
+
+    A scan which reaches the end of its collection is marked finished, and only the checkpoint of a finished scan can
+    be marked complete (see mark_complete).
+    """
+
+    def __init__(self, field, sample_interval=100, watermark=None):
+        """
+        :param field: the field the scan is ordered by
+        :param sample_interval: the number of entities between recorded values of the field
+        :param watermark: the watermark the scan was resumed from, if any
+        """
+        self.field = field
+        self.sample_interval = sample_interval
+        self.counter = 0
+        self.samples = []
+        self.watermark = watermark
+
+        # the number of entities scanned up to the end of each batch which has been sent but not yet committed
+        self.batch_ends = {}
+        self.acknowledged = set()
+        self.next_batch = 0
+        self.committed_count = 0
+        self.finished = False
+
+    def finish(self):
+        """
+        Records that the scan reached the end of its collection, rather than failing or being stopped
+        """
+        self.finished = True
+
+    def add(self, entity):
+        self.counter += 1
+
+        if self.counter % self.sample_interval == 0 and entity.get(self.field) is not None:
+            self.samples.append((self.counter, long(entity.get(self.field))))
+
+    def sent(self, batch, end):
+        """
+        :param batch: the sequence number of a batch sent to the entity workers, starting from 0
+        :param end: the number of entities scanned up to and including the last entity of the batch
+        """
+        self.batch_ends[batch] = end
+
+    def acknowledge(self, batch):
+        """
+        :param batch: the sequence number of a batch whose entities have all been processed
+        """
+        self.acknowledged.add(batch)
+
+    def committed(self):
+        """
+        :return: the committed watermark, None if there is none yet
+        """
+        while self.next_batch in self.acknowledged and self.next_batch in self.batch_ends:
+            self.acknowledged.remove(self.next_batch)
+            self.committed_count = self.batch_ends.pop(self.next_batch)
+            self.next_batch += 1
+
+        while len(self.samples) > 0 and self.samples[0][0] <= self.committed_count:
+            self.watermark = self.samples.pop(0)[1]
+
+        return self.watermark
+
+    def checkpoint(self, complete=False):
+        return {
+            'field': self.field,
+            'watermark': self.committed(),
+            'count': self.counter,
+            'complete': complete,
+            'finished': self.finished,
+            'updated': long(time.time() * 1000)
+        }
+
+
+def mark_complete(checkpoint):
+    """
+    Marks the checkpoint of a scan complete once its entities have all been processed, so that --resume skips it
+
+    :return: the completed checkpoint, or None if the scan did not reach the end of its collection, in which case
+    --resume continues it from its watermark
+    """
+    if checkpoint is None or not checkpoint.get('finished', False):
+        return None
+
+    completed = dict(checkpoint)
+    completed['complete'] = True
+
+    return completed
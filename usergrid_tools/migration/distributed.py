@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from Queue import Empty
+
+from usergrid_tools.migration.status_aggregator import StatusAggregator
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('Distributed')
+
+DEFAULT_LEASE_TIME = 300.0
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_SEED_TIMEOUT = 300.0
+DEFAULT_SEED_POLL_INTERVAL = 5.0
+
+# moves the item at the head of the queue to the leases, scored by the time the lease expires
+LEASE_SCRIPT = """
+local item = redis.call('RPOP', KEYS[1])
+if item then
+    redis.call('ZADD', KEYS[2], ARGV[1], item)
+end
+return item
+"""
+
+# extends the leases which are still held, so that a lease which has been reclaimed is not revived
+RENEW_SCRIPT = """
+local renewed = 0
+for i = 2, #ARGV do
+    if redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[i])
+        renewed = renewed + 1
+    end
+end
+return renewed
+"""
+
+# returns the items with expired leases to the head of the queue
+RECLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for i, item in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('RPUSH', KEYS[1], item)
+end
+return #expired
+"""
+
+
+def run_key(key_version, org, migrate, run_id, name):
+    """
+    :return: the key of a structure shared by the hosts of a distributed run
+    """
+    return '%s:run:%s:%s:%s:%s' % (key_version, org, migrate, run_id, name)
+
+
+class RunSeeder(object):
+    """
+    Makes sure that the work items of a distributed run are published once, by one of its hosts.  A host claims the
+    seeding with a key which expires after the timeout, then publishes all of the items along with a completion marker
+    in a single transaction, so the items are either all published or none are.  If the host which claimed the seeding
+    dies before publishing, its claim expires and another host takes over.
+    """
+
+    def __init__(self, client, key, timeout=DEFAULT_SEED_TIMEOUT, poll_interval=DEFAULT_SEED_POLL_INTERVAL):
+        self.client = client
+        self.claim_key = '%s:claim' % key
+        self.complete_key = '%s:complete' % key
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def is_complete(self):
+        return bool(self.client.exists(self.complete_key))
+
+    def claim(self):
+        """
+        :return: True if this host claimed the seeding and should now publish the items
+        """
+        claim = json.dumps({'host': os.uname()[1], 'pid': os.getpid(), 'time': time.time()})
+
+        return bool(self.client.set(self.claim_key, claim, nx=True, ex=int(self.timeout)))
+
+    def publish(self, work_queue, items):
+        pipe = self.client.pipeline(transaction=True)
+
+        for item in items:
+            pipe.lpush(work_queue.pending_key, work_queue.encode(item))
+
+        pipe.set(self.complete_key, json.dumps({'host': os.uname()[1], 'count': len(items), 'time': time.time()}))
+        pipe.delete(self.claim_key)
+        pipe.execute()
+
+    def seed(self, work_queue, items):
+        """
+        Waits until the items have been published, publishing them from this host if no other host does
+
+        :return: True if this host published the items
+        """
+        while not self.is_complete():
+            if self.claim():
+                self.publish(work_queue, items)
+                return True
+
+            logger.info('Waiting for another host to publish the work items of [%s]' % work_queue.name)
+            time.sleep(self.poll_interval)
+
+        return False
+
+
+class RedisWorkQueue(object):
+    """
+    A work queue in Redis which is shared by the worker processes of several hosts.  It is used in place of a
+    multiprocessing.Queue, with JSON-serializable items.
+
+    An item taken from the queue is leased to the thread which took it until that thread takes its next item or calls
+    done().  The leases of the items held by a process are renewed by a background thread of the process, so an item
+    whose worker dies returns to the queue once its lease expires, and is then processed again by another worker.
+    Lease expiry times are taken from the clocks of the hosts, which should be kept in sync.
+    """
+
+    def __init__(self, client, name, lease_time=DEFAULT_LEASE_TIME, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.client = client
+        self.name = name
+        self.pending_key = '%s:pending' % name
+        self.leases_key = '%s:leases' % name
+        self.lease_time = lease_time
+        self.poll_interval = poll_interval
+
+        self.lease_script = client.register_script(LEASE_SCRIPT)
+        self.renew_script = client.register_script(RENEW_SCRIPT)
+        self.reclaim_script = client.register_script(RECLAIM_SCRIPT)
+
+        self.lock = threading.Lock()
+        self.held = {}
+        self._pid = None
+
+    def _check_process(self):
+        # called with the lock held.  The leases copied from the parent on fork belong to the parent
+        pid = os.getpid()
+
+        if self._pid != pid:
+            self._pid = pid
+            self.held = {}
+
+            heartbeat = threading.Thread(target=self._heartbeat_loop, name='LeaseHeartbeat')
+            heartbeat.daemon = True
+            heartbeat.start()
+
+    def _heartbeat_loop(self):
+        pid = os.getpid()
+
+        while self._pid == pid:
+            time.sleep(self.lease_time / 3)
+
+            with self.lock:
+                items = self.held.values()
+
+            if len(items) == 0:
+                continue
+
+            try:
+                self.renew_script(keys=[self.leases_key], args=[time.time() + self.lease_time] + items)
+            except Exception:
+                logger.exception('Error renewing [%s] leases of [%s]' % (len(items), self.name))
+
+    def encode(self, item):
+        # items are wrapped with an id so that equal items are distinct members of the leases
+        return json.dumps({'id': uuid.uuid4().hex, 'item': item})
+
+    def put(self, item):
+        self.client.lpush(self.pending_key, self.encode(item))
+
+    def get(self, timeout=None):
+        """
+        Releases the item previously taken by the calling thread and leases the next one
+
+        :raises Empty: if no item became available within the timeout
+        """
+        self.done()
+
+        wait_until = time.time() + (timeout if timeout is not None else 31536000)
+
+        while True:
+            # return the items of workers which have died to the queue before taking one
+            reclaimed = self.reclaim_script(keys=[self.pending_key, self.leases_key], args=[time.time()])
+
+            if reclaimed > 0:
+                logger.warning('Reclaimed [%s] items with expired leases from [%s]' % (reclaimed, self.name))
+
+            raw = self.lease_script(keys=[self.pending_key, self.leases_key], args=[time.time() + self.lease_time])
+
+            if raw is not None:
+                with self.lock:
+                    self._check_process()
+                    self.held[threading.current_thread().ident] = raw
+
+                return json.loads(raw).get('item')
+
+            if time.time() >= wait_until:
+                raise Empty
+
+            time.sleep(min(self.poll_interval, max(wait_until - time.time(), 0)))
+
+    def done(self):
+        """
+        Releases the item taken by the calling thread, which has been processed
+        """
+        with self.lock:
+            raw = self.held.pop(threading.current_thread().ident, None)
+
+        if raw is not None:
+            self.client.zrem(self.leases_key, raw)
+
+    def release(self):
+        """
+        Returns the items held by this process to the queue without waiting for their leases to expire
+        """
+        with self.lock:
+            items = self.held.values()
+            self.held = {}
+
+        for raw in items:
+            if self.client.zrem(self.leases_key, raw):
+                self.client.rpush(self.pending_key, raw)
+
+    def qsize(self):
+        return self.client.llen(self.pending_key)
+
+    def leased(self):
+        return self.client.zcard(self.leases_key)
+
+    def close(self):
+        self.release()
+
+
+class RedisStatusBoard(object):
+    """
+    Holds the latest status of each collection reported by any host of a distributed run, so that the status of the
+    whole run can be aggregated by any of them
+    """
+
+    def __init__(self, client, key):
+        self.client = client
+        self.key = key
+
+    def update(self, app, status_map):
+        self.client.hmset(self.key, dict([(json.dumps([app, status_key]), json.dumps(collection_data))
+                                          for status_key, collection_data in status_map.iteritems()]))
+
+    def aggregate(self, org):
+        """
+        :return: a StatusAggregator of the status of every collection of the run
+        """
+        status = StatusAggregator(org)
+
+        for field, value in self.client.hgetall(self.key).iteritems():
+            app, status_key = json.loads(field)
+            status.update(app, {status_key: json.loads(value)})
+
+        return status
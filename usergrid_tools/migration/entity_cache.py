@@ -0,0 +1,68 @@
+import hashlib
+import json
+import logging
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('EntityCache')
+
+# fields which are not part of the content hash since they are set by the target or change with the collection mapping
+content_hash_ignore_fields = ['metadata', 'modified', 'type']
+
+
+def content_hash(entity):
+    """
+    :return: a hash of the content of an entity which is the same for the source entity and the entity written to the
+    target, since it excludes the fields in content_hash_ignore_fields and does not depend on the order of the keys
+    """
+    content = dict([(key, value) for key, value in entity.iteritems() if key not in content_hash_ignore_fields])
+
+    return hashlib.sha1(json.dumps(content, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+
+def cache_value(entity, with_hash=False):
+    """
+    :return: the value cached for an entity once it has been migrated, 'modified' or, with_hash, 'modified:hash'
+    """
+    value = str(entity.get('modified'))
+
+    if with_hash:
+        value = '%s:%s' % (value, content_hash(entity))
+
+    return value
+
+
+def parse_cache_value(value):
+    """
+    Parses the cached value of an entity, which is 'modified' or, with --content_hash, 'modified:hash'
+
+    :return: (modified, content hash), either of which may be None
+    """
+    if value in [None, 'None']:
+        return None, None
+
+    parts = str(value).split(':', 1)
+
+    modified = long(parts[0]) if parts[0] not in ['', 'None'] else None
+    hash_value = parts[1] if len(parts) > 1 else None
+
+    return modified, hash_value
+
+
+def is_cached_unchanged(value, source_entity, use_hash=False):
+    """
+    :param value: the value cached when the entity was last migrated, None if it was not
+    :param use_hash: decide by the content hash when one was cached, rather than by the modified timestamp
+    :return: True if the entity has not changed since it was migrated, so that it does not need to be written again
+    """
+    modified, cached_hash = parse_cache_value(value)
+
+    if modified is None:
+        return False
+
+    # entities are often touched without changing their content, which the modified timestamp alone would write again
+    if use_hash and cached_hash is not None:
+        return cached_hash == content_hash(source_entity)
+
+    # the entity was migrated at this version or a later one
+    return source_entity.get('modified') is not None and modified >= long(source_entity.get('modified'))
@@ -0,0 +1,207 @@
+import json
+import logging
+import threading
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('EntityTransport')
+
+DEFAULT_TRANSPORT_BATCH_SIZE = 100
+
+
+class CollectionTable(object):
+    """
+    Assigns a small integer id to each (app, collection) pair.  The table is filled in before the worker processes are
+    forked, so every process holds the same ids and a message only needs to carry the id.  Pairs which are not in the
+    table, such as those of replayed records, are sent as the pair itself.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.ids = {}
+
+    def add(self, app, collection_name):
+        key = (app, collection_name)
+
+        if key not in self.ids:
+            self.ids[key] = len(self.keys)
+            self.keys.append(key)
+
+        return self.ids[key]
+
+    def encode(self, app, collection_name):
+        return self.ids.get((app, collection_name), (app, collection_name))
+
+    def decode(self, key_id):
+        # pairs sent through Redis are decoded from JSON as lists
+        if isinstance(key_id, (tuple, list)):
+            return tuple(key_id)
+
+        return self.keys[key_id]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class EntityBatchSender(object):
+    """
+    Buffers the entities published by a producer and puts them on a multiprocessing.Queue in batches.  Each message is
+    (key_id, payload, tag), where the payload is the JSON array of up to batch_size entities, so a consumer parses a
+    batch with one json.loads instead of unpickling a dict per entity.  Fields which the operation does not need, such
+    as metadata, are dropped before the entities are serialized.
+
+    While a scan is tracked (see start_scan), the tag of each batch is (ack_channel, scan_id, sequence) and the
+    consumer acknowledges the batch on that channel once its entities have been processed.  Otherwise the tag is None.
+    """
+
+    def __init__(self, queue, collection_table, batch_size=DEFAULT_TRANSPORT_BATCH_SIZE, strip_fields=None):
+        self.queue = queue
+        self.collection_table = collection_table
+        self.batch_size = max(batch_size, 1)
+        self.strip_fields = strip_fields or []
+
+        self.key = None
+        self.entity_jsons = []
+
+        self.ack_channel = None
+        self.scan_id = None
+        self.sequence = 0
+        self.scan_count = 0
+        self.sent = []
+
+    def start_scan(self, ack_channel=None, scan_id=None):
+        """
+        Flushes the batch of the previous scan, then numbers the batches of the new scan from 0.  Without a scan_id the
+        batches are not acknowledged.
+        """
+        self.flush()
+
+        self.ack_channel = ack_channel
+        self.scan_id = scan_id
+        self.sequence = 0
+        self.scan_count = 0
+        self.sent = []
+
+    def take_sent(self):
+        """
+        :return: the (sequence, end) of each batch of the scan sent since the last call, where end is the number of
+        entities of the scan up to and including the last entity of the batch
+        """
+        sent = self.sent
+        self.sent = []
+        return sent
+
+    def encode(self, entity):
+        """
+        :return: the JSON of the entity as it will be sent
+        """
+        if len(self.strip_fields) > 0:
+            entity = dict([(field, value) for field, value in entity.iteritems() if field not in self.strip_fields])
+
+        return json.dumps(entity)
+
+    def add(self, app, collection_name, entity_json):
+        if (app, collection_name) != self.key:
+            self.flush()
+            self.key = (app, collection_name)
+
+        self.entity_jsons.append(entity_json)
+        self.scan_count += 1
+
+        if len(self.entity_jsons) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.entity_jsons) == 0:
+            return
+
+        app, collection_name = self.key
+        tag = None
+
+        if self.scan_id is not None:
+            tag = (self.ack_channel, self.scan_id, self.sequence)
+            self.sent.append((self.sequence, self.scan_count))
+            self.sequence += 1
+
+        self.queue.put((self.collection_table.encode(app, collection_name), '[%s]' % ','.join(self.entity_jsons), tag))
+        self.entity_jsons = []
+
+    def __len__(self):
+        return len(self.entity_jsons)
+
+
+def decode_batch(message, collection_table):
+    """
+    :return: the app, the collection name, the list of entities and the acknowledgement tag of a message put on the
+    queue by an EntityBatchSender
+    """
+    key_id, payload, tag = message
+    app, collection_name = collection_table.decode(key_id)
+
+    return app, collection_name, json.loads(payload), tag
+
+
+class BatchAcknowledger(object):
+    """
+    Counts the entities of each tagged batch received by an entity worker which have not been processed yet, and sends
+    the acknowledgement of the batch once they all have.  Entities are identified by the objects decoded from the
+    batch, which are held until they are done.  It is safe to share between the threads of a worker process.
+    """
+
+    def __init__(self, send_ack):
+        """
+        :param send_ack: called with the tag of each batch whose entities have all been processed
+        """
+        self.send_ack = send_ack
+        self.lock = threading.Lock()
+        self.outstanding = {}
+        self.entity_tags = {}
+
+    def receive(self, tag, entities):
+        if tag is None:
+            return
+
+        # tags sent through Redis are decoded from JSON as lists
+        tag = tuple(tag)
+
+        with self.lock:
+            self.outstanding[tag] = self.outstanding.get(tag, 0) + len(entities)
+
+            for entity in entities:
+                self.entity_tags[id(entity)] = (tag, entity)
+
+        if len(entities) == 0:
+            self._release(tag)
+
+    def done(self, entity):
+        """
+        Records that an entity has been processed, whether or not it succeeded
+        """
+        with self.lock:
+            tag, held_entity = self.entity_tags.pop(id(entity), (None, None))
+
+            if tag is None:
+                return
+
+            self.outstanding[tag] -= 1
+
+            if self.outstanding[tag] > 0:
+                return
+
+        self._release(tag)
+
+    def _release(self, tag):
+        with self.lock:
+            if self.outstanding.get(tag) != 0:
+                return
+
+            del self.outstanding[tag]
+
+        try:
+            self.send_ack(tag)
+        except Exception:
+            logger.exception('Error acknowledging batch [%s]' % (tag,))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.outstanding)
@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from usergrid_tools.migration.export_index import ExportIndexBuilder, index_keys, index_file_name
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('ExportFiles')
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_ZSTD = 'zstd'
+
+COMPRESSIONS = [COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZSTD]
+
+# the keys of the file lists in a manifest
+ENTITY_FILES = 'entity_files'
+EDGE_FILES = 'edge_files'
+
+file_extensions = {
+    COMPRESSION_NONE: '.txt',
+    COMPRESSION_GZIP: '.txt.gz',
+    COMPRESSION_ZSTD: '.txt.zst'
+}
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def check_compression(compression):
+    """
+    :raises ValueError: if the compression is unknown or its library is not installed
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unknown compression [%s], expected one of %s' % (compression, COMPRESSIONS))
+
+    if compression == COMPRESSION_ZSTD and zstandard is None:
+        raise ValueError('zstd compression requires the zstandard package: pip install zstandard')
+
+
+def compression_for_file(file_name):
+    for compression in [COMPRESSION_GZIP, COMPRESSION_ZSTD]:
+        if file_name.endswith(file_extensions[compression]):
+            return compression
+
+    return COMPRESSION_NONE
+
+
+def _create_compressor(compression):
+    if compression == COMPRESSION_GZIP:
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compressobj()
+
+    return None
+
+
+def _create_decompressor(compression):
+    if compression == COMPRESSION_GZIP:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    return None
+
+
+class ExportFile(object):
+    """
+    A single newline-delimited JSON export file which is compressed as it is written.  Data is written to a temporary
+    file which is renamed to the final name on close, so a file with the final name is always complete.  A file which
+    is closed before all of its records were written, such as when its collection fails, gets a .partial name instead.
+    The number of records, the number of uncompressed bytes and the created/modified range of the entities are recorded
+    for the manifest.  Uncompressed files can also be written with a sidecar index of the byte range of each record by
+    uuid and name, see export_index.
+    """
+
+    def __init__(self, file_name, compression=COMPRESSION_NONE, buffer_size=DEFAULT_BUFFER_SIZE, index=False):
+        self.file_name = file_name
+        self.temp_file_name = '%s.tmp' % file_name
+        self.compression = compression
+        self.compressor = _create_compressor(compression)
+        self.file = open(self.temp_file_name, 'wb', buffer_size)
+
+        # offsets into a compressed file can not be read without decompressing what precedes them
+        self.index_builder = ExportIndexBuilder() if index and compression == COMPRESSION_NONE else None
+
+        self.stats = {
+            'file': os.path.basename(file_name),
+            'count': 0,
+            'bytes': 0
+        }
+
+    def write(self, line, entity=None):
+        """
+        :param line: the serialized record, without a trailing newline
+        :param entity: the entity the record is for, used to track the created/modified range and to index the record
+        """
+        data = line + '\n'
+
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        if self.index_builder is not None and entity is not None:
+            self.index_builder.add(index_keys(entity), self.stats['bytes'], len(data) - 1)
+
+        self.stats['count'] += 1
+        self.stats['bytes'] += len(data)
+
+        if entity is not None:
+            self._track_range(entity)
+
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+
+        if len(data) > 0:
+            self.file.write(data)
+
+    def _track_range(self, entity):
+        for field in ['created', 'modified']:
+            value = entity.get(field)
+
+            if value is None:
+                continue
+
+            try:
+                value = long(value)
+            except ValueError:
+                continue
+
+            if self.stats.get('min_%s' % field) is None or value < self.stats['min_%s' % field]:
+                self.stats['min_%s' % field] = value
+
+            if self.stats.get('max_%s' % field) is None or value > self.stats['max_%s' % field]:
+                self.stats['max_%s' % field] = value
+
+    def close(self, complete=True):
+        """
+        :param complete: False if the records were not all written, in which case the file is named <file>.partial
+        :return: the stats of the file for the manifest
+        """
+        if self.file is None:
+            return self.stats
+
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+
+        self.file.close()
+        self.file = None
+
+        if not complete:
+            self.file_name = '%s.partial' % self.file_name
+            self.stats['file'] = os.path.basename(self.file_name)
+            self.stats['partial'] = True
+
+        os.rename(self.temp_file_name, self.file_name)
+
+        self.stats['compressed_bytes'] = os.path.getsize(self.file_name)
+
+        if self.index_builder is not None:
+            self.index_builder.write(index_file_name(self.file_name))
+            self.stats['index'] = os.path.basename(index_file_name(self.file_name))
+
+        return self.stats
+
+
+class RollingExportWriter(object):
+    """
+    Writes records to a sequence of export files named {base}-N{extension}, starting a new file every records_per_file
+    records.  The first file is only created when the first record is written.
+    """
+
+    def __init__(self, file_name_base, records_per_file, compression=COMPRESSION_NONE,
+                 buffer_size=DEFAULT_BUFFER_SIZE, index=False):
+        self.file_name_base = file_name_base
+        self.records_per_file = records_per_file
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.index = index
+
+        self.file_number = 0
+        self.current = None
+        self.files = []
+
+    def write(self, line, entity=None):
+        if self.current is not None and self.current.stats['count'] >= self.records_per_file:
+            self._close_current()
+
+        if self.current is None:
+            file_name = '%s-%s%s' % (self.file_name_base, self.file_number, file_extensions[self.compression])
+            self.current = ExportFile(file_name, self.compression, self.buffer_size, self.index)
+            self.file_number += 1
+
+        self.current.write(line, entity)
+
+    def _close_current(self, complete=True):
+        if self.current is not None:
+            self.files.append(self.current.close(complete))
+            self.current = None
+
+    def close(self, complete=True):
+        """
+        :param complete: False if the records were not all written, in which case the open file is named <file>.partial.
+        The files which were already closed hold all of their records.
+        :return: the stats of each file written
+        """
+        self._close_current(complete)
+
+        return self.files
+
+
+def summarize_files(files):
+    """
+    :return: the total count/bytes and the overall created/modified range of a list of file stats
+    """
+    summary = {
+        'files': len(files),
+        'count': sum([f.get('count', 0) for f in files]),
+        'bytes': sum([f.get('bytes', 0) for f in files]),
+        'compressed_bytes': sum([f.get('compressed_bytes', 0) for f in files])
+    }
+
+    for field in ['created', 'modified']:
+        minimums = [f.get('min_%s' % field) for f in files if f.get('min_%s' % field) is not None]
+        maximums = [f.get('max_%s' % field) for f in files if f.get('max_%s' % field) is not None]
+
+        if len(minimums) > 0:
+            summary['min_%s' % field] = min(minimums)
+            summary['max_%s' % field] = max(maximums)
+
+    return summary
+
+
+def write_manifest(file_name, manifest):
+    temp_file_name = '%s.tmp' % file_name
+
+    with open(temp_file_name, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(temp_file_name, file_name)
+
+
+def read_manifest(file_name):
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+def read_lines(file_name):
+    """
+    Iterates the lines of an export file, decompressing it based on its extension
+
+    :return: a generator of the lines of the file without the trailing newline
+    """
+    decompressor = _create_decompressor(compression_for_file(file_name))
+    remainder = ''
+
+    with open(file_name, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+
+            if len(chunk) == 0:
+                break
+
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+
+            for line in lines:
+                yield line
+
+    if len(remainder) > 0:
+        yield remainder
+
+
+def read_records(file_name):
+    """
+    :return: a generator of the JSON records of an export file
+    """
+    for line in read_lines(file_name):
+        if len(line.strip()) > 0:
+            yield json.loads(line)
+
+
+def is_data_file(name, data_type):
+    """
+    :param data_type: entity-data or edge-data
+    """
+    if '_%s' % data_type not in name:
+        return False
+
+    return any([name.endswith(extension) for extension in file_extensions.values()])
+
+
+def find_collection_files(app_directory):
+    """
+    Finds the entity and edge files of each collection exported for an app.  The files listed in the manifests are
+    used when the manifests are present, and any data file which is not in a manifest, such as the files of an export
+    written before manifests were added, is found by its name.  Partial files, which were being written when their
+    export failed, are skipped.
+
+    :return: a dict of collection name -> {ENTITY_FILES: [file names], EDGE_FILES: [file names]}
+    """
+    collections = {}
+    listed = set()
+
+    names = sorted(os.listdir(app_directory))
+
+    for name in names:
+        if '_manifest' not in name or not name.endswith('.json'):
+            continue
+
+        manifest = read_manifest(os.path.join(app_directory, name))
+        collection_name = manifest.get('collection', name[:name.rindex('_manifest')])
+
+        if not manifest.get('complete', False):
+            logger.warning('Manifest [%s] is from an export which did not complete' % os.path.join(app_directory, name))
+
+        files = collections.setdefault(collection_name, {ENTITY_FILES: [], EDGE_FILES: []})
+
+        for key in [ENTITY_FILES, EDGE_FILES]:
+            for file_stats in manifest.get(key, []):
+                listed.add(file_stats.get('file'))
+
+                if file_stats.get('partial', False):
+                    logger.warning('Skipping partial file [%s]' % os.path.join(app_directory, file_stats.get('file')))
+                    continue
+
+                files[key].append(os.path.join(app_directory, file_stats.get('file')))
+
+    for name in names:
+        if name in listed:
+            continue
+
+        for key, data_type in [(ENTITY_FILES, 'entity-data'), (EDGE_FILES, 'edge-data')]:
+            if is_data_file(name, data_type):
+                collection_name = name[:name.rindex('_%s' % data_type)]
+                files = collections.setdefault(collection_name, {ENTITY_FILES: [], EDGE_FILES: []})
+                files[key].append(os.path.join(app_directory, name))
+
+    return collections
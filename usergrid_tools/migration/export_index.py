@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('ExportIndex')
+
+INDEX_EXTENSION = '.idx'
+INDEX_MAGIC = 'UGIDX001'
+
+# the header is the magic and the number of entries, followed by the entries sorted by key.  Each entry is a key padded
+# with NUL bytes, the byte offset of the record in the data file and the length of the record without its newline
+HEADER = struct.Struct('>8sQ')
+ENTRY = struct.Struct('>48sQI')
+KEY_SIZE = 48
+
+
+def uuid_key(entity_uuid):
+    return 'u:%s' % str(entity_uuid).lower()
+
+
+def name_key(name):
+    if not isinstance(name, basestring):
+        name = str(name)
+
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+
+    # names can be longer than the key, so they are indexed by their hash
+    return 'n:%s' % hashlib.sha1(name).hexdigest()
+
+
+def index_keys(entity):
+    """
+    :param entity: an entity, or the entity reference of an edge record
+    :return: the keys an export record of the entity is indexed by
+    """
+    keys = []
+
+    if entity.get('uuid') is not None:
+        keys.append(uuid_key(entity.get('uuid')))
+
+    if entity.get('name') is not None:
+        keys.append(name_key(entity.get('name')))
+
+    return keys
+
+
+def index_file_name(data_file_name):
+    return data_file_name + INDEX_EXTENSION
+
+
+def check_indexable(data_file_name):
+    """
+    :raises ValueError: if the file is compressed, since records can only be read at an offset of an uncompressed file
+    """
+    if not data_file_name.endswith('.txt'):
+        raise ValueError('Only uncompressed (.txt) export files can be indexed: [%s]' % data_file_name)
+
+
+class ExportIndexBuilder(object):
+    """
+    Collects the keys and byte ranges of the records of an export file as they are written, then writes them to the
+    sidecar index of the file
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, keys, offset, length):
+        for key in keys:
+            self.entries.append((key, offset, length))
+
+    def write(self, file_name):
+        self.entries.sort()
+
+        temp_file_name = '%s.tmp' % file_name
+
+        with open(temp_file_name, 'wb') as f:
+            f.write(HEADER.pack(INDEX_MAGIC, len(self.entries)))
+
+            for key, offset, length in self.entries:
+                f.write(ENTRY.pack(key, offset, length))
+
+        os.rename(temp_file_name, file_name)
+
+
+def build_index(data_file_name):
+    """
+    Writes the sidecar index of an existing uncompressed export file, such as one exported without --index
+
+    :return: the name of the index file
+    """
+    check_indexable(data_file_name)
+
+    builder = ExportIndexBuilder()
+    offset = 0
+
+    with open(data_file_name, 'rb') as f:
+        for line in f:
+            length = len(line.rstrip('\n'))
+
+            if length > 0:
+                record = json.loads(line)
+                builder.add(index_keys(record.get('entity', record)), offset, length)
+
+            offset += len(line)
+
+    builder.write(index_file_name(data_file_name))
+
+    return index_file_name(data_file_name)
+
+
+class ExportIndex(object):
+    """
+    Looks up the records of an uncompressed export file by uuid or name using its sidecar index.  The index and the data
+    file are memory-mapped, so a lookup is a binary search over the index followed by a read of only the matching
+    records.  Records of edge files are indexed by the uuid of their source entity, so they can be joined to the entity
+    files of the same collection.
+    """
+
+    def __init__(self, data_file_name, index_file_name_override=None):
+        check_indexable(data_file_name)
+
+        self.data_file_name = data_file_name
+        self.index_file_name = index_file_name_override or index_file_name(data_file_name)
+
+        self.index_file = open(self.index_file_name, 'rb')
+        self.data_file = open(self.data_file_name, 'rb')
+
+        self.index_map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self.index_map, 0)
+
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ValueError('[%s] is not an export index' % self.index_file_name)
+
+        # an empty file can not be mapped
+        self.data_map = None
+
+        if os.path.getsize(self.data_file_name) > 0:
+            self.data_map = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _entry(self, position):
+        key, offset, length = ENTRY.unpack_from(self.index_map, HEADER.size + position * ENTRY.size)
+        return key, offset, length
+
+    def _find_first(self, padded_key):
+        low = 0
+        high = self.count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self._entry(middle)[0] < padded_key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def lookup_key(self, key):
+        """
+        :return: the raw lines of the records indexed by the key
+        """
+        padded_key = key.ljust(KEY_SIZE, '\0')
+        lines = []
+        position = self._find_first(padded_key)
+
+        while position < self.count:
+            entry_key, offset, length = self._entry(position)
+
+            if entry_key != padded_key:
+                break
+
+            lines.append(self.data_map[offset:offset + length])
+            position += 1
+
+        return lines
+
+    def lookup_uuid(self, entity_uuid):
+        """
+        :return: the records of the entity with the uuid, or of its edges for an edge file
+        """
+        return [json.loads(line) for line in self.lookup_key(uuid_key(entity_uuid))]
+
+    def lookup_name(self, name):
+        """
+        :return: the records of the entities with the name
+        """
+        # names are decoded from the JSON records as unicode, but given on the command line as UTF-8 bytes
+        if isinstance(name, str):
+            name = name.decode('utf-8')
+
+        return [record for record in [json.loads(line) for line in self.lookup_key(name_key(name))]
+                if record.get('name') == name]
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        for resource in [self.index_map, getattr(self, 'data_map', None), self.index_file, self.data_file]:
+            if resource is not None:
+                resource.close()
+
+
+def find_data_files(paths):
+    data_files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith('.txt') and ('_entity-data' in name or '_edge-data' in name):
+                        data_files.append(os.path.join(root, name))
+        else:
+            data_files.append(path)
+
+    return data_files
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Usergrid Export Lookup')
+
+    parser.add_argument('path',
+                        help='One or more export files, or directories to search for export files',
+                        nargs='+')
+
+    parser.add_argument('-u', '--uuid',
+                        help='One or more uuids of entities to look up',
+                        default=[],
+                        action='append')
+
+    parser.add_argument('-n', '--name',
+                        help='One or more names of entities to look up',
+                        default=[],
+                        action='append')
+
+    parser.add_argument('--build',
+                        help='Build the index of any uncompressed export file which does not have one',
+                        action='store_true')
+
+    my_args = parser.parse_args(sys.argv[1:])
+
+    return vars(my_args)
+
+
+def main():
+    config = parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    for data_file_name in find_data_files(config.get('path')):
+        if not os.path.exists(index_file_name(data_file_name)):
+            if not config.get('build'):
+                logger.warning('Skipping [%s] which has no index, use --build to create it' % data_file_name)
+                continue
+
+            logger.info('Building index of [%s]' % data_file_name)
+            build_index(data_file_name)
+
+        export_index = ExportIndex(data_file_name)
+
+        try:
+            for entity_uuid in config.get('uuid'):
+                for record in export_index.lookup_uuid(entity_uuid):
+                    print '%s\t%s' % (data_file_name, json.dumps(record))
+
+            for name in config.get('name'):
+                for record in export_index.lookup_name(name):
+                    print '%s\t%s' % (data_file_name, json.dumps(record))
+
+        finally:
+            export_index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import heapq
+import logging
+import os
+import tempfile
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('ExternalSort')
+
+DEFAULT_BUFFER_SIZE = 100000
+
+
+def _write_run(items, temp_dir):
+    items.sort()
+
+    handle, run_file_name = tempfile.mkstemp(prefix='usergrid-sort-', suffix='.run', dir=temp_dir)
+
+    with os.fdopen(handle, 'wb') as f:
+        for key, value in items:
+            f.write('%s\t%s\n' % (key, value))
+
+    return run_file_name
+
+
+def _read_run(run_file_name):
+    with open(run_file_name, 'rb') as f:
+        for line in f:
+            key, value = line.rstrip('\n').split('\t', 1)
+            yield key, value
+
+
+def external_sort(items, buffer_size=DEFAULT_BUFFER_SIZE, temp_dir=None):
+    """
+    Sorts (key, value) pairs of byte strings which may not fit in memory.  Up to buffer_size pairs are sorted in memory
+    at a time and written to a temporary run file, then the runs are merged.  Keys must not contain a tab and neither
+    keys nor values may contain a newline.
+
+    :param items: an iterable of (key, value) pairs
+    :param buffer_size: the number of pairs to hold in memory
+    :param temp_dir: the directory to write the run files to, defaults to the system temporary directory
+    :return: a generator of the pairs sorted by key, then value
+    """
+    run_file_names = []
+    buffer = []
+
+    try:
+        for item in items:
+            buffer.append(item)
+
+            if len(buffer) >= buffer_size:
+                run_file_names.append(_write_run(buffer, temp_dir))
+                buffer = []
+
+        # everything fit in memory, so no runs need to be merged
+        if len(run_file_names) == 0:
+            buffer.sort()
+
+            for item in buffer:
+                yield item
+
+            return
+
+        if len(buffer) > 0:
+            run_file_names.append(_write_run(buffer, temp_dir))
+            buffer = []
+
+        logger.info('Merging [%s] sorted runs' % len(run_file_names))
+
+        for item in heapq.merge(*[_read_run(run_file_name) for run_file_name in run_file_names]):
+            yield item
+
+    finally:
+        for run_file_name in run_file_names:
+            try:
+                os.remove(run_file_name)
+            except OSError:
+                pass
+
+
+def unique_by_key(sorted_items):
+    """
+    :return: a generator of the first pair for each key of a sorted iterable of pairs
+    """
+    last_key = None
+
+    for key, value in sorted_items:
+        if key != last_key:
+            yield key, value
+            last_key = key
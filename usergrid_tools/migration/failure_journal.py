@@ -0,0 +1,79 @@
+import datetime
+import fcntl
+import json
+import logging
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('FailureJournal')
+
+KIND_ENTITY = 'entity'
+KIND_EDGE = 'edge'
+
+
+def failure_record(kind, operation, org, app, collection_name, entity, reason, **extra):
+    """
+    :param kind: KIND_ENTITY or KIND_EDGE
+    :param operation: the name of the operation which failed, such as migrate_data or create_connection
+    :param entity: the (source) entity the operation failed on
+    :param reason: a description of the failure
+    :param extra: additional fields such as attempts, edge_name and target_entity
+    :return: the journal record of a failure
+    """
+    record = {
+        'kind': kind,
+        'operation': operation,
+        'org': org,
+        'app': app,
+        'collection': collection_name,
+        'reason': reason,
+        'time': str(datetime.datetime.utcnow()),
+        'entity': entity
+    }
+
+    record.update(extra)
+
+    return record
+
+
+class FailureJournalWriter(object):
+    """
+    Appends a JSON record per line for each failed entity or edge operation.  The file is locked for each write so that
+    it can be shared by worker processes.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def write(self, record):
+        line = json.dumps(record) + '\n'
+
+        with open(self.file_name, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                f.write(line)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_failure_journal(file_name):
+    """
+    Iterates the records of a failure journal, skipping any line which is not valid JSON such as a partially written
+    last line
+
+    :return: a generator of the records in the journal
+    """
+    with open(file_name, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+
+            if len(line) == 0:
+                continue
+
+            try:
+                yield json.loads(line)
+
+            except ValueError:
+                logger.warning('Skipping invalid record on line [%s] of [%s]' % (line_number, file_name))
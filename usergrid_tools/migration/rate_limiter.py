@@ -0,0 +1,186 @@
+import bisect
+import logging
+import time
+from multiprocessing import Lock, Value, Array
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('RateLimiter')
+
+# the upper bounds (ms) of the latency histogram buckets used to estimate the p99 latency
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 75, 100, 150, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000,
+                      30000, 60000]
+
+
+class AdaptiveRateLimiter(object):
+    """
+    A token bucket rate limiter whose state is held in shared memory so that a single instance created before the
+    worker processes are started limits the combined request rate of all of them.
+
+    The rate is adjusted with additive increase / multiplicative decrease: every adjust_interval seconds the p99 latency
+    and the 5xx/connection error rate of the requests recorded in that interval are compared to the latency and error
+    budgets.  If both are within budget the rate is increased by increase_step, otherwise it is multiplied by
+    decrease_factor.  The rate is always kept within [min_rate, max_rate].
+    """
+
+    def __init__(self,
+                 initial_rate,
+                 min_rate=1.0,
+                 max_rate=1000.0,
+                 latency_budget_ms=1000,
+                 error_budget=0.01,
+                 adjust_interval=10,
+                 increase_step=None,
+                 decrease_factor=0.5,
+                 min_samples=20):
+        """
+        :param initial_rate: the number of requests per second to start at
+        :param min_rate: the lowest number of requests per second to back off to
+        :param max_rate: the highest number of requests per second to increase to
+        :param latency_budget_ms: the p99 latency above which the rate is decreased
+        :param error_budget: the fraction of requests which may fail with a 5xx or connection error before the rate is
+        decreased
+        :param adjust_interval: the number of seconds between rate adjustments
+        :param increase_step: the number of requests per second added when healthy, defaults to 2% of max_rate
+        :param decrease_factor: the factor the rate is multiplied by when over budget
+        :param min_samples: the minimum number of requests in an interval needed to increase the rate
+        """
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.latency_budget_ms = latency_budget_ms
+        self.error_budget = error_budget
+        self.adjust_interval = adjust_interval
+        self.increase_step = increase_step if increase_step is not None else max(self.max_rate * 0.02, 1.0)
+        self.decrease_factor = decrease_factor
+        self.min_samples = min_samples
+
+        now = time.time()
+
+        self.lock = Lock()
+        self.rate = Value('d', min(max(float(initial_rate), self.min_rate), self.max_rate), lock=False)
+        self.tokens = Value('d', 0.0, lock=False)
+        self.last_refill = Value('d', now, lock=False)
+        self.window_start = Value('d', now, lock=False)
+        self.requests = Value('l', 0, lock=False)
+        self.errors = Value('l', 0, lock=False)
+        self.latency_histogram = Array('l', len(LATENCY_BUCKETS_MS) + 1, lock=False)
+
+    def acquire(self):
+        """
+        Blocks until a request may be made
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+
+                if now - self.window_start.value >= self.adjust_interval:
+                    self._adjust(now)
+
+                # allow at most one second of burst
+                elapsed = max(now - self.last_refill.value, 0)
+                self.tokens.value = min(self.tokens.value + elapsed * self.rate.value, max(self.rate.value, 1.0))
+                self.last_refill.value = now
+
+                if self.tokens.value >= 1:
+                    self.tokens.value -= 1
+                    return
+
+                wait_time = (1 - self.tokens.value) / self.rate.value
+
+            time.sleep(wait_time)
+
+    def record(self, latency_seconds, status_code=None):
+        """
+        Records the outcome of a request
+
+        :param latency_seconds: the time taken by the request
+        :param status_code: the HTTP status, None if the request failed without a response
+        """
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, latency_seconds * 1000)
+
+        with self.lock:
+            self.requests.value += 1
+            self.latency_histogram[bucket] += 1
+
+            if status_code is None or status_code >= 500:
+                self.errors.value += 1
+
+    def get_rate(self):
+        return self.rate.value
+
+    def _p99_ms(self):
+        target = 0.99 * self.requests.value
+        count = 0
+
+        for bucket, bucket_count in enumerate(self.latency_histogram):
+            count += bucket_count
+
+            if count >= target:
+                return LATENCY_BUCKETS_MS[bucket] if bucket < len(LATENCY_BUCKETS_MS) else float('inf')
+
+        return 0
+
+    def _adjust(self, now):
+        # called with the lock held
+        requests = self.requests.value
+        error_rate = self.errors.value / float(requests) if requests > 0 else 0.0
+        p99_ms = self._p99_ms() if requests > 0 else 0
+        old_rate = self.rate.value
+
+        if error_rate > self.error_budget or p99_ms > self.latency_budget_ms:
+            self.rate.value = max(old_rate * self.decrease_factor, self.min_rate)
+
+        elif requests >= self.min_samples:
+            self.rate.value = min(old_rate + self.increase_step, self.max_rate)
+
+        if self.rate.value != old_rate:
+            logger.warning('Rate limit changed from [%.1f] to [%.1f] requests/sec - p99=[%s]ms errors=[%.2f%%] '
+                           'over [%s] requests' % (old_rate, self.rate.value, p99_ms, 100 * error_rate, requests))
+
+        self.window_start.value = now
+        self.requests.value = 0
+        self.errors.value = 0
+
+        for bucket in xrange(len(self.latency_histogram)):
+            self.latency_histogram[bucket] = 0
+
+
+class RateLimitedSession(object):
+    """
+    Wraps a requests.Session (or ProcessLocalSession) so that each request waits for the rate limiter and its latency
+    and status are recorded.  Other attributes are delegated to the wrapped session.
+    """
+
+    def __init__(self, session, rate_limiter):
+        self.wrapped_session = session
+        self.rate_limiter = rate_limiter
+
+    def request(self, method, url, **kwargs):
+        self.rate_limiter.acquire()
+        start_time = time.time()
+
+        try:
+            r = self.wrapped_session.request(method, url, **kwargs)
+
+        except Exception:
+            self.rate_limiter.record(time.time() - start_time, None)
+            raise
+
+        self.rate_limiter.record(time.time() - start_time, r.status_code)
+
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped_session, name)
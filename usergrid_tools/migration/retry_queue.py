@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('RetryQueue')
+
+
+class TransientError(Exception):
+    """
+    Raised by an operation which failed in a way that may succeed if the operation is attempted again later
+    """
+    pass
+
+
+def get_backoff(attempts, base=1.0, max_backoff=60.0):
+    """
+    :param attempts: the number of attempts made so far
+    :return: the number of seconds to wait before the next attempt, an exponential backoff with full jitter so that
+    operations which failed together do not retry together
+    """
+    return random.uniform(0, min(max_backoff, base * (2 ** max(attempts - 1, 0))))
+
+
+class RetryScheduler(object):
+    """
+    Holds operations which are waiting to be retried, ordered by the time they are due.  Instead of sleeping on a
+    failure a worker schedules the operation here and moves on to other work, checking for due retries between items.
+    It is safe to share between the threads of a worker process.
+    """
+
+    def __init__(self, backoff_base=1.0, backoff_max=60.0):
+        """
+        :param backoff_base: the number of seconds to wait before the first retry, doubled on each further attempt
+        :param backoff_max: the maximum number of seconds to wait before a retry
+        """
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.lock = threading.Lock()
+        self.heap = []
+        self.sequence = itertools.count()
+        self.keys = {}
+
+    def schedule(self, item, attempts, key=None):
+        """
+        :param item: the operation to retry, returned as is by pop_due()
+        :param attempts: the number of attempts made so far
+        :param key: identifies the item for is_scheduled() until it is popped
+        :return: the number of seconds until the retry is due
+        """
+        delay = get_backoff(attempts, self.backoff_base, self.backoff_max)
+
+        with self.lock:
+            heapq.heappush(self.heap, (time.time() + delay, next(self.sequence), item, key))
+
+            if key is not None:
+                self.keys[key] = self.keys.get(key, 0) + 1
+
+        return delay
+
+    def _pop(self):
+        # called with the lock held
+        due_time, sequence, item, key = heapq.heappop(self.heap)
+
+        if key is not None:
+            self.keys[key] -= 1
+
+            if self.keys[key] == 0:
+                del self.keys[key]
+
+        return item
+
+    def is_scheduled(self, key):
+        with self.lock:
+            return key in self.keys
+
+    def pop_due(self, now=None):
+        """
+        :return: the operations which are due to be retried, removing them from the scheduler
+        """
+        now = now if now is not None else time.time()
+        due = []
+
+        with self.lock:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                due.append(self._pop())
+
+        return due
+
+    def pop_all(self):
+        """
+        :return: all of the operations waiting to be retried in the order they are due, removing them
+        """
+        with self.lock:
+            items = [self._pop() for x in xrange(len(self.heap))]
+
+        return items
+
+    def next_due_in(self):
+        """
+        :return: the number of seconds until the next retry is due, or None if there are no retries pending
+        """
+        with self.lock:
+            if len(self.heap) == 0:
+                return None
+
+            return max(self.heap[0][0] - time.time(), 0)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.heap)
+
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('StatusAggregator')
+
+ADDITIVE_FIELDS = ['count', 'bytes']
+MAX_FIELDS = ['max_created', 'max_modified']
+MIN_FIELDS = ['min_created', 'min_modified']
+
+
+def new_summary():
+    return {
+        'max_created': -1,
+        'max_modified': -1,
+        'min_created': 1584946416000,
+        'min_modified': 1584946416000,
+        'count': 0,
+        'bytes': 0
+    }
+
+
+class StatusAggregator(object):
+    """
+    Holds the status of each collection reported by the workers along with the summary of each app and of the org.
+    Each update only applies the change in the updated collection to the summaries instead of recomputing them: the
+    counts are adjusted by the difference from the previous status of the collection and the created/modified ranges
+    are widened, since the range of a collection scan only grows.
+    """
+
+    def __init__(self, org):
+        self.org_results = {
+            'name': org,
+            'apps': {},
+            'summary': new_summary()
+        }
+
+        self.dirty = False
+
+    def update(self, app, status_map):
+        """
+        :param status_map: the status of one or more collections (or time slices) of the app, by status key
+        """
+        app_data = self.org_results['apps'].get(app)
+
+        if app_data is None:
+            app_data = self.org_results['apps'][app] = {
+                'collections': {},
+                'summary': new_summary()
+            }
+
+        for status_key, collection_data in status_map.iteritems():
+            previous = app_data['collections'].get(status_key) or {}
+
+            for summary in [app_data['summary'], self.org_results['summary']]:
+                for field in ADDITIVE_FIELDS:
+                    summary[field] += collection_data.get(field, 0) - previous.get(field, 0)
+
+                for field in MAX_FIELDS:
+                    if collection_data.get(field) > summary[field]:
+                        summary[field] = collection_data.get(field)
+
+                for field in MIN_FIELDS:
+                    if collection_data.get(field) is not None and collection_data.get(field) < summary[field]:
+                        summary[field] = collection_data.get(field)
+
+            app_data['collections'][status_key] = collection_data
+
+        self.dirty = True
+
+    def to_json(self):
+        return json.dumps(self.org_results)
+
+    def write(self, file_name):
+        """
+        Writes the status to a temporary file which is renamed over the status file, so that a reader never sees a
+        partially written status
+        """
+        temp_file_name = '%s.tmp' % file_name
+
+        with open(temp_file_name, 'w') as f:
+            json.dump(self.org_results, f, indent=2)
+
+        os.rename(temp_file_name, file_name)
+
+        self.dirty = False
@@ -0,0 +1,161 @@
+import logging
+import re
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('TimeSlices')
+
+range_query_template = 'select * order by {field} {direction}'
+time_slice_predicate_template = '{field} >= {start} and {field} < {end}'
+
+# the order of the default --ql, which does not prevent a checkpointed scan from being ordered by another field
+default_order = 'created asc'
+ql_pattern = re.compile(r'^\s*(select\s+\*\s*)*(where\s+(?P<where>.*?))?\s*(order\s+by\s+(?P<order>.*?))?\s*$',
+                        re.IGNORECASE | re.DOTALL)
+
+
+def get_field_range(session, build_query_url, field='created'):
+    """
+    Retrieves the minimum and maximum value of a timestamp field of a collection using two single-entity queries
+
+    :param session: the requests.Session to use
+    :param build_query_url: a function which takes a QL string and returns the URL of a query with limit=1
+    :param field: the field to get the range of, such as 'created' or 'modified'
+    :return: a tuple of (min, max), or (None, None) if the range could not be determined
+    """
+    values = []
+
+    for direction in ['asc', 'desc']:
+        url = build_query_url(range_query_template.format(field=field, direction=direction))
+
+        try:
+            r = session.get(url)
+
+            if r.status_code != 200:
+                logger.warning('Unable to determine [%s] range, HTTP [%s] on URL=[%s]: %s' % (
+                    field, r.status_code, url, r.text))
+                return None, None
+
+            entities = r.json().get('entities', [])
+
+            if len(entities) == 0 or entities[0].get(field) is None:
+                return None, None
+
+            values.append(long(entities[0].get(field)))
+
+        except Exception:
+            logger.exception('Unable to determine [%s] range on URL=[%s]' % (field, url))
+            return None, None
+
+    return min(values), max(values)
+
+
+def build_time_slices(min_value, max_value, count, field='created'):
+    """
+    Splits the range [min_value, max_value] into count contiguous ranges of equal width
+
+    :return: an array of time slices, each being a dict with the field, the inclusive start, the exclusive end and the
+    index/count of the slice
+    """
+    if min_value is None or max_value is None or count <= 1 or max_value <= min_value:
+        return []
+
+    end_value = max_value + 1
+    width = max((end_value - min_value) / count, 1)
+
+    time_slices = []
+    start = min_value
+
+    for index in xrange(count):
+        end = end_value if index == count - 1 else min(start + width, end_value)
+
+        time_slices.append({
+            'field': field,
+            'start': start,
+            'end': end,
+            'index': index,
+            'count': count
+        })
+
+        start = end
+
+        if start >= end_value:
+            break
+
+    for time_slice in time_slices:
+        time_slice['count'] = len(time_slices)
+
+    return time_slices
+
+
+def time_slice_predicate(time_slice):
+    return time_slice_predicate_template.format(**time_slice)
+
+
+def parse_ql(ql):
+    """
+    Splits a QL string such as 'select * where name = 'x' order by created asc' into its where and order by clauses
+
+    :return: a tuple of (where, order), each being None if the clause is not present
+    """
+    match = ql_pattern.match(ql or '')
+
+    if match is None:
+        raise ValueError('Unable to parse QL [%s], only select * with where and order by clauses is supported' % ql)
+
+    return match.group('where') or None, match.group('order') or None
+
+
+def is_scan_order(ql, field):
+    """
+    :return: True if the order by clause of the QL allows a scan to be ordered by the field, which is required to
+    checkpoint the scan by the field
+    """
+    order = parse_ql(ql)[1]
+
+    if order is None:
+        return True
+
+    order = ' '.join(order.lower().split())
+
+    if len(order.split()) == 1:
+        order += ' asc'
+
+    return order in [default_order, '%s asc' % field.lower()]
+
+
+def scan_ql(ql, predicates, order_field=None):
+    """
+    Adds predicates to the where clause of a QL string
+
+    :param ql: the QL string, such as --ql
+    :param predicates: the predicates to AND into the where clause of the QL
+    :param order_field: the field to order the scan by instead of the order by clause of the QL, such as the field a
+    checkpointed scan is tracked by
+    :return: the QL string of the scan
+    """
+    where, order = parse_ql(ql)
+    clauses = (['(%s)' % where] if where is not None else []) + list(predicates)
+
+    if order_field is not None:
+        order = '%s asc' % order_field
+
+    ql = 'select *'
+
+    if len(clauses) > 0:
+        ql += ' where %s' % ' and '.join(clauses)
+
+    if order is not None:
+        ql += ' order by %s' % order
+
+    return ql
+
+
+def time_slice_label(collection_name, time_slice):
+    """
+    :return: the name under which the progress of a collection (or one time slice of it) is reported
+    """
+    if time_slice is None:
+        return collection_name
+
+    return '%s[%s/%s]' % (collection_name, time_slice.get('index') + 1, time_slice.get('count'))
@@ -13,13 +13,23 @@ from cloghandler import ConcurrentRotatingFileHandler
 import requests
 import traceback
 import time
+from collections import OrderedDict
 from sys import platform as _platform
 
 import signal
 
-from usergrid import UsergridQueryIterator
 import urllib3
 
+from usergrid_tools.general.http_client import ProcessLocalSession, DEFAULT_POOL_SIZE
+from usergrid_tools.general.metrics import registry as metrics, MetricsAggregator, InstrumentedSession, \
+    start_metrics_server
+from usergrid_tools.iterators.prefetch_iterator import PrefetchingQueryIterator
+from usergrid_tools.migration.export_files import RollingExportWriter, COMPRESSIONS, check_compression, \
+    summarize_files, write_manifest, read_manifest
+from usergrid_tools.migration.status_aggregator import StatusAggregator
+from usergrid_tools.migration.time_slices import get_field_range, build_time_slices, time_slice_predicate, \
+    time_slice_label, parse_ql, is_scan_order, scan_ql
+
 __author__ = 'Jeff West @ ApigeeCorporation'
 
 ECID = str(uuid.uuid1())
@@ -38,6 +48,9 @@ DEFAULT_CREATE_APPS = False
 DEFAULT_RETRY_SLEEP = 10
 DEFAULT_PROCESSING_SLEEP = 1
 
+# the status listener exits when no status has been received for this many seconds
+STATUS_IDLE_TIMEOUT = 7200
+
 queue = Queue()
 QSIZE_OK = False
 
@@ -47,8 +60,8 @@ try:
 except:
     pass
 
-session_source = requests.Session()
-session_target = requests.Session()
+session_source = ProcessLocalSession()
+session_target = ProcessLocalSession()
 
 
 def total_seconds(td):
@@ -137,121 +150,60 @@ class StatusListener(Process):
     def run(self):
         keep_going = True
 
-        org_results = {
-            'name': config.get('org'),
-            'apps': {},
-        }
+        status = StatusAggregator(config.get('org'))
 
-        empty_count = 0
+        status_interval = config.get('status_interval', 10)
+        last_write_time = 0
+        last_update_time = time.time()
 
         while keep_going:
 
             try:
-                app, collection, status_map = self.status_queue.get(timeout=60)
+                app, collection, status_map = self.status_queue.get(timeout=status_interval)
                 status_logger.info('Received status update for app/collection: [%s / %s]' % (app, collection))
-                empty_count = 0
-                org_results['summary'] = {
-                    'max_created': -1,
-                    'max_modified': -1,
-                    'min_created': 1584946416000,
-                    'min_modified': 1584946416000,
-                    'count': 0,
-                    'bytes': 0
-                }
-
-                if app not in org_results['apps']:
-                    org_results['apps'][app] = {
-                        'collections': {}
-                    }
-
-                org_results['apps'][app]['collections'].update(status_map)
-
-                try:
-                    for app, app_data in org_results['apps'].iteritems():
-                        app_data['summary'] = {
-                            'max_created': -1,
-                            'max_modified': -1,
-                            'min_created': 1584946416000,
-                            'min_modified': 1584946416000,
-                            'count': 0,
-                            'bytes': 0
-                        }
-
-                        if 'collections' in app_data:
-                            for collection, collection_data in app_data['collections'].iteritems():
-
-                                app_data['summary']['count'] += collection_data['count']
-                                app_data['summary']['bytes'] += collection_data['bytes']
-
-                                org_results['summary']['count'] += collection_data['count']
-                                org_results['summary']['bytes'] += collection_data['bytes']
-
-                                # APP
-                                if collection_data.get('max_modified') > app_data['summary']['max_modified']:
-                                    app_data['summary']['max_modified'] = collection_data.get('max_modified')
-
-                                if collection_data.get('min_modified') < app_data['summary']['min_modified']:
-                                    app_data['summary']['min_modified'] = collection_data.get('min_modified')
+                last_update_time = time.time()
 
-                                if collection_data.get('max_created') > app_data['summary']['max_created']:
-                                    app_data['summary']['max_created'] = collection_data.get('max_created')
-
-                                if collection_data.get('min_created') < app_data['summary']['min_created']:
-                                    app_data['summary']['min_created'] = collection_data.get('min_created')
-
-                                # ORG
-                                if collection_data.get('max_modified') > org_results['summary']['max_modified']:
-                                    org_results['summary']['max_modified'] = collection_data.get('max_modified')
-
-                                if collection_data.get('min_modified') < org_results['summary']['min_modified']:
-                                    org_results['summary']['min_modified'] = collection_data.get('min_modified')
-
-                                if collection_data.get('max_created') > org_results['summary']['max_created']:
-                                    org_results['summary']['max_created'] = collection_data.get('max_created')
-
-                                if collection_data.get('min_created') < org_results['summary']['min_created']:
-                                    org_results['summary']['min_created'] = collection_data.get('min_created')
-
-                        if QSIZE_OK:
-                            status_logger.warn('CURRENT Queue Depth: %s' % self.worker_queue.qsize())
-
-                        status_logger.warn('UPDATED status of org processed: %s' % json.dumps(org_results))
-
-                except KeyboardInterrupt, e:
-                    raise e
-
-                except:
-                    print traceback.format_exc()
+                status.update(app, status_map)
 
             except KeyboardInterrupt, e:
-                status_logger.warn('FINAL status of org processed: %s' % json.dumps(org_results))
+                status_logger.warn('FINAL status of org processed: %s' % status.to_json())
                 raise e
 
             except Empty:
                 if QSIZE_OK:
                     status_logger.warn('CURRENT Queue Depth: %s' % self.worker_queue.qsize())
 
-                status_logger.warn('CURRENT status of org processed: %s' % json.dumps(org_results))
-
-                status_logger.warning('EMPTY! Count=%s' % empty_count)
+                idle_time = time.time() - last_update_time
 
-                empty_count += 1
+                status_logger.warning('EMPTY! No status received for [%.0f]s' % idle_time)
 
-                if empty_count >= 120:
+                if idle_time >= STATUS_IDLE_TIMEOUT:
                     keep_going = False
 
             except:
                 print traceback.format_exc()
 
-        logger.warn('FINAL status of org processed: %s' % json.dumps(org_results))
+            # the status is logged and written at most once per interval, however often it is updated
+            if status.dirty and time.time() - last_write_time >= status_interval:
+                if QSIZE_OK:
+                    status_logger.warn('CURRENT Queue Depth: %s' % self.worker_queue.qsize())
+
+                status_logger.warn('UPDATED status of org processed: %s' % status.to_json())
+
+                status.dirty = False
+
+                last_write_time = time.time()
+
+        logger.warn('FINAL status of org processed: %s' % status.to_json())
 
 
 class EntityExportWorker(Process):
-    def __init__(self, work_queue, response_queue):
+    def __init__(self, work_queue, response_queue, edge_queue):
         super(EntityExportWorker, self).__init__()
         collection_worker_logger.debug('Creating worker!')
         self.work_queue = work_queue
         self.response_queue = response_queue
+        self.edge_queue = edge_queue
 
     def run(self):
 
@@ -261,6 +213,7 @@ class EntityExportWorker(Process):
         empty_count = 0
         app = 'NOT SET'
         collection_name = 'NOT SET'
+        status_key = 'NOT SET'
         status_map = {}
         entity_file = None
 
@@ -268,21 +221,26 @@ class EntityExportWorker(Process):
             while keep_going:
 
                 try:
-                    app, collection_name = self.work_queue.get(timeout=30)
+                    work_item = self.work_queue.get(timeout=30)
                     empty_count = 0
 
-                    status_map = self.process_collection(app, collection_name)
+                    # work items are (app, collection) or (app, collection, time_slice) for a slice of a collection
+                    app, collection_name = work_item[0], work_item[1]
+                    time_slice = work_item[2] if len(work_item) > 2 else None
+                    status_key = time_slice_label(collection_name, time_slice)
+
+                    status_map = self.process_collection(app, collection_name, time_slice)
 
-                    status_map[collection_name]['iteration_finished'] = str(datetime.datetime.now())
+                    status_map[status_key]['iteration_finished'] = str(datetime.datetime.now())
 
                     collection_worker_logger.warning(
                             'Collection [%s / %s / %s] loop complete!  Max Created entity %s' % (
-                                config.get('org'), app, collection_name, status_map[collection_name]['max_created']))
+                                config.get('org'), app, collection_name, status_map[status_key]['max_created']))
 
                     collection_worker_logger.warning(
-                            'Sending FINAL stats for app/collection [%s / %s]: %s' % (app, collection_name, status_map))
+                            'Sending FINAL stats for app/collection [%s / %s]: %s' % (app, status_key, status_map))
 
-                    self.response_queue.put((app, collection_name, status_map))
+                    self.response_queue.put((app, status_key, status_map))
 
                     collection_worker_logger.info('Done! Finished app/collection: %s / %s' % (app, collection_name))
 
@@ -305,14 +263,20 @@ class EntityExportWorker(Process):
             if entity_file is not None:
                 entity_file.close()
 
-            self.response_queue.put((app, collection_name, status_map))
+            self.response_queue.put((app, status_key, status_map))
+
+            # send the metrics recorded since the last periodic flush, which would be lost on exit
+            metrics.flush()
             collection_worker_logger.info('FINISHED!')
 
-    def process_collection(self, app, collection_name):
+    def process_collection(self, app, collection_name, time_slice=None):
+
+        status_key = time_slice_label(collection_name, time_slice)
 
         status_map = {
-            collection_name: {
+            status_key: {
                 'iteration_started': str(datetime.datetime.now()),
+                'collection': collection_name,
                 'max_created': -1,
                 'max_modified': -1,
                 'min_created': 1584946416000,
@@ -322,124 +286,64 @@ class EntityExportWorker(Process):
             }
         }
 
-        # added a flag for using graph vs query/index
-        if config.get('graph', False):
-            source_collection_url = collection_graph_url_template.format(org=config.get('org'),
-                                                                         app=app,
-                                                                         collection=collection_name,
-                                                                         limit=config.get('limit'),
-                                                                         **config.get('source_endpoint'))
-        else:
-            source_collection_url = collection_query_url_template.format(org=config.get('org'),
-                                                                         app=app,
-                                                                         collection=collection_name,
-                                                                         limit=config.get('limit'),
-                                                                         ql="select * %s" % config.get(
-                                                                                 'ql'),
-                                                                         **config.get('source_endpoint'))
+        if time_slice is not None:
+            status_map[status_key]['time_slice'] = time_slice
+
+        source_collection_url = get_source_collection_url(app, collection_name, time_slice)
         counter = 0
 
-        # use the UsergridQuery from the Python SDK to iterate the collection
-        q = UsergridQueryIterator(source_collection_url,
-                                  page_delay=config.get('page_sleep_time'),
-                                  sleep_time=config.get('error_retry_sleep'))
+        # use the UsergridQuery from the Python SDK (or the prefetching iterator) to iterate the collection
+        q = get_collection_iterator(source_collection_url)
 
-        directory = os.path.join(config['export_path'], ECID, config['org'], app)
+        directory = get_export_directory(app)
 
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+        entity_filename_base = os.path.join(directory,
+                                            '_'.join([collection_name, 'entity-data']) + get_file_suffix(time_slice))
 
-        entity_filename = '_'.join([collection_name, 'entity-data'])
-        entity_filename_base = os.path.join(directory, entity_filename)
-        entity_file_number = 0
-        entity_file_counter = 0
-        entity_filename = '%s-%s.txt' % (entity_filename_base, entity_file_number)
-        entity_file = open(entity_filename, 'w')
+        entity_writer = RollingExportWriter(entity_filename_base, config['entities_per_file'],
+                                            compression=config.get('compression'),
+                                            buffer_size=config.get('write_buffer_size'),
+                                            index=config.get('index'))
 
-        edge_filename = '_'.join([collection_name, 'edge-data'])
-        edge_filename_base = os.path.join(directory, edge_filename)
-        edge_file_number = 0
-        edge_file_counter = 0
-        edge_filename = '%s-%s.txt' % (edge_filename_base, edge_file_number)
-        edge_file = open(edge_filename, 'w')
+        manifest_filename = get_manifest_filename(app, collection_name, time_slice)
+        complete = False
 
         try:
 
             for entity in q:
                 try:
-                    entity_file_counter += 1
                     counter += 1
 
-                    if entity_file_counter > config['entities_per_file']:
-                        entity_file.close()
-                        entity_file_number += 1
-                        entity_file_counter = 0
-                        entity_filename = '%s-%s.txt' % (entity_filename_base, entity_file_number)
-                        entity_file = open(entity_filename, 'w')
-
-                    entity_file.write('%s\n' % json.dumps(entity))
-
-                    edge_names = get_edge_names(entity)
+                    # the line written to the file is also used for the size of the entity
+                    entity_json = json.dumps(entity)
 
-                    for edge_name in edge_names:
-                        if not include_edge(collection_name, edge_name):
-                            continue
+                    entity_writer.write(entity_json, entity)
 
-                        connection_query_url = connection_query_url_template.format(
-                                org=config.get('org'),
-                                app=app,
-                                verb=edge_name,
-                                collection=collection_name,
-                                uuid=entity.get('uuid'),
-                                limit=config.get('limit'),
-                                **config.get('source_endpoint'))
+                    edge_names = [edge_name for edge_name in get_edge_names(entity)
+                                  if include_edge(collection_name, edge_name)]
 
-                        connection_query = UsergridQueryIterator(connection_query_url,
-                                                                 sleep_time=config.get('error_retry_sleep'))
-
-                        target_uuids = []
+                    # the edges are queried by the edge workers so that the scan is not held up by them
+                    if len(edge_names) > 0:
+                        entity_ref = {
+                            'type': entity.get('type'),
+                            'uuid': entity.get('uuid')
+                        }
 
-                        try:
-                            for target_entity in connection_query:
-                                target_uuids.append(target_entity.get('uuid'))
-                        except:
-                            logger.exception('Error processing edge [%s] of entity [ %s / %s / %s]' % (
-                                edge_name, app, collection_name, entity.get('uuid')))
-
-                        if len(target_uuids) > 0:
-                            edge_file_counter += 1
-
-                            edges = {
-                                'entity': {
-                                    'type': entity.get('type'),
-                                    'uuid': entity.get('uuid')
-                                },
-                                'edge_name': edge_name,
-                                'target_uuids': target_uuids
-                            }
-
-                            if entity_file_counter > config['entities_per_file']:
-                                edge_file.close()
-                                edge_file_number += 1
-                                edge_file_counter = 0
-                                edge_filename = '%s-%s.txt' % (edge_filename_base, edge_file_number)
-                                edge_file = open(edge_filename, 'w')
-
-                            edge_file.write('%s\n' % json.dumps(edges))
+                        self.edge_queue.put((app, collection_name, time_slice, entity_ref, edge_names))
 
                     if 'created' in entity:
 
                         try:
                             entity_created = long(entity.get('created'))
 
-                            if entity_created > status_map[collection_name]['max_created']:
-                                status_map[collection_name]['max_created'] = entity_created
-                                status_map[collection_name]['max_created_str'] = str(
+                            if entity_created > status_map[status_key]['max_created']:
+                                status_map[status_key]['max_created'] = entity_created
+                                status_map[status_key]['max_created_str'] = str(
                                         datetime.datetime.fromtimestamp(entity_created / 1000))
 
-                            if entity_created < status_map[collection_name]['min_created']:
-                                status_map[collection_name]['min_created'] = entity_created
-                                status_map[collection_name]['min_created_str'] = str(
+                            if entity_created < status_map[status_key]['min_created']:
+                                status_map[status_key]['min_created'] = entity_created
+                                status_map[status_key]['min_created_str'] = str(
                                         datetime.datetime.fromtimestamp(entity_created / 1000))
 
                         except ValueError:
@@ -450,21 +354,24 @@ class EntityExportWorker(Process):
                         try:
                             entity_modified = long(entity.get('modified'))
 
-                            if entity_modified > status_map[collection_name]['max_modified']:
-                                status_map[collection_name]['max_modified'] = entity_modified
-                                status_map[collection_name]['max_modified_str'] = str(
+                            if entity_modified > status_map[status_key]['max_modified']:
+                                status_map[status_key]['max_modified'] = entity_modified
+                                status_map[status_key]['max_modified_str'] = str(
                                         datetime.datetime.fromtimestamp(entity_modified / 1000))
 
-                            if entity_modified < status_map[collection_name]['min_modified']:
-                                status_map[collection_name]['min_modified'] = entity_modified
-                                status_map[collection_name]['min_modified_str'] = str(
+                            if entity_modified < status_map[status_key]['min_modified']:
+                                status_map[status_key]['min_modified'] = entity_modified
+                                status_map[status_key]['min_modified_str'] = str(
                                         datetime.datetime.fromtimestamp(entity_modified / 1000))
 
                         except ValueError:
                             pass
 
-                    status_map[collection_name]['bytes'] += count_bytes(entity)
-                    status_map[collection_name]['count'] += 1
+                    status_map[status_key]['bytes'] += len(entity_json)
+
+                    metrics.inc('usergrid_entities_scanned_total', app=app, collection=collection_name)
+                    metrics.inc('usergrid_entity_bytes_total', len(entity_json), app=app, collection=collection_name)
+                    status_map[status_key]['count'] += 1
 
                     if counter % 1000 == 1:
                         try:
@@ -472,7 +379,7 @@ class EntityExportWorker(Process):
                                     'Sending incremental stats for app/collection [%s / %s]: %s' % (
                                         app, collection_name, status_map))
 
-                            self.response_queue.put((app, collection_name, status_map))
+                            self.response_queue.put((app, status_key, status_map))
 
                             if QSIZE_OK:
                                 collection_worker_logger.info(
@@ -490,6 +397,8 @@ class EntityExportWorker(Process):
                     logger.exception(
                             'Error processing entity %s / %s / %s' % (app, collection_name, entity.get('uuid')))
 
+            complete = True
+
         except KeyboardInterrupt:
             raise
 
@@ -497,15 +406,289 @@ class EntityExportWorker(Process):
             logger.exception('Error processing collection %s / %s ' % (app, collection_name))
 
         finally:
-            if edge_file is not None:
-                edge_file.close()
+            # stops the background page requests of a scan which failed
+            q.close()
+
+            # a file which was being written when the collection failed is left with a .partial name
+            entity_files = entity_writer.close(complete)
+
+            # the edge files are added to the manifest by merge_edge_manifests once the edge workers are done
+            edge_files = []
+
+            manifest = {
+                'org': config.get('org'),
+                'app': app,
+                'collection': collection_name,
+                'time_slice': time_slice,
+                'compression': config.get('compression'),
+                'complete': complete,
+                'iteration_started': status_map[status_key]['iteration_started'],
+                'iteration_finished': str(datetime.datetime.now()),
+                'entities': summarize_files(entity_files),
+                'edges': summarize_files(edge_files),
+                'entity_files': entity_files,
+                'edge_files': edge_files
+            }
 
-            if entity_file is not None:
-                entity_file.close()
+            write_manifest(manifest_filename, manifest)
+
+            status_map[status_key]['manifest'] = manifest_filename
 
         return status_map
 
 
+class EdgeExportWorker(Process):
+    """
+    Queries the edges of the entities published by the entity export workers and writes them to edge files of its own,
+    named <collection>_edge-data[-sliceN]-w<worker>-N.  Runs until it receives None from the edge queue, then writes a
+    partial manifest of its edge files next to the manifest of each collection.
+
+    At most --max_open_edge_files edge files are open at a time.  When a worker has more, the file of the least
+    recently written collection is closed, and that collection continues with a new file if more of its edges arrive.
+    """
+
+    def __init__(self, edge_queue, worker_index):
+        super(EdgeExportWorker, self).__init__()
+        self.edge_queue = edge_queue
+        self.worker_index = worker_index
+
+    def run(self):
+        worker_logger.info('starting run()...')
+
+        # (app, collection_name, file_suffix) -> (writer, manifest_filename)
+        writers = {}
+
+        # the keys of the writers with an open file, least recently written first
+        open_writers = OrderedDict()
+        count_entities = 0
+        count_edges = 0
+        complete = False
+
+        try:
+            while True:
+                try:
+                    work_item = self.edge_queue.get(timeout=30)
+
+                except Empty:
+                    worker_logger.info('EMPTY! Waiting for edges...')
+                    continue
+
+                if work_item is None:
+                    break
+
+                app, collection_name, time_slice, entity_ref, edge_names = work_item
+                writer = self.get_writer(writers, open_writers, app, collection_name, time_slice)
+                count_entities += 1
+
+                for edge_name in edge_names:
+                    target_uuids = get_edge_target_uuids(app, collection_name, entity_ref, edge_name)
+
+                    if len(target_uuids) > 0:
+                        count_edges += len(target_uuids)
+
+                        metrics.inc('usergrid_edges_exported_total', len(target_uuids), app=app,
+                                    collection=collection_name)
+
+                        writer.write(json.dumps({
+                            'entity': entity_ref,
+                            'edge_name': edge_name,
+                            'target_uuids': target_uuids
+                        }), entity_ref)
+
+                if count_entities % 1000 == 1:
+                    worker_logger.info('Exported edges of [%s] entities, [%s] edges' % (count_entities, count_edges))
+
+            complete = True
+
+        finally:
+            for writer, manifest_filename in writers.values():
+                write_manifest('%s.edges-w%s' % (manifest_filename, self.worker_index), {
+                    'edge_files': writer.close(complete)
+                })
+
+            # send the metrics recorded since the last periodic flush, which would be lost on exit
+            metrics.flush()
+            worker_logger.info('FINISHED! Exported edges of [%s] entities, [%s] edges' % (count_entities, count_edges))
+
+    def get_writer(self, writers, open_writers, app, collection_name, time_slice):
+        key = (app, collection_name, get_file_suffix(time_slice))
+
+        if key in open_writers:
+            del open_writers[key]
+
+        open_writers[key] = True
+
+        while len(open_writers) > max(config.get('max_open_edge_files'), 1):
+            closed_key, _ = open_writers.popitem(last=False)
+
+            # the writer keeps the stats of its files and numbers the next one on, so it can be written again later
+            writers[closed_key][0].close()
+
+        if key not in writers:
+            edge_filename_base = os.path.join(get_export_directory(app), '%s_edge-data%s-w%s' % (
+                collection_name, get_file_suffix(time_slice), self.worker_index))
+
+            writer = RollingExportWriter(edge_filename_base, config['entities_per_file'],
+                                         compression=config.get('compression'),
+                                         buffer_size=config.get('write_buffer_size'),
+                                         index=config.get('index'))
+
+            writers[key] = (writer, get_manifest_filename(app, collection_name, time_slice))
+
+        return writers[key][0]
+
+
+def get_edge_target_uuids(app, collection_name, entity_ref, edge_name):
+    connection_query_url = connection_query_url_template.format(
+            org=config.get('org'),
+            app=app,
+            verb=edge_name,
+            collection=collection_name,
+            uuid=entity_ref.get('uuid'),
+            limit=config.get('limit'),
+            **config.get('source_endpoint'))
+
+    connection_query = get_query_iterator(connection_query_url)
+
+    target_uuids = []
+
+    try:
+        for target_entity in connection_query:
+            target_uuids.append(target_entity.get('uuid'))
+    except:
+        logger.exception('Error processing edge [%s] of entity [ %s / %s / %s]' % (
+            edge_name, app, collection_name, entity_ref.get('uuid')))
+
+    return target_uuids
+
+
+def get_export_directory(app):
+    directory = os.path.join(config['export_path'], ECID, config['org'], app)
+
+    # several workers may create the directory at the same time
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+
+    return directory
+
+
+def get_file_suffix(time_slice):
+    # each time slice of a collection writes its own files
+    return '' if time_slice is None else '-slice%s' % (time_slice.get('index') + 1)
+
+
+def get_manifest_filename(app, collection_name, time_slice):
+    return os.path.join(get_export_directory(app),
+                        '_'.join([collection_name, 'manifest']) + get_file_suffix(time_slice) + '.json')
+
+
+def merge_edge_manifests(export_directory):
+    """
+    Adds the edge files recorded in the partial manifests of the edge workers to the manifest of each collection
+    """
+    partials = {}
+
+    for root, dirs, files in os.walk(export_directory):
+        for name in files:
+            if '.edges-w' in name and not name.endswith('.tmp'):
+                partial_filename = os.path.join(root, name)
+                manifest_filename = partial_filename[:partial_filename.rindex('.edges-w')]
+                partials.setdefault(manifest_filename, []).append(partial_filename)
+
+    for manifest_filename, partial_filenames in partials.iteritems():
+        if os.path.exists(manifest_filename):
+            manifest = read_manifest(manifest_filename)
+        else:
+            logger.warning('Manifest [%s] not found, writing one with only the edge files' % manifest_filename)
+            manifest = {'complete': False, 'entity_files': [], 'entities': summarize_files([])}
+
+        edge_files = manifest.get('edge_files', [])
+
+        for partial_filename in sorted(partial_filenames):
+            edge_files += read_manifest(partial_filename).get('edge_files', [])
+
+        manifest['edge_files'] = edge_files
+        manifest['edges'] = summarize_files(edge_files)
+
+        write_manifest(manifest_filename, manifest)
+
+        for partial_filename in partial_filenames:
+            os.remove(partial_filename)
+
+    logger.info('Merged the edge files of [%s] manifests' % len(partials))
+
+
+def get_source_collection_url(app, collection_name, time_slice=None):
+    # added a flag for using graph vs query/index
+    if config.get('graph', False):
+        return collection_graph_url_template.format(org=config.get('org'),
+                                                    app=app,
+                                                    collection=collection_name,
+                                                    limit=config.get('limit'),
+                                                    **config.get('source_endpoint'))
+
+    if time_slice is not None:
+        ql = scan_ql(config.get('ql'), [time_slice_predicate(time_slice)], time_slice.get('field'))
+    else:
+        ql = "select * %s" % config.get('ql')
+
+    return collection_query_url_template.format(org=config.get('org'),
+                                                app=app,
+                                                collection=collection_name,
+                                                limit=config.get('limit'),
+                                                ql=ql,
+                                                **config.get('source_endpoint'))
+
+
+def get_collection_slices(app, collection_name):
+    """
+    Splits a collection into --collection_slices ranges of the --slice_field timestamp so that each range can be
+    scanned by a different collection worker.  The ranges are sized from the min/max of the field in the collection.
+
+    :return: an array of time slices, empty if the collection should be scanned as a whole
+    """
+    if config.get('collection_slices', 1) <= 1 or config.get('graph', False):
+        return []
+
+    field = config.get('slice_field')
+
+    def build_query_url(ql):
+        return collection_query_url_template.format(org=config.get('org'),
+                                                    app=app,
+                                                    collection=collection_name,
+                                                    limit=1,
+                                                    ql=ql,
+                                                    **config.get('source_endpoint'))
+
+    min_value, max_value = get_field_range(session_source, build_query_url, field)
+
+    time_slices = build_time_slices(min_value, max_value, config.get('collection_slices'), field)
+
+    logger.info('Split collection [%s / %s] into [%s] slices by [%s] from [%s] to [%s]' % (
+        app, collection_name, len(time_slices), field, min_value, max_value))
+
+    return time_slices
+
+
+def get_query_iterator(query_url, page_delay=0, read_ahead=0):
+    return PrefetchingQueryIterator(query_url,
+                                    page_delay=page_delay,
+                                    sleep_time=config.get('error_retry_sleep'),
+                                    read_ahead=read_ahead,
+                                    max_attempts=config.get('page_max_attempts') or None,
+                                    session=session_source)
+
+
+def get_collection_iterator(source_collection_url):
+    # prefetch pages in the background when read-ahead is configured
+    return get_query_iterator(source_collection_url,
+                              page_delay=config.get('page_sleep_time'),
+                              read_ahead=config.get('read_ahead', 0))
+
+
 def use_name_for_collection(collection_name):
     return collection_name in config.get('use_name_for_collection', [])
 
@@ -648,16 +831,65 @@ def parse_args():
                         type=int,
                         default=10000)
 
+    parser.add_argument('--compression',
+                        help='The compression to apply to the export files as they are written. zstd requires the '
+                             'zstandard package',
+                        choices=COMPRESSIONS,
+                        default='none')
+
+    parser.add_argument('--write_buffer_size',
+                        help='The number of bytes buffered in memory for each export file before writing to disk',
+                        type=int,
+                        default=1024 * 1024)
+
+    parser.add_argument('--index',
+                        help='Write a sidecar .idx index of each export file which maps the uuid and name of each '
+                             'entity to the byte range of its record, for lookups with usergrid_export_lookup. Requires '
+                             '--compression none',
+                        action='store_true')
+
     parser.add_argument('--error_retry_sleep',
                         help='The number of seconds to wait between retrieving after an error',
                         type=float,
                         default=30)
 
+    parser.add_argument('--page_max_attempts',
+                        help='The maximum number of attempts to retrieve a page of a query before the scan fails.  '
+                             'Client (4xx) errors then fail the scan without retrying.  By default, 0, every error is '
+                             'retried indefinitely',
+                        type=int,
+                        default=0)
+
     parser.add_argument('--page_sleep_time',
                         help='The number of seconds to wait between retrieving pages from the UsergridQueryIterator',
                         type=float,
                         default=.5)
 
+    parser.add_argument('--http_pool_size',
+                        help='The number of HTTP connections each worker process keeps open to each host',
+                        type=int,
+                        default=10)
+
+    parser.add_argument('--disable_keep_alive',
+                        help='Open a new HTTP connection for every request instead of reusing pooled connections',
+                        action='store_true')
+
+    parser.add_argument('--disable_gzip',
+                        help='Do not request gzip compressed HTTP responses',
+                        action='store_true')
+
+    parser.add_argument('--metrics_port',
+                        help='Serve live metrics of all of the worker processes in the Prometheus text format at '
+                             'http://<host>:<port>/metrics, 0 to disable',
+                        type=int,
+                        default=0)
+
+    parser.add_argument('--read_ahead',
+                        help='The number of collection pages to request in the background while the current page is '
+                             'processed, 0 to request each page after the previous one is processed',
+                        type=int,
+                        default=0)
+
     parser.add_argument('--entity_sleep_time',
                         help='The number of seconds to wait between retrieving pages from the UsergridQueryIterator',
                         type=float,
@@ -669,6 +901,36 @@ def parse_args():
                         type=int,
                         default=4)
 
+    parser.add_argument('--edge_workers',
+                        help='The number of worker processes which query and write the edges of the exported entities',
+                        type=int,
+                        default=4)
+
+    parser.add_argument('--edge_queue_size',
+                        help='The maximum number of entities waiting for their edges to be exported before the '
+                             'collection scans pause',
+                        type=int,
+                        default=100000)
+
+    parser.add_argument('--max_open_edge_files',
+                        help='The maximum number of edge files each edge worker keeps open.  The file of the least '
+                             'recently written collection is closed when a worker has more',
+                        type=int,
+                        default=64)
+
+    parser.add_argument('--collection_slices',
+                        help='The number of time ranges to split each collection into so that the ranges can be '
+                             'exported in parallel by the workers, 1 to export each collection as a whole.  Each '
+                             'range is scanned with a QL filter on --slice_field which is added to the where clause of --ql',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--slice_field',
+                        help='The timestamp field used to split collections into time ranges',
+                        type=str,
+                        choices=['created', 'modified'],
+                        default='created')
+
     parser.add_argument('--queue_size_max',
                         help='The max size of entities to allow in the queue',
                         type=int,
@@ -680,6 +942,11 @@ def parse_args():
                         default='select * order by created asc')
     # default='select * order by created asc')
 
+    parser.add_argument('--status_interval',
+                        help='The minimum number of seconds between writes of the status of the org to the log',
+                        type=float,
+                        default=10)
+
     parser.add_argument('--nohup',
                         help='specifies not to use stdout for logging',
                         action='store_true')
@@ -710,6 +977,41 @@ def init():
     config['source_endpoint'] = config['source_config'].get('endpoint').copy()
     config['source_endpoint'].update(config['source_config']['credentials'][config['org']])
 
+    check_compression(config.get('compression'))
+
+    if not config.get('graph', False):
+        try:
+            parse_ql(config.get('ql'))
+
+        except ValueError, e:
+            message = 'ABORT: %s' % e
+            print message
+            logger.critical(message)
+            exit()
+
+        if config.get('collection_slices', 1) > 1 and not is_scan_order(config.get('ql'), config.get('slice_field')):
+            message = 'ABORT: --collection_slices orders each scan by %s, which conflicts with the order by clause ' \
+                      'of --ql' % config.get('slice_field')
+            print message
+            logger.critical(message)
+            exit()
+
+    if config.get('index') and config.get('compression') != 'none':
+        message = 'ABORT: --index requires --compression none since compressed files can not be read at an offset'
+        print message
+        logger.critical(message)
+        exit()
+
+    init_sessions()
+
+
+def init_sessions():
+    # sessions are created on first use in each process, so this only sets the options they are created with
+    for session in [session_source, session_target]:
+        session.configure(pool_size=config.get('http_pool_size', DEFAULT_POOL_SIZE),
+                          keep_alive=not config.get('disable_keep_alive', False),
+                          gzip=not config.get('disable_gzip', False))
+
 
 def wait_for(threads, label, sleep_time=60):
     wait = True
@@ -734,17 +1036,6 @@ def wait_for(threads, label, sleep_time=60):
     logger.warn('All workers [%s] done!' % label)
 
 
-def count_bytes(entity):
-    entity_copy = entity.copy()
-
-    if 'metadata' in entity_copy:
-        del entity_copy['metadata']
-
-    entity_str = json.dumps(entity_copy)
-
-    return len(entity_str)
-
-
 def check_response_status(r, url, exit_on_error=True):
     if r.status_code != 200:
         logger.critical('HTTP [%s] on URL=[%s]' % (r.status_code, url))
@@ -755,12 +1046,26 @@ def check_response_status(r, url, exit_on_error=True):
 
 
 def main():
-    global config
+    global config, session_source
 
     config = parse_args()
     init()
     init_logging()
 
+    metrics_aggregator = None
+
+    # the metrics queue is created before the workers are started so that they all send their metrics to it
+    if config.get('metrics_port', 0) > 0:
+        metrics_queue = Queue()
+        metrics.configure(metrics_queue)
+
+        metrics_aggregator = MetricsAggregator(metrics_queue)
+        metrics_aggregator.start()
+
+        start_metrics_server(config.get('metrics_port'), metrics_aggregator)
+
+        session_source = InstrumentedSession(session_source, 'source')
+
     status_map = {}
 
     org_apps = {
@@ -797,9 +1102,15 @@ def main():
     if _platform == "linux" or _platform == "linux2":
         collection_queue = Queue(maxsize=config.get('queue_size_max'))
         collection_response_queue = Queue(maxsize=config.get('queue_size_max'))
+        edge_queue = Queue(maxsize=config.get('edge_queue_size'))
     else:
         collection_queue = Queue()
         collection_response_queue = Queue()
+        edge_queue = Queue()
+
+    if metrics_aggregator is not None:
+        metrics_aggregator.add_gauge('usergrid_queue_depth', lambda: collection_queue.qsize(), queue='collection')
+        metrics_aggregator.add_gauge('usergrid_queue_depth', lambda: edge_queue.qsize(), queue='edge')
 
     logger.info('Starting entity_workers...')
 
@@ -807,10 +1118,14 @@ def main():
     status_listener.start()
 
     # start the worker processes which will iterate the collections
-    collection_workers = [EntityExportWorker(collection_queue, collection_response_queue) for x in
+    collection_workers = [EntityExportWorker(collection_queue, collection_response_queue, edge_queue) for x in
                           xrange(config.get('collection_workers'))]
     [w.start() for w in collection_workers]
 
+    # start the worker processes which will export the edges of the entities
+    edge_workers = [EdgeExportWorker(edge_queue, x) for x in xrange(max(config.get('edge_workers'), 1))]
+    [w.start() for w in edge_workers]
+
     try:
         apps_to_process = config.get('app')
         collections_to_process = config.get('collection')
@@ -892,9 +1207,18 @@ def main():
 
                         continue
 
-                    logger.info('Publishing app / collection: %s / %s' % (app, collection_name))
+                    time_slices = get_collection_slices(app, collection_name)
+
+                    if len(time_slices) == 0:
+                        logger.info('Publishing app / collection: %s / %s' % (app, collection_name))
 
-                    collection_queue.put((app, collection_name))
+                        collection_queue.put((app, collection_name))
+
+                    for time_slice in time_slices:
+                        logger.info('Publishing app / collection / slice: %s / %s / %s' % (
+                            app, collection_name, time_slice_label(collection_name, time_slice)))
+
+                        collection_queue.put((app, collection_name, time_slice))
 
             status_map[app]['iteration_finished'] = str(datetime.datetime.now())
 
@@ -903,6 +1227,13 @@ def main():
         # allow collection workers to finish
         wait_for(collection_workers, label='collection_workers', sleep_time=30)
 
+        # no more edges will be published, stop each edge worker once the queue has been drained
+        [edge_queue.put(None) for w in edge_workers]
+
+        wait_for(edge_workers, label='edge_workers', sleep_time=30)
+
+        merge_edge_manifests(os.path.join(config['export_path'], ECID))
+
         status_listener.terminate()
 
     except KeyboardInterrupt:
@@ -911,9 +1242,11 @@ def main():
         collection_response_queue.close()
 
         [os.kill(super(EntityExportWorker, p).pid, signal.SIGINT) for p in collection_workers]
+        [os.kill(super(EdgeExportWorker, p).pid, signal.SIGINT) for p in edge_workers]
         os.kill(super(StatusListener, status_listener).pid, signal.SIGINT)
 
         [w.terminate() for w in collection_workers]
+        [w.terminate() for w in edge_workers]
         status_listener.terminate()
 
     logger.info('entity_workers DONE!')
@@ -0,0 +1,697 @@
+import os
+import uuid
+from Queue import Empty
+import argparse
+import json
+import logging
+import sys
+from multiprocessing import Queue, Process
+
+import datetime
+from cloghandler import ConcurrentRotatingFileHandler
+import traceback
+import time
+
+import signal
+
+import urllib3
+
+from usergrid_tools.general.http_client import ProcessLocalSession, DEFAULT_POOL_SIZE
+from usergrid_tools.migration.export_files import ENTITY_FILES, EDGE_FILES, find_collection_files, read_records
+from usergrid_tools.migration.failure_journal import KIND_ENTITY, KIND_EDGE, failure_record, FailureJournalWriter
+from usergrid_tools.migration.retry_queue import get_backoff
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+ECID = str(uuid.uuid1())
+
+logger = logging.getLogger('DataLoader')
+worker_logger = logging.getLogger('LoaderWorker')
+
+urllib3.disable_warnings()
+
+KIND_ENTITY_FILE = ENTITY_FILES
+KIND_EDGE_FILE = EDGE_FILES
+
+session_target = ProcessLocalSession()
+
+failure_journal = None
+
+config = {}
+
+# URL Templates for Usergrid
+collection_url_template = "{api_url}/{org}/{app}/{collection}?client_id={client_id}&client_secret={client_secret}"
+put_entity_url_template = "{api_url}/{org}/{app}/{collection}/{uuid}?client_id={client_id}&client_secret={client_secret}"
+connection_create_by_uuid_url_template = "{api_url}/{org}/{app}/{collection}/{uuid}/{verb}/{target_uuid}?client_id={client_id}&client_secret={client_secret}"
+
+
+def init_logging(stdout_enabled=True):
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.getLevelName(config.get('log_level', 'INFO')))
+
+    logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(logging.ERROR)
+    logging.getLogger('urllib3.connectionpool').setLevel(logging.WARN)
+
+    log_formatter = logging.Formatter(
+            fmt='%(asctime)s | ' + ECID + ' | %(name)s | %(processName)s | %(levelname)s | %(message)s',
+            datefmt='%m/%d/%Y %I:%M:%S %p')
+
+    if stdout_enabled:
+        stdout_logger = logging.StreamHandler(sys.stdout)
+        stdout_logger.setFormatter(log_formatter)
+        stdout_logger.setLevel(logging.getLevelName(config.get('log_level', 'INFO')))
+        root_logger.addHandler(stdout_logger)
+
+    log_file_name = os.path.join(config.get('log_dir'), '%s-load-%s-loader.log' % (config.get('org'), ECID))
+
+    rotating_file = ConcurrentRotatingFileHandler(filename=log_file_name,
+                                                  mode='a',
+                                                  maxBytes=404857600,
+                                                  backupCount=0)
+    rotating_file.setFormatter(log_formatter)
+    rotating_file.setLevel(logging.INFO)
+
+    root_logger.addHandler(rotating_file)
+
+    error_log_file_name = os.path.join(config.get('log_dir'), '%s-load-%s-loader-errors.log' % (config.get('org'), ECID))
+
+    error_rotating_file = ConcurrentRotatingFileHandler(filename=error_log_file_name,
+                                                        mode='a',
+                                                        maxBytes=404857600,
+                                                        backupCount=0)
+    error_rotating_file.setFormatter(log_formatter)
+    error_rotating_file.setLevel(logging.ERROR)
+
+    root_logger.addHandler(error_rotating_file)
+
+
+class LoaderWorker(Process):
+    """
+    Loads the export files published to the work queue until it receives None.  Work items are (kind, app, collection,
+    file name) where kind is KIND_ENTITY_FILE or KIND_EDGE_FILE, and the stats of each file are sent to the response
+    queue once it has been loaded.
+    """
+
+    def __init__(self, work_queue, response_queue):
+        super(LoaderWorker, self).__init__()
+        self.work_queue = work_queue
+        self.response_queue = response_queue
+
+    def run(self):
+        worker_logger.info('starting run()...')
+
+        while True:
+            try:
+                work_item = self.work_queue.get(timeout=30)
+
+            except Empty:
+                worker_logger.info('EMPTY! Waiting for files...')
+                continue
+
+            if work_item is None:
+                break
+
+            kind, app, collection_name, file_name = work_item
+            start_time = datetime.datetime.now()
+
+            try:
+                if kind == KIND_ENTITY_FILE:
+                    stats = load_entity_file(app, collection_name, file_name)
+                else:
+                    stats = load_edge_file(app, collection_name, file_name)
+
+            except KeyboardInterrupt:
+                raise
+
+            except Exception:
+                logger.exception('Error loading file [%s]' % file_name)
+                stats = {'error': traceback.format_exc()}
+
+            stats['elapsed_seconds'] = total_seconds(datetime.datetime.now() - start_time)
+
+            worker_logger.warning('Loaded [%s] file [%s]: %s' % (kind, file_name, json.dumps(stats)))
+
+            self.response_queue.put((kind, app, collection_name, file_name, stats))
+
+        worker_logger.info('FINISHED!')
+
+
+def total_seconds(td):
+    return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10 ** 6) / 10 ** 6
+
+
+def get_target_mapping(app, collection_name):
+    target_org = config.get('org_mapping', {}).get(config.get('org'), config.get('org'))
+    target_app = config.get('app_mapping', {}).get(app, app)
+    target_collection = config.get('collection_mapping', {}).get(collection_name, collection_name)
+    return target_app, target_collection, target_org
+
+
+def write_failure(kind, operation, app, collection_name, source_entity, reason, **extra):
+    if failure_journal is None:
+        return
+
+    try:
+        failure_journal.write(failure_record(kind, operation, config.get('org'), app, collection_name, source_entity,
+                                             reason, **extra))
+
+    except:
+        logger.exception('Error writing failure of [%s] on entity [%s / %s / %s] to the journal' % (
+            operation, app, collection_name, source_entity.get('uuid')))
+
+
+def request_with_retry(method, url, data=None):
+    """
+    Makes a request to the target, retrying connection errors and 5xx responses with an exponential backoff up to
+    --max_attempts times
+
+    :return: the last response, or None if the last attempt failed without a response
+    """
+    attempts = 0
+    r = None
+
+    while attempts < config.get('max_attempts'):
+        attempts += 1
+
+        try:
+            r = session_target.request(method, url, data=data)
+
+            if r.status_code < 500:
+                return r
+
+            message = 'HTTP [%s]: %s' % (r.status_code, r.text)
+
+        except KeyboardInterrupt:
+            raise
+
+        except Exception, e:
+            r = None
+            message = str(e)
+
+        if attempts < config.get('max_attempts'):
+            backoff = get_backoff(attempts, config.get('retry_backoff_base'), config.get('retry_backoff_max'))
+
+            logger.warning('FAILED %s (will retry in [%.1f]s) on URL=[%s]: %s' % (method, backoff, url, message))
+            time.sleep(backoff)
+
+    return r
+
+
+def response_reason(r):
+    if r is None:
+        return 'no response after [%s] attempts' % config.get('max_attempts')
+
+    return 'HTTP [%s]: %s' % (r.status_code, r.text)
+
+
+def load_entity_file(app, collection_name, file_name):
+    stats = {
+        'count': 0,
+        'loaded': 0,
+        'failed': 0
+    }
+
+    batch = []
+
+    for entity in read_records(file_name):
+        stats['count'] += 1
+        batch.append(entity)
+
+        if len(batch) >= config.get('batch_size'):
+            load_entity_batch(app, collection_name, batch, stats)
+            batch = []
+
+    if len(batch) > 0:
+        load_entity_batch(app, collection_name, batch, stats)
+
+    return stats
+
+
+def load_entity_batch(app, collection_name, source_entities, stats):
+    """
+    Writes a batch of entities to the target with a single POST of an entity array.  Any entity which is not confirmed
+    in the response of the bulk write is written again with a PUT of its own.  Users, roles and groups are always
+    written with a PUT of their own, as the migrator does.
+    """
+    target_app, target_collection, target_org = get_target_mapping(app, collection_name)
+
+    entity_copies = []
+
+    for source_entity in source_entities:
+        entity_copy = source_entity.copy()
+
+        if 'metadata' in entity_copy:
+            entity_copy.pop('metadata')
+
+        entity_copies.append(entity_copy)
+
+    written_uuids = set()
+
+    # users, roles and groups need confirmation, credentials or permissions per entity
+    if len(entity_copies) > 1 and collection_name not in ['users', 'user', 'roles', 'role', 'groups', 'group']:
+        target_collection_url = collection_url_template.format(org=target_org,
+                                                               app=target_app,
+                                                               collection=target_collection,
+                                                               **config.get('target_endpoint'))
+
+        r = request_with_retry('POST', target_collection_url, data=json.dumps(entity_copies))
+
+        if r is not None and r.status_code == 200:
+            written_uuids = set([e.get('uuid') for e in r.json().get('entities', [])])
+        else:
+            logger.warning('Failure on bulk POST of [%s] entities to url=[%s], falling back to PUT: %s' % (
+                len(entity_copies), target_collection_url, response_reason(r)))
+
+    for entity_copy in entity_copies:
+        if entity_copy.get('uuid') in written_uuids or load_entity(app, collection_name, entity_copy):
+            stats['loaded'] += 1
+        else:
+            stats['failed'] += 1
+
+
+def load_entity(app, collection_name, entity):
+    target_app, target_collection, target_org = get_target_mapping(app, collection_name)
+
+    target_entity_url = put_entity_url_template.format(org=target_org,
+                                                       app=target_app,
+                                                       collection=target_collection,
+                                                       uuid=entity.get('uuid'),
+                                                       **config.get('target_endpoint'))
+
+    r = request_with_retry('PUT', target_entity_url, data=json.dumps(entity))
+
+    if r is not None and r.status_code == 200:
+        return True
+
+    logger.critical('FAILED to PUT entity [%s / %s / %s] at URL=[%s]: %s' % (
+        app, collection_name, entity.get('uuid'), target_entity_url, response_reason(r)))
+
+    write_failure(KIND_ENTITY, 'load_entity', app, collection_name, entity, response_reason(r))
+
+    return False
+
+
+def load_edge_file(app, collection_name, file_name):
+    stats = {
+        'count': 0,
+        'created': 0,
+        'failed': 0,
+        'skipped': 0
+    }
+
+    for record in read_records(file_name):
+        entity = record.get('entity', {})
+        edge_name = record.get('edge_name')
+
+        if not include_edge(collection_name, edge_name):
+            stats['skipped'] += len(record.get('target_uuids', []))
+            continue
+
+        for target_uuid in record.get('target_uuids', []):
+            stats['count'] += 1
+
+            if create_connection(app, collection_name, entity, edge_name, target_uuid):
+                stats['created'] += 1
+            else:
+                stats['failed'] += 1
+
+    return stats
+
+
+def create_connection(app, collection_name, entity, edge_name, target_uuid):
+    target_app, target_collection, target_org = get_target_mapping(app, collection_name)
+
+    create_connection_url = connection_create_by_uuid_url_template.format(org=target_org,
+                                                                          app=target_app,
+                                                                          collection=target_collection,
+                                                                          uuid=entity.get('uuid'),
+                                                                          verb=edge_name,
+                                                                          target_uuid=target_uuid,
+                                                                          **config.get('target_endpoint'))
+
+    r = request_with_retry('POST', create_connection_url)
+
+    if r is not None and r.status_code == 200:
+        return True
+
+    logger.critical('FAILED to create connection [%s / %s / %s] --[%s]--> [%s] at URL=[%s]: %s' % (
+        app, collection_name, entity.get('uuid'), edge_name, target_uuid, create_connection_url, response_reason(r)))
+
+    write_failure(KIND_EDGE, 'create_connection', app, collection_name, entity, response_reason(r),
+                  edge_name=edge_name, target_entity={'uuid': target_uuid})
+
+    return False
+
+
+def include_collection(collection_name):
+    if collection_name in config.get('exclude_collection', []):
+        return False
+
+    collections = config.get('collection', [])
+
+    return len(collections) == 0 or collection_name in collections
+
+
+def include_edge(collection_name, edge_name):
+    include_edges = config.get('include_edge', [])
+
+    if include_edges is None:
+        include_edges = []
+
+    exclude_edges = config.get('exclude_edge', [])
+
+    if exclude_edges is None:
+        exclude_edges = []
+
+    if len(include_edges) > 0 and edge_name not in include_edges:
+        logger.debug('Skipping edge [%s] since it is not in INCLUDED list: %s' % (edge_name, include_edges))
+        return False
+
+    if edge_name in exclude_edges:
+        logger.debug('Skipping edge [%s] since it is in EXCLUDED list: %s' % (edge_name, exclude_edges))
+        return False
+
+    if (collection_name in ['users', 'user'] and edge_name in ['followers', 'feed', 'activities']) \
+            or (collection_name in ['receipts', 'receipt'] and edge_name in ['device', 'devices']):
+        # feed and activities are not retrieved when applications are exported, plus roles, groups and other
+        # system collections are handled by the entities themselves
+        return False
+
+    return True
+
+
+def find_import_files():
+    """
+    :return: a dict of app -> collection name -> {KIND_ENTITY_FILE: [file names], KIND_EDGE_FILE: [file names]}
+    """
+    import_files = {}
+    apps_to_process = config.get('app')
+
+    for app in sorted(os.listdir(config.get('import_path'))):
+        app_directory = os.path.join(config.get('import_path'), app)
+
+        if not os.path.isdir(app_directory):
+            continue
+
+        if apps_to_process and len(apps_to_process) > 0 and app not in apps_to_process:
+            logger.warning('Skipping app [%s] not included in process list [%s]' % (app, apps_to_process))
+            continue
+
+        import_files[app] = {}
+
+        for collection_name, files in find_collection_files(app_directory).iteritems():
+            if not include_collection(collection_name):
+                logger.warning('Skipping collection=[%s]' % collection_name)
+                continue
+
+            import_files[app][collection_name] = files
+
+            logger.info('Found [%s] entity files and [%s] edge files for app/collection [%s / %s]' % (
+                len(files[KIND_ENTITY_FILE]), len(files[KIND_EDGE_FILE]), app, collection_name))
+
+    return import_files
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Usergrid Export Loader')
+
+    parser.add_argument('--log_dir',
+                        help='path to the place where logs will be written',
+                        default='./',
+                        type=str,
+                        required=False)
+
+    parser.add_argument('--log_level',
+                        help='log level - DEBUG, INFO, WARN, ERROR, CRITICAL',
+                        default='INFO',
+                        type=str,
+                        required=False)
+
+    parser.add_argument('-o', '--org',
+                        help='Name of the org which was exported',
+                        type=str,
+                        required=True)
+
+    parser.add_argument('-i', '--import_path',
+                        help='The path to the exported org, which contains a directory for each app. This is '
+                             '<export_path>/<id>/<org> for the files written by usergrid_data_exporter',
+                        type=str,
+                        required=True)
+
+    parser.add_argument('-a', '--app',
+                        help='Name of one or more apps to include, specify none to include all apps',
+                        required=False,
+                        action='append')
+
+    parser.add_argument('-e', '--include_edge',
+                        help='Name of one or more edges/connection types to INCLUDE, specify none to include all edges',
+                        required=False,
+                        action='append')
+
+    parser.add_argument('--exclude_edge',
+                        help='Name of one or more edges/connection types to EXCLUDE, specify none to include all edges',
+                        required=False,
+                        action='append')
+
+    parser.add_argument('--exclude_collection',
+                        help='Name of one or more collections to EXCLUDE, specify none to include all collections',
+                        required=False,
+                        action='append')
+
+    parser.add_argument('-c', '--collection',
+                        help='Name of one or more collections to include, specify none to include all collections',
+                        default=[],
+                        action='append')
+
+    parser.add_argument('-d', '--target_config',
+                        help='The path to the target endpoint/org configuration file',
+                        type=str,
+                        default='destination.json')
+
+    parser.add_argument('-w', '--workers',
+                        help='The number of worker processes which load the files, each loads one file at a time',
+                        type=int,
+                        default=8)
+
+    parser.add_argument('--batch_size',
+                        help='The number of entities to write to the target in a single bulk request, 1 disables bulk '
+                             'writes',
+                        type=int,
+                        default=100)
+
+    parser.add_argument('--skip_data',
+                        help='Skip loading the entity files',
+                        action='store_true')
+
+    parser.add_argument('--skip_connections',
+                        help='Skip loading the edge files',
+                        action='store_true')
+
+    parser.add_argument('--max_attempts',
+                        help='The number of attempts to make for each request which fails with a 5xx or connection '
+                             'error before the entity or edge is written to the failure journal',
+                        type=int,
+                        default=5)
+
+    parser.add_argument('--retry_backoff_base',
+                        help='The number of seconds to wait before the first retry of a failed request, doubled on each '
+                             'further attempt and randomized',
+                        type=float,
+                        default=1.0)
+
+    parser.add_argument('--retry_backoff_max',
+                        help='The maximum number of seconds to wait before retrying a failed request',
+                        type=float,
+                        default=60.0)
+
+    parser.add_argument('--failure_journal',
+                        help='The file to append failed entities and edges to, one JSON record per line, which can be '
+                             'replayed with usergrid_data_migrator -m replay. Defaults to a file in --log_dir',
+                        type=str)
+
+    parser.add_argument('--http_pool_size',
+                        help='The number of HTTP connections each worker process keeps open to each host',
+                        type=int,
+                        default=10)
+
+    parser.add_argument('--disable_keep_alive',
+                        help='Open a new HTTP connection for every request instead of reusing pooled connections',
+                        action='store_true')
+
+    parser.add_argument('--disable_gzip',
+                        help='Do not request gzip compressed HTTP responses',
+                        action='store_true')
+
+    parser.add_argument('--nohup',
+                        help='specifies not to use stdout for logging',
+                        action='store_true')
+
+    parser.add_argument('--map_app',
+                        help="Multiple allowed: A colon-separated string such as 'apples:oranges' which indicates to"
+                             " put data from the app named 'apples' in the export into app named 'oranges' "
+                             "in the target endpoint",
+                        default=[],
+                        action='append')
+
+    parser.add_argument('--map_collection',
+                        help="One or more colon-separated string such as 'cats:dogs' which indicates to put data from "
+                             "collections named 'cats' in the export into a collection named 'dogs' in the "
+                             "target endpoint, applicable globally to all apps",
+                        default=[],
+                        action='append')
+
+    parser.add_argument('--map_org',
+                        help="One or more colon-separated strings such as 'red:blue' which indicates to put data from "
+                             "org named 'red' in the export into org named 'blue' in the target endpoint",
+                        default=[],
+                        action='append')
+
+    my_args = parser.parse_args(sys.argv[1:])
+
+    return vars(my_args)
+
+
+def init():
+    global config, failure_journal
+
+    config['collection_mapping'] = {}
+    config['app_mapping'] = {}
+    config['org_mapping'] = {}
+
+    for mapping in config.get('map_collection', []):
+        parts = mapping.split(':')
+
+        if len(parts) == 2:
+            config['collection_mapping'][parts[0]] = parts[1]
+        else:
+            logger.warning('Skipping Collection mapping: [%s]' % mapping)
+
+    for mapping in config.get('map_app', []):
+        parts = mapping.split(':')
+
+        if len(parts) == 2:
+            config['app_mapping'][parts[0]] = parts[1]
+        else:
+            logger.warning('Skipping App mapping: [%s]' % mapping)
+
+    for mapping in config.get('map_org', []):
+        parts = mapping.split(':')
+
+        if len(parts) == 2:
+            config['org_mapping'][parts[0]] = parts[1]
+            logger.info('Mapping Org [%s] to [%s] from mapping [%s]' % (parts[0], parts[1], mapping))
+        else:
+            logger.warning('Skipping Org mapping: [%s]' % mapping)
+
+    with open(config.get('target_config'), 'r') as f:
+        config['target_config'] = json.load(f)
+
+    if config['exclude_collection'] is None:
+        config['exclude_collection'] = []
+
+    config['batch_size'] = max(config.get('batch_size'), 1)
+
+    target_org = config.get('org_mapping', {}).get(config.get('org'), config.get('org'))
+
+    config['target_endpoint'] = config['target_config'].get('endpoint').copy()
+    config['target_endpoint'].update(config['target_config']['credentials'][target_org])
+
+    if config.get('failure_journal') is None:
+        config['failure_journal'] = os.path.join(config.get('log_dir'),
+                                                 '%s-load-%s-failures.json' % (config.get('org'), ECID))
+
+    failure_journal = FailureJournalWriter(config.get('failure_journal'))
+
+    # sessions are created on first use in each process, so this only sets the options they are created with
+    session_target.configure(pool_size=config.get('http_pool_size', DEFAULT_POOL_SIZE),
+                             keep_alive=not config.get('disable_keep_alive', False),
+                             gzip=not config.get('disable_gzip', False))
+
+
+def load_files(kind, import_files):
+    """
+    Publishes the files of one kind to a new set of workers and waits for them to be loaded
+
+    :return: the totals of the stats of the files
+    """
+    work_queue = Queue()
+    response_queue = Queue()
+
+    file_count = 0
+
+    for app, collections in import_files.iteritems():
+        for collection_name, files in collections.iteritems():
+            for file_name in files[kind]:
+                work_queue.put((kind, app, collection_name, file_name))
+                file_count += 1
+
+    logger.warning('Loading [%s] %s with [%s] workers' % (file_count, kind, config.get('workers')))
+
+    workers = [LoaderWorker(work_queue, response_queue) for x in xrange(max(config.get('workers'), 1))]
+    [work_queue.put(None) for w in workers]
+    [w.start() for w in workers]
+
+    totals = {}
+    files_loaded = 0
+
+    try:
+        # the responses are read while waiting since a worker can not exit until its responses have been read
+        while files_loaded < file_count:
+            try:
+                file_kind, app, collection_name, file_name, stats = response_queue.get(timeout=30)
+
+            except Empty:
+                if not any([w.is_alive() for w in workers]):
+                    logger.critical('All workers exited before [%s] of [%s] %s were loaded' % (
+                        file_count - files_loaded, file_count, kind))
+                    break
+
+                continue
+
+            files_loaded += 1
+
+            for key, value in stats.iteritems():
+                if isinstance(value, (int, long)):
+                    totals[key] = totals.get(key, 0) + value
+
+            if 'error' in stats:
+                totals['file_errors'] = totals.get('file_errors', 0) + 1
+
+            logger.info('Loaded [%s] of [%s] %s, totals: %s' % (files_loaded, file_count, kind, totals))
+
+        [w.join() for w in workers]
+
+    except KeyboardInterrupt:
+        logger.warning('Keyboard Interrupt, aborting...')
+
+        [os.kill(super(LoaderWorker, w).pid, signal.SIGINT) for w in workers]
+        [w.terminate() for w in workers]
+
+        raise
+
+    return totals
+
+
+def main():
+    global config
+
+    config = parse_args()
+    init()
+    init_logging(stdout_enabled=not config.get('nohup', False))
+
+    import_files = find_import_files()
+
+    if not config.get('skip_data'):
+        totals = load_files(KIND_ENTITY_FILE, import_files)
+        logger.warning('Finished loading entities: %s' % json.dumps(totals))
+
+    # edges are created once all of the entities have been loaded so that both ends of each edge exist
+    if not config.get('skip_connections'):
+        totals = load_files(KIND_EDGE_FILE, import_files)
+        logger.warning('Finished loading edges: %s' % json.dumps(totals))
+
+    logger.warning('Failures (if any) were written to [%s]' % config.get('failure_journal'))
+
+
+if __name__ == "__main__":
+    main()
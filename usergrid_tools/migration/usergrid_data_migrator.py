@@ -5,7 +5,8 @@ import argparse
 import json
 import logging
 import sys
-from multiprocessing import Queue, Process
+from multiprocessing import Event, Queue, Process
+from multiprocessing.pool import ThreadPool
 from sets import Set
 
 import time_uuid
@@ -19,11 +20,31 @@ import time
 from sys import platform as _platform
 
 import signal
+import threading
 
 from requests.auth import HTTPBasicAuth
-from usergrid import UsergridQueryIterator
 import urllib3
 
+from usergrid_tools.general.http_client import ProcessLocalSession, DEFAULT_POOL_SIZE
+from usergrid_tools.general.metrics import registry as metrics, MetricsAggregator, InstrumentedSession, \
+    start_metrics_server
+from usergrid_tools.iterators.prefetch_iterator import PrefetchingQueryIterator
+from usergrid_tools.migration.entity_cache import content_hash, cache_value, parse_cache_value, is_cached_unchanged
+from usergrid_tools.migration.checkpoint import checkpoint_key, watermark_predicate, RedisCheckpointStore, \
+    FileCheckpointStore, WatermarkTracker, mark_complete
+from usergrid_tools.migration.distributed import RedisWorkQueue, RedisStatusBoard, RunSeeder, run_key, \
+    DEFAULT_LEASE_TIME
+from usergrid_tools.migration.entity_transport import CollectionTable, EntityBatchSender, BatchAcknowledger, \
+    decode_batch, DEFAULT_TRANSPORT_BATCH_SIZE
+from usergrid_tools.migration.status_aggregator import StatusAggregator
+from usergrid_tools.migration.time_slices import get_field_range, build_time_slices, time_slice_predicate, \
+    time_slice_label, parse_ql, is_scan_order, scan_ql
+from usergrid_tools.migration.rate_limiter import AdaptiveRateLimiter, RateLimitedSession
+from usergrid_tools.migration.failure_journal import FailureJournalWriter, failure_record, read_failure_journal, \
+    KIND_ENTITY, KIND_EDGE
+from usergrid_tools.migration.retry_queue import TransientError, RetryScheduler, get_backoff
+from usergrid_tools.migration.visit_cache import VisitCache
+
 __author__ = 'Jeff West @ ApigeeCorporation'
 
 ECID = str(uuid.uuid1())
@@ -42,19 +63,58 @@ DEFAULT_CREATE_APPS = False
 DEFAULT_RETRY_SLEEP = 10
 DEFAULT_PROCESSING_SLEEP = 1
 
+# the status listener exits when no status has been received for this many seconds
+STATUS_IDLE_TIMEOUT = 7200
+
 queue = Queue()
 QSIZE_OK = False
 
+# the ids of the (app, collection) pairs on the entity queue, filled in before the workers are started
+collection_table = CollectionTable()
+
+# set by the main process on the first Ctrl-C to stop the scans and let the entity workers finish the queued entities
+drain_event = Event()
+
 try:
     queue.qsize()
     QSIZE_OK = True
 except:
     pass
 
-session_source = requests.Session()
-session_target = requests.Session()
+session_source = ProcessLocalSession()
+session_target = ProcessLocalSession()
 
 cache = None
+checkpoint_store = None
+rate_limiter = None
+
+# the Redis client shared by the hosts of a --distributed run, and the status of all of their collections
+redis_client = None
+status_board = None
+
+# sums the metrics of all of the processes when --metrics_port is set, only used in the main process
+metrics_aggregator = None
+failure_journal = None
+
+# the entity operations waiting to be retried by the current worker process
+retry_scheduler = None
+
+# the queues the entity workers acknowledge the processed batches of each collection worker on, and the acknowledger
+# of the current entity worker process
+ack_queues = []
+acknowledger = None
+
+# the thread pools used to create the edges of an entity concurrently, created on first use by each worker thread so
+# that the threads of a worker process do not queue behind each other's edges
+edge_pools = threading.local()
+
+# the number of edges handled by the current worker process
+edge_stats = {
+    'created': 0,
+    'skipped': 0,
+    'failed': 0
+}
+edge_stats_lock = threading.Lock()
 
 
 def total_seconds(td):
@@ -137,6 +197,12 @@ permissions_url_template = "{api_url}/{org}/{app}/{collection}/{uuid}/permission
 
 user_credentials_url_template = "{api_url}/{org}/{app}/users/{uuid}/credentials"
 
+delta_predicate_template = 'modified > {min_modified} and modified <= {max_modified}'
+uuid_predicate_template = 'uuid = {uuid}'
+
+# the number of entities to fetch from the target in a single query when comparing content hashes
+content_hash_query_size = 50
+
 ignore_collections = ['activities', 'queues', 'events', 'notifications']
 
 
@@ -149,189 +215,282 @@ class StatusListener(Process):
     def run(self):
         keep_going = True
 
-        org_results = {
-            'name': config.get('org'),
-            'apps': {},
-        }
+        # the main process coordinates the shutdown on Ctrl-C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-        empty_count = 0
+        status = StatusAggregator(config.get('org'))
 
         status_file_name = os.path.join(config.get('log_dir'),
                                         '%s-%s-%s-status.json' % (config.get('org'), config.get('migrate'), ECID))
 
-        while keep_going:
-
-            try:
-                app, collection, status_map = self.status_queue.get(timeout=60)
-                status_logger.info('Received status update for app/collection: [%s / %s]' % (app, collection))
-                empty_count = 0
-                org_results['summary'] = {
-                    'max_created': -1,
-                    'max_modified': -1,
-                    'min_created': 1584946416000,
-                    'min_modified': 1584946416000,
-                    'count': 0,
-                    'bytes': 0
-                }
-
-                if app not in org_results['apps']:
-                    org_results['apps'][app] = {
-                        'collections': {}
-                    }
-
-                org_results['apps'][app]['collections'].update(status_map)
+        run_status_file_name = os.path.join(config.get('log_dir'), '%s-%s-%s-run-status.json' % (
+            config.get('org'), config.get('migrate'), config.get('run_id')))
 
-                try:
-                    for app, app_data in org_results['apps'].iteritems():
-                        app_data['summary'] = {
-                            'max_created': -1,
-                            'max_modified': -1,
-                            'min_created': 1584946416000,
-                            'min_modified': 1584946416000,
-                            'count': 0,
-                            'bytes': 0
-                        }
-
-                        if 'collections' in app_data:
-                            for collection, collection_data in app_data['collections'].iteritems():
+        status_interval = config.get('status_interval', 10)
+        last_write_time = 0
+        last_update_time = time.time()
 
-                                app_data['summary']['count'] += collection_data['count']
-                                app_data['summary']['bytes'] += collection_data['bytes']
-
-                                org_results['summary']['count'] += collection_data['count']
-                                org_results['summary']['bytes'] += collection_data['bytes']
+        while keep_going:
 
-                                # APP
-                                if collection_data.get('max_modified') > app_data['summary']['max_modified']:
-                                    app_data['summary']['max_modified'] = collection_data.get('max_modified')
+            try:
+                message = self.status_queue.get(timeout=status_interval)
 
-                                if collection_data.get('min_modified') < app_data['summary']['min_modified']:
-                                    app_data['summary']['min_modified'] = collection_data.get('min_modified')
+                # the main process sends a None once all of the workers have finished
+                if message is None:
+                    keep_going = False
+                    continue
 
-                                if collection_data.get('max_created') > app_data['summary']['max_created']:
-                                    app_data['summary']['max_created'] = collection_data.get('max_created')
+                app, collection, status_map = message
+                status_logger.info('Received status update for app/collection: [%s / %s]' % (app, collection))
+                last_update_time = time.time()
 
-                                if collection_data.get('min_created') < app_data['summary']['min_created']:
-                                    app_data['summary']['min_created'] = collection_data.get('min_created')
+                status.update(app, status_map)
 
-                                # ORG
-                                if collection_data.get('max_modified') > org_results['summary']['max_modified']:
-                                    org_results['summary']['max_modified'] = collection_data.get('max_modified')
+                if status_board is not None:
+                    status_board.update(app, status_map)
 
-                                if collection_data.get('min_modified') < org_results['summary']['min_modified']:
-                                    org_results['summary']['min_modified'] = collection_data.get('min_modified')
+            except KeyboardInterrupt, e:
+                status_logger.warn('FINAL status of org processed: %s' % status.to_json())
+                raise e
 
-                                if collection_data.get('max_created') > org_results['summary']['max_created']:
-                                    org_results['summary']['max_created'] = collection_data.get('max_created')
+            except Empty:
+                if QSIZE_OK:
+                    status_logger.warn('CURRENT Queue Depth: %s' % self.worker_queue.qsize())
 
-                                if collection_data.get('min_created') < org_results['summary']['min_created']:
-                                    org_results['summary']['min_created'] = collection_data.get('min_created')
+                idle_time = time.time() - last_update_time
 
-                        if QSIZE_OK:
-                            status_logger.warn('CURRENT Queue Depth: %s' % self.worker_queue.qsize())
+                status_logger.warning('EMPTY! No status received for [%.0f]s' % idle_time)
 
-                        status_logger.warn('UPDATED status of org processed: %s' % json.dumps(org_results))
+                if idle_time >= STATUS_IDLE_TIMEOUT:
+                    keep_going = False
 
-                        try:
-                            logger.info('Writing status to file: %s' % status_file_name)
+            except:
+                print traceback.format_exc()
 
-                            with open(status_file_name, 'w') as f:
-                                json.dump(org_results, f, indent=2)
-                        except:
-                            print traceback.format_exc()
+            # the status is logged and written at most once per interval, however often it is updated
+            if status.dirty and time.time() - last_write_time >= status_interval:
+                if QSIZE_OK:
+                    status_logger.warn('CURRENT Queue Depth: %s' % self.worker_queue.qsize())
 
-                except KeyboardInterrupt, e:
-                    raise e
+                status_logger.warn('UPDATED status of org processed: %s' % status.to_json())
 
+                try:
+                    logger.info('Writing status to file: %s' % status_file_name)
+                    status.write(status_file_name)
                 except:
                     print traceback.format_exc()
 
-            except KeyboardInterrupt, e:
-                status_logger.warn('FINAL status of org processed: %s' % json.dumps(org_results))
-                raise e
+                self.write_run_status(run_status_file_name)
 
-            except Empty:
-                if QSIZE_OK:
-                    status_logger.warn('CURRENT Queue Depth: %s' % self.worker_queue.qsize())
-
-                status_logger.warn('CURRENT status of org processed: %s' % json.dumps(org_results))
+                last_write_time = time.time()
 
-                status_logger.warning('EMPTY! Count=%s' % empty_count)
+        logger.warn('FINAL status of org processed: %s' % status.to_json())
 
-                empty_count += 1
+        try:
+            logger.info('Writing final status to file: %s' % status_file_name)
+            status.write(status_file_name)
+        except:
+            print traceback.format_exc()
 
-                if empty_count >= 120:
-                    keep_going = False
+        self.write_run_status(run_status_file_name)
 
-            except:
-                print traceback.format_exc()
-
-        logger.warn('FINAL status of org processed: %s' % json.dumps(org_results))
+    def write_run_status(self, run_status_file_name):
+        """
+        Writes the status of every collection of a distributed run, as reported by all of its hosts
+        """
+        if status_board is None:
+            return
 
         try:
-            logger.info('Writing final status to file: %s' % status_file_name)
-            with open(status_file_name, 'w') as f:
-                json.dump(org_results, f, indent=2)
+            logger.info('Writing status of the run to file: %s' % run_status_file_name)
+            status_board.aggregate(config.get('org')).write(run_status_file_name)
         except:
             print traceback.format_exc()
 
 
 class EntityWorker(Process):
-    def __init__(self, queue, handler_function):
+    def __init__(self, queue, handler_function, batch_handler_function=None, batch_size=1, threads=1):
         super(EntityWorker, self).__init__()
 
         worker_logger.debug('Creating worker!')
         self.queue = queue
         self.handler_function = handler_function
+        self.batch_handler_function = batch_handler_function
+        self.batch_size = batch_size
+        self.threads = threads
+
+        # a message of a RedisWorkQueue is acknowledged by the next get, so its entities are not held in a batch
+        self.batch_per_message = isinstance(queue, RedisWorkQueue)
 
     def run(self):
+        global retry_scheduler, acknowledger
 
         worker_logger.info('starting run()...')
+
+        # the main process coordinates the shutdown on Ctrl-C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        retry_scheduler = RetryScheduler(backoff_base=config.get('retry_backoff_base', 1.0),
+                                         backoff_max=config.get('retry_backoff_max', 60.0))
+
+        acknowledger = BatchAcknowledger(send_ack)
+
+        # the collection workers may have exited, so do not wait for their acknowledgements to be read on exit
+        for ack_queue in ack_queues:
+            ack_queue.cancel_join_thread()
+
+        # allow one pooled connection for each request which may be in flight in this process
+        pool_size = self.threads * max(config.get('edge_concurrency', 1), 1)
+
+        if pool_size > 1:
+            init_session_pools(pool_size)
+
+        try:
+            if self.threads <= 1:
+                self.process_queue()
+                return
+
+            # each thread runs the same loop on the shared queue, so up to [threads] operations are in flight in this
+            # process while the others are waiting on the network
+            threads = [threading.Thread(target=self.process_queue, name='%s-Thread-%s' % (self.name, x))
+                       for x in xrange(self.threads)]
+
+            for t in threads:
+                t.daemon = True
+                t.start()
+
+            # join with a timeout so that a KeyboardInterrupt is not blocked
+            while len([t for t in threads if t.is_alive()]) > 0:
+                for t in threads:
+                    t.join(1)
+
+            worker_logger.info('All [%s] threads finished!' % self.threads)
+
+        finally:
+            # send the metrics recorded since the last periodic flush, which would be lost on exit
+            metrics.flush()
+
+    def process_queue(self):
         keep_going = True
 
         count_processed = 0
         empty_count = 0
         start_time = int(time.time())
+        end_of_stream = False
+
+        # entities waiting to be written in bulk, keyed by (app, collection_name)
+        batches = {}
 
         while keep_going:
 
             try:
-                # get an entity with the app and collection name
-                app, collection_name, entity = self.queue.get(timeout=120)
-                empty_count = 0
+                count_processed += self.run_due_retries()
 
-                # if entity.get('type') == 'user':
-                #     entity = confirm_user_entity(app, entity)
+                # the other hosts of a distributed run may still be producing, so a drain stops taking their entities
+                # from the shared queue rather than waiting for it to become empty
+                if drain_event.is_set() and isinstance(self.queue, RedisWorkQueue):
+                    worker_logger.warning('Draining, no more entities will be taken from [%s]' % self.queue.name)
 
-                # the handler operation is the specified operation such as migrate_graph
-                if self.handler_function is not None:
-                    try:
-                        message_start_time = int(time.time())
-                        processed = self.handler_function(app, collection_name, entity)
-                        message_end_time = int(time.time())
+                    # the message this thread took last has been processed, so it is acknowledged rather than released
+                    self.queue.done()
+                    self.journal_pending_retries()
+                    keep_going = False
+                    continue
+
+                if end_of_stream:
+                    # no more entities will be sent, so only the retries which are still pending are waited for
+                    if len(retry_scheduler) == 0:
+                        keep_going = False
+
+                    elif drain_event.is_set():
+                        self.journal_pending_retries()
+                        keep_going = False
+
+                    else:
+                        time.sleep(self.get_queue_timeout())
+
+                    continue
 
-                        if processed:
-                            count_processed += 1
+                # get a batch of entities with the app and collection name, waking up when the next retry is due
+                message = self.queue.get(timeout=self.get_queue_timeout())
 
-                            total_time = message_end_time - start_time
-                            avg_time_per_message = total_time / count_processed
-                            message_time = message_end_time - message_start_time
+                # the main process sends a None for each thread of each entity worker once the producers have finished
+                if message is None:
+                    worker_logger.info('Received the end of the entity stream')
+                    end_of_stream = True
 
-                            worker_logger.debug('Processed [%sth] entity = %s / %s / %s' % (
-                                count_processed, app, collection_name, entity.get('uuid')))
+                    for (batch_app, batch_collection_name), batch in batches.items():
+                        count_processed += self.process_batch(batch_app, batch_collection_name, batch)
 
-                            if count_processed % 1000 == 1:
-                                worker_logger.info(
+                    batches = {}
+                    flush_cache()
+                    continue
+
+                app, collection_name, entities, tag = decode_batch(message, collection_table)
+                acknowledger.receive(tag, entities)
+                empty_count = 0
+
+                for entity in entities:
+                    # if entity.get('type') == 'user':
+                    #     entity = confirm_user_entity(app, entity)
+
+                    if self.batch_handler_function is not None and self.batch_size > 1:
+                        batch = batches.setdefault((app, collection_name), [])
+                        batch.append(entity)
+
+                        if len(batch) >= self.batch_size:
+                            count_processed += self.process_batch(app, collection_name,
+                                                                  batches.pop((app, collection_name)))
+
+                    # the handler operation is the specified operation such as migrate_graph
+                    elif self.handler_function is not None:
+                        try:
+                            message_start_time = int(time.time())
+                            operation_start_time = time.time()
+                            # a transient failure of the data migration is scheduled for a retry rather than
+                            # waited for, which is only safe when nothing else depends on the entity being written
+                            if self.handler_function == migrate_data:
+                                processed = migrate_data(app, collection_name, entity, defer=True)
+                            else:
+                                processed = self.handler_function(app, collection_name, entity)
+                            message_end_time = int(time.time())
+
+                            metrics.observe('usergrid_operation_seconds', time.time() - operation_start_time,
+                                            operation=self.handler_function.__name__)
+                            metrics.inc('usergrid_entities_processed_total', app=app, collection=collection_name,
+                                        result='processed' if processed else 'not_processed')
+
+                            if processed:
+                                count_processed += 1
+
+                                total_time = message_end_time - start_time
+                                avg_time_per_message = total_time / count_processed
+                                message_time = message_end_time - message_start_time
+
+                                worker_logger.debug('Processed [%sth] entity = %s / %s / %s' % (
+                                    count_processed, app, collection_name, entity.get('uuid')))
+
+                                if count_processed % 1000 == 1:
+                                    worker_logger.info(
                                         'Processed [%sth] entity = [%s / %s / %s] in [%s]s - avg time/message [%s]' % (
                                             count_processed, app, collection_name, entity.get('uuid'), message_time,
                                             avg_time_per_message))
 
-                    except KeyboardInterrupt, e:
-                        raise e
+                                    log_cache_stats()
+                                    log_edge_stats(start_time)
 
-                    except Exception, e:
-                        logger.exception('Error in EntityWorker processing message')
-                        print traceback.format_exc()
+                        except KeyboardInterrupt, e:
+                            raise e
+
+                        except Exception, e:
+                            logger.exception('Error in EntityWorker processing message')
+                            print traceback.format_exc()
+
+                        finally:
+                            self.entity_done(entity)
+
+                if self.batch_per_message and (app, collection_name) in batches:
+                    count_processed += self.process_batch(app, collection_name, batches.pop((app, collection_name)))
 
             except KeyboardInterrupt, e:
                 raise e
@@ -339,6 +498,23 @@ class EntityWorker(Process):
             except Empty:
                 worker_logger.warning('EMPTY! Count=%s' % empty_count)
 
+                # do not hold partial batches while waiting for more work
+                for (batch_app, batch_collection_name), batch in batches.items():
+                    count_processed += self.process_batch(batch_app, batch_collection_name, batch)
+
+                batches = {}
+                flush_cache()
+
+                # a drain does not wait for the retries, which are left in the failure journal to be replayed
+                if drain_event.is_set():
+                    self.journal_pending_retries()
+
+                # keep going while there are retries waiting to become due
+                if len(retry_scheduler) > 0:
+                    continue
+
+                # the end of the stream is normally marked by the main process, this stops a worker whose producers
+                # went away, such as on the other hosts of a distributed run
                 empty_count += 1
 
                 if empty_count >= 2:
@@ -348,38 +524,153 @@ class EntityWorker(Process):
                 logger.exception('Error in EntityWorker run()')
                 print traceback.format_exc()
 
+        for (batch_app, batch_collection_name), batch in batches.items():
+            count_processed += self.process_batch(batch_app, batch_collection_name, batch)
+
+        flush_cache()
+        log_cache_stats()
+        log_edge_stats(start_time)
+
+        total_time = int(time.time()) - start_time
+
+        worker_logger.info('Processed [%s] entities in [%s]s - [%s] entities/sec' % (
+            count_processed, total_time, count_processed / max(total_time, 1)))
+
+    def get_queue_timeout(self):
+        next_due_in = retry_scheduler.next_due_in()
+
+        if next_due_in is None:
+            return 120
+
+        return min(max(next_due_in, 0.1), 120)
+
+    def entity_done(self, entity):
+        # an entity waiting to be retried is done once its retry has run
+        if not retry_scheduler.is_scheduled(id(entity)):
+            acknowledger.done(entity)
+
+    def journal_pending_retries(self):
+        for app, collection_name, entity, attempts, force in retry_scheduler.pop_all():
+            write_failure(KIND_ENTITY, 'migrate_data', app, collection_name, entity,
+                          'retry pending when the run was drained', attempts=attempts)
+            acknowledger.done(entity)
+
+    def run_due_retries(self):
+        count_processed = 0
+
+        for app, collection_name, entity, attempts, force in retry_scheduler.pop_due():
+            try:
+                if migrate_data(app, collection_name, entity, attempts=attempts, force=force, defer=True):
+                    count_processed += 1
+
+            except KeyboardInterrupt, e:
+                raise e
+
+            except Exception, e:
+                logger.exception('Error in EntityWorker retrying entity [%s / %s / %s]' % (
+                    app, collection_name, entity.get('uuid')))
+
+            finally:
+                self.entity_done(entity)
+
+        return count_processed
+
+    def process_batch(self, app, collection_name, entities):
+        try:
+            batch_start_time = time.time()
+            processed = self.batch_handler_function(app, collection_name, entities)
+            batch_time = time.time() - batch_start_time
+
+            metrics.observe('usergrid_operation_seconds', batch_time, operation=self.batch_handler_function.__name__)
+            metrics.inc('usergrid_entities_processed_total', processed, app=app, collection=collection_name,
+                        result='processed')
+            metrics.inc('usergrid_entities_processed_total', len(entities) - processed, app=app,
+                        collection=collection_name, result='not_processed')
+
+            worker_logger.info('Processed batch of [%s/%s] entities = [%s / %s] in [%.3f]s' % (
+                processed, len(entities), app, collection_name, batch_time))
+
+            log_cache_stats()
+
+            return processed
+
+        except KeyboardInterrupt, e:
+            raise e
+
+        except Exception, e:
+            logger.exception('Error in EntityWorker processing batch')
+            print traceback.format_exc()
+
+        finally:
+            for entity in entities:
+                self.entity_done(entity)
+
+        return 0
+
 
 class CollectionWorker(Process):
-    def __init__(self, work_queue, entity_queue, response_queue):
+    def __init__(self, work_queue, entity_queue, response_queue, strip_fields=None, ack_channel=None):
         super(CollectionWorker, self).__init__()
         collection_worker_logger.debug('Creating worker!')
         self.work_queue = work_queue
         self.response_queue = response_queue
         self.entity_queue = entity_queue
+        self.strip_fields = strip_fields
+        self.ack_channel = ack_channel
 
     def run(self):
 
         collection_worker_logger.info('starting run()...')
         keep_going = True
 
+        # the main process coordinates the shutdown on Ctrl-C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
         counter = 0
         # max_created = 0
         empty_count = 0
         app = 'ERROR'
         collection_name = 'NOT SET'
+        status_key = 'NOT SET'
         status_map = {}
         sleep_time = 10
+        stalled = False
+
+        sender = EntityBatchSender(self.entity_queue, collection_table,
+                                   batch_size=config.get('transport_batch_size', DEFAULT_TRANSPORT_BATCH_SIZE),
+                                   strip_fields=self.strip_fields)
 
         try:
 
             while keep_going:
 
                 try:
-                    app, collection_name = self.work_queue.get(timeout=30)
+                    if drain_event.is_set() or stalled:
+                        collection_worker_logger.warning('Draining, no more collections will be scanned')
+
+                        # acknowledge the collection finished last, which would otherwise be scanned again by another
+                        # host once its lease expired
+                        if isinstance(self.work_queue, RedisWorkQueue):
+                            self.work_queue.done()
+
+                        break
+
+                    work_item = self.work_queue.get(timeout=30)
+
+                    # the main process sends a None for each collection worker after the collections
+                    if work_item is None:
+                        keep_going = False
+                        continue
+
+                    # work items are (app, collection) or (app, collection, time_slice) for a slice of a collection
+                    app, collection_name = work_item[0], work_item[1]
+                    time_slice = work_item[2] if len(work_item) > 2 else None
+                    status_key = time_slice_label(collection_name, time_slice)
 
                     status_map = {
-                        collection_name: {
+                        status_key: {
                             'iteration_started': str(datetime.datetime.now()),
+                            'collection': collection_name,
                             'max_created': -1,
                             'max_modified': -1,
                             'min_created': 1584946416000,
@@ -389,114 +680,194 @@ class CollectionWorker(Process):
                         }
                     }
 
+                    if time_slice is not None:
+                        status_map[status_key]['time_slice'] = time_slice
+
+                    delta_since = get_delta_watermark(app, collection_name)
+
+                    # carry the watermark forward so that the next delta run starts from here if nothing changed
+                    if delta_since is not None and not config.get('graph', False):
+                        status_map[status_key]['delta_since'] = delta_since
+                        status_map[status_key]['max_modified'] = delta_since
+
+                    # the next delta run starts from the time this scan started rather than from the highest modified
+                    # timestamp it saw, since the scan is not ordered by modified
+                    status_map[status_key]['delta_until'] = get_delta_bound()
+
                     empty_count = 0
 
-                    # added a flag for using graph vs query/index
-                    if config.get('graph', False):
-                        source_collection_url = collection_graph_url_template.format(org=config.get('org'),
-                                                                                     app=app,
-                                                                                     collection=collection_name,
-                                                                                     limit=config.get('limit'),
-                                                                                     **config.get('source_endpoint'))
+                    # scans are checkpointed by the field they are ordered by, graph scans have no order
+                    order_field = None if config.get('graph', False) else (time_slice or {}).get('field', 'created')
+
+                    if order_field is not None and not is_scan_order(config.get('ql'), order_field):
+                        order_field = None
+                    checkpoint = None
+
+                    if config.get('resume', False) and order_field is not None:
+                        checkpoint = load_checkpoint(app, collection_name, time_slice)
+
+                    if checkpoint is not None and checkpoint.get('complete'):
+                        collection_worker_logger.warning('Skipping completed app/collection [%s / %s] on resume' % (
+                            app, status_key))
+
+                        status_map[status_key]['resumed'] = 'complete'
+                        self.response_queue.put((app, status_key, status_map))
+                        continue
+
+                    watermark = checkpoint.get('watermark') if checkpoint is not None else None
+
+                    if watermark is not None:
+                        collection_worker_logger.warning('Resuming app/collection [%s / %s] from %s >= %s' % (
+                            app, status_key, order_field, watermark))
+
+                        status_map[status_key]['resumed_from'] = watermark
+
+                    tracker = WatermarkTracker(order_field, sample_interval=config.get('limit'), watermark=watermark)
+
+                    # replaces the checkpoint of a previous run which finished its scan, so that this scan is only
+                    # marked complete if it finishes too
+                    if order_field is not None:
+                        save_checkpoint(app, collection_name, time_slice, tracker.checkpoint())
+
+                    # the batches of a checkpointed scan are acknowledged once the entity workers have processed them
+                    if order_field is not None and self.ack_channel is not None:
+                        sender.start_scan(self.ack_channel, uuid.uuid1().hex)
                     else:
-                        source_collection_url = collection_query_url_template.format(org=config.get('org'),
-                                                                                     app=app,
-                                                                                     collection=collection_name,
-                                                                                     limit=config.get('limit'),
-                                                                                     ql="select * %s" % config.get(
-                                                                                             'ql'),
-                                                                                     **config.get('source_endpoint'))
+                        sender.start_scan()
+
+                    source_collection_url = get_source_collection_url(app, collection_name, time_slice, watermark)
 
                     logger.info('Iterating URL: %s' % source_collection_url)
 
-                    # use the UsergridQuery from the Python SDK to iterate the collection
-                    q = UsergridQueryIterator(source_collection_url,
-                                              page_delay=config.get('page_sleep_time'),
-                                              sleep_time=config.get('error_retry_sleep'))
+                    # use the UsergridQuery from the Python SDK (or the prefetching iterator) to iterate the collection
+                    q = get_collection_iterator(source_collection_url)
+
+                    try:
+                        for entity in q:
+
+                            # begin entity loop
+
+                            # the entity is serialized once and sent to the entity workers in a batch with the entities
+                            # which follow it
+                            entity_json = sender.encode(entity)
 
-                    for entity in q:
+                            sender.add(app, collection_name, entity_json)
+                            counter += 1
 
-                        # begin entity loop
+                            metrics.inc('usergrid_entities_scanned_total', app=app, collection=collection_name)
+                            metrics.inc('usergrid_entity_bytes_total', len(entity_json), app=app,
+                                        collection=collection_name)
 
-                        self.entity_queue.put((app, collection_name, entity))
-                        counter += 1
+                            if order_field is not None:
+                                tracker.add(entity)
 
-                        if 'created' in entity:
+                                if tracker.counter % config.get('checkpoint_interval') == 0:
+                                    save_checkpoint(app, collection_name, time_slice, self.checkpoint(tracker, sender))
 
-                            try:
-                                entity_created = long(entity.get('created'))
+                            if counter % 100 == 0:
+                                stalled = not self.wait_for_queue_drain()
 
-                                if entity_created > status_map[collection_name]['max_created']:
-                                    status_map[collection_name]['max_created'] = entity_created
-                                    status_map[collection_name]['max_created_str'] = str(
-                                            datetime.datetime.fromtimestamp(entity_created / 1000))
+                                # stop the scan and checkpoint where it got to, so that it can be resumed
+                                if drain_event.is_set() or stalled:
+                                    status_map[status_key]['drained'] = True
+                                    status_map[status_key]['stalled'] = stalled
+                                    break
 
-                                if entity_created < status_map[collection_name]['min_created']:
-                                    status_map[collection_name]['min_created'] = entity_created
-                                    status_map[collection_name]['min_created_str'] = str(
-                                            datetime.datetime.fromtimestamp(entity_created / 1000))
+                            if 'created' in entity:
 
-                            except ValueError:
-                                pass
+                                try:
+                                    entity_created = long(entity.get('created'))
 
-                        if 'modified' in entity:
+                                    if entity_created > status_map[status_key]['max_created']:
+                                        status_map[status_key]['max_created'] = entity_created
+                                        status_map[status_key]['max_created_str'] = str(
+                                                datetime.datetime.fromtimestamp(entity_created / 1000))
 
-                            try:
-                                entity_modified = long(entity.get('modified'))
+                                    if entity_created < status_map[status_key]['min_created']:
+                                        status_map[status_key]['min_created'] = entity_created
+                                        status_map[status_key]['min_created_str'] = str(
+                                                datetime.datetime.fromtimestamp(entity_created / 1000))
 
-                                if entity_modified > status_map[collection_name]['max_modified']:
-                                    status_map[collection_name]['max_modified'] = entity_modified
-                                    status_map[collection_name]['max_modified_str'] = str(
-                                            datetime.datetime.fromtimestamp(entity_modified / 1000))
+                                except ValueError:
+                                    pass
 
-                                if entity_modified < status_map[collection_name]['min_modified']:
-                                    status_map[collection_name]['min_modified'] = entity_modified
-                                    status_map[collection_name]['min_modified_str'] = str(
-                                            datetime.datetime.fromtimestamp(entity_modified / 1000))
+                            if 'modified' in entity:
 
-                            except ValueError:
-                                pass
+                                try:
+                                    entity_modified = long(entity.get('modified'))
 
-                        status_map[collection_name]['bytes'] += count_bytes(entity)
-                        status_map[collection_name]['count'] += 1
+                                    if entity_modified > status_map[status_key]['max_modified']:
+                                        status_map[status_key]['max_modified'] = entity_modified
+                                        status_map[status_key]['max_modified_str'] = str(
+                                                datetime.datetime.fromtimestamp(entity_modified / 1000))
 
-                        if counter % 1000 == 1:
-                            try:
-                                collection_worker_logger.warning(
-                                        'Sending stats for app/collection [%s / %s]: %s' % (
-                                            app, collection_name, status_map))
+                                    if entity_modified < status_map[status_key]['min_modified']:
+                                        status_map[status_key]['min_modified'] = entity_modified
+                                        status_map[status_key]['min_modified_str'] = str(
+                                                datetime.datetime.fromtimestamp(entity_modified / 1000))
 
-                                self.response_queue.put((app, collection_name, status_map))
+                                except ValueError:
+                                    pass
 
-                                if QSIZE_OK:
-                                    collection_worker_logger.info(
-                                            'Counter=%s, collection queue depth=%s' % (
-                                                counter, self.work_queue.qsize()))
-                            except:
-                                pass
+                            status_map[status_key]['bytes'] += len(entity_json)
+                            status_map[status_key]['count'] += 1
 
-                            collection_worker_logger.warn(
-                                    'Current status of collections processed: %s' % json.dumps(status_map))
+                            if counter % 1000 == 1:
+                                try:
+                                    collection_worker_logger.warning(
+                                            'Sending stats for app/collection [%s / %s]: %s' % (
+                                                app, collection_name, status_map))
 
-                        if config.get('entity_sleep_time') > 0:
-                            collection_worker_logger.debug(
-                                    'sleeping for [%s]s per entity...' % (config.get('entity_sleep_time')))
-                            time.sleep(config.get('entity_sleep_time'))
-                            collection_worker_logger.debug(
-                                    'STOPPED sleeping for [%s]s per entity...' % (config.get('entity_sleep_time')))
+                                    self.response_queue.put((app, status_key, status_map))
+
+                                    if QSIZE_OK:
+                                        collection_worker_logger.info(
+                                                'Counter=%s, collection queue depth=%s' % (
+                                                    counter, self.work_queue.qsize()))
+                                except:
+                                    pass
+
+                                collection_worker_logger.warn(
+                                        'Current status of collections processed: %s' % json.dumps(status_map))
+
+                            if config.get('entity_sleep_time') > 0:
+                                collection_worker_logger.debug(
+                                        'sleeping for [%s]s per entity...' % (config.get('entity_sleep_time')))
+                                time.sleep(config.get('entity_sleep_time'))
+                                collection_worker_logger.debug(
+                                        'STOPPED sleeping for [%s]s per entity...' % (config.get('entity_sleep_time')))
+
+                    finally:
+                        # stops the background page requests of a scan which was drained, stalled or failed
+                        q.close()
 
                     # end entity loop
 
-                    status_map[collection_name]['iteration_finished'] = str(datetime.datetime.now())
+                    # a scan which failed raised out of the loop, and one which was drained or stalled broke out of it
+                    # after checkpointing, so neither is marked complete and --resume continues them
+                    if not status_map[status_key].get('drained'):
+                        tracker.finish()
+
+                    sender.flush()
+
+                    # another host of a distributed run can take over the collection without waiting for the lease
+                    if status_map[status_key].get('drained') and isinstance(self.work_queue, RedisWorkQueue):
+                        self.work_queue.release()
+
+                    status_map[status_key]['iteration_finished'] = str(datetime.datetime.now())
+
+                    # the collection is only marked complete once the entity workers have finished
+                    if order_field is not None:
+                        save_checkpoint(app, collection_name, time_slice, self.checkpoint(tracker, sender))
 
                     collection_worker_logger.warning(
                             'Collection [%s / %s / %s] loop complete!  Max Created entity %s' % (
-                                config.get('org'), app, collection_name, status_map[collection_name]['max_created']))
+                                config.get('org'), app, collection_name, status_map[status_key]['max_created']))
 
                     collection_worker_logger.warning(
-                            'Sending FINAL stats for app/collection [%s / %s]: %s' % (app, collection_name, status_map))
+                            'Sending FINAL stats for app/collection [%s / %s]: %s' % (app, status_key, status_map))
 
-                    self.response_queue.put((app, collection_name, status_map))
+                    self.response_queue.put((app, status_key, status_map))
 
                     collection_worker_logger.info('Done! Finished app/collection: %s / %s' % (app, collection_name))
 
@@ -516,9 +887,353 @@ class CollectionWorker(Process):
                     print traceback.format_exc()
 
         finally:
-            self.response_queue.put((app, collection_name, status_map))
+            sender.flush()
+            self.response_queue.put((app, status_key, status_map))
+
+            # send the metrics recorded since the last periodic flush, which would be lost on exit
+            metrics.flush()
             collection_worker_logger.info('FINISHED!')
 
+    def checkpoint(self, tracker, sender):
+        """
+        :return: the checkpoint of the scan, committed up to the batches which the entity workers have acknowledged
+        """
+        for batch, end in sender.take_sent():
+            tracker.sent(batch, end)
+
+        for scan_id, batch in read_acks(self.ack_channel):
+            # acknowledgements of the previous scans of this worker are no longer needed
+            if scan_id == sender.scan_id:
+                tracker.acknowledge(batch)
+
+        return tracker.checkpoint()
+
+    def wait_for_queue_drain(self):
+        """
+        Pauses publishing once the entity queue reaches the high watermark until the entity workers have brought it
+        down to the low watermark
+
+        :return: False if the queue did not go down for --max_queue_pause seconds, such as when the entity workers have
+        died, in which case the scan should stop
+        """
+        depth = get_entity_queue_depth(self.entity_queue) if QSIZE_OK else 0
+
+        if depth < config.get('queue_watermark_high'):
+            return True
+
+        collection_worker_logger.warning('Entity queue depth [%s] reached high watermark [%s], PAUSING...' % (
+            depth, config.get('queue_watermark_high')))
+
+        pause_start_time = time.time()
+        lowest_depth = depth
+        progress_time = pause_start_time
+
+        while depth > config.get('queue_watermark_low') and not drain_event.is_set():
+            time.sleep(DEFAULT_PROCESSING_SLEEP)
+            depth = get_entity_queue_depth(self.entity_queue)
+
+            if depth < lowest_depth:
+                lowest_depth = depth
+                progress_time = time.time()
+
+            elif 0 < config.get('max_queue_pause', 0) <= time.time() - progress_time:
+                collection_worker_logger.critical(
+                        'Entity queue depth [%s] has not gone down in [%.1f]s, STOPPING the scan.  Are the entity '
+                        'workers running?' % (depth, time.time() - progress_time))
+                return False
+
+        collection_worker_logger.warning('Entity queue depth [%s] reached low watermark [%s], RESUMING after [%.1f]s' % (
+            depth, config.get('queue_watermark_low'), time.time() - pause_start_time))
+
+        return True
+
+
+class ReplayWorker(Process):
+    """
+    Publishes the records of a failure journal to the entity queue in place of the collection workers
+    """
+
+    def __init__(self, replay_file_name, entity_queue):
+        super(ReplayWorker, self).__init__()
+        self.replay_file_name = replay_file_name
+        self.entity_queue = entity_queue
+
+    def run(self):
+        collection_worker_logger.info('Replaying [%s]...' % self.replay_file_name)
+
+        # the main process coordinates the shutdown on Ctrl-C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        counts = {}
+
+        # records are sent whole, since the operation which failed may need any of their fields
+        sender = EntityBatchSender(self.entity_queue, collection_table,
+                                   batch_size=config.get('transport_batch_size', DEFAULT_TRANSPORT_BATCH_SIZE))
+
+        for record in read_failure_journal(self.replay_file_name):
+            if drain_event.is_set():
+                collection_worker_logger.warning('Draining, the rest of [%s] will not be replayed' % (
+                    self.replay_file_name))
+                break
+
+            if record.get('org') not in [None, config.get('org')]:
+                collection_worker_logger.warning('Skipping record of org [%s] for entity [%s]' % (
+                    record.get('org'), (record.get('entity') or {}).get('uuid')))
+                continue
+
+            if record.get('kind') not in [KIND_ENTITY, KIND_EDGE] or record.get('entity') is None:
+                collection_worker_logger.warning('Skipping unknown record: %s' % json.dumps(record))
+                continue
+
+            sender.add(record.get('app'), record.get('collection'), sender.encode(record))
+
+            counts[record.get('kind')] = counts.get(record.get('kind'), 0) + 1
+
+        sender.flush()
+
+        collection_worker_logger.warning('Finished replaying [%s]: %s' % (self.replay_file_name, counts))
+
+
+def get_source_collection_url(app, collection_name, time_slice=None, watermark=None):
+    # added a flag for using graph vs query/index
+    if config.get('graph', False):
+        return collection_graph_url_template.format(org=config.get('org'),
+                                                    app=app,
+                                                    collection=collection_name,
+                                                    limit=config.get('limit'),
+                                                    **config.get('source_endpoint'))
+
+    predicates = []
+    order_field = None
+
+    if time_slice is not None:
+        time_slice = time_slice.copy()
+        order_field = time_slice.get('field')
+
+        # resume the slice from the checkpoint watermark
+        if watermark is not None:
+            time_slice['start'] = max(time_slice.get('start'), watermark)
+
+        predicates.append(time_slice_predicate(time_slice))
+
+    elif watermark is not None:
+        order_field = 'created'
+        predicates.append(watermark_predicate(order_field, watermark))
+
+    delta_since = get_delta_watermark(app, collection_name)
+
+    if delta_since is not None:
+        predicates.append(delta_predicate_template.format(min_modified=delta_since,
+                                                          max_modified=config.get('max_modified')))
+
+    # the predicates are added to the where clause of --ql, and a checkpointed scan is ordered by its tracked field
+    if len(predicates) > 0:
+        ql = scan_ql(config.get('ql'), predicates, order_field)
+    else:
+        ql = "select * %s" % config.get('ql')
+
+    return collection_query_url_template.format(org=config.get('org'),
+                                                app=app,
+                                                collection=collection_name,
+                                                limit=config.get('limit'),
+                                                ql=ql,
+                                                **config.get('source_endpoint'))
+
+
+def get_collection_slices(app, collection_name):
+    """
+    Splits a collection into --collection_slices ranges of the --slice_field timestamp so that each range can be
+    scanned by a different collection worker.  The ranges are sized from the min/max of the field in the collection.
+
+    :return: an array of time slices, empty if the collection should be scanned as a whole
+    """
+    if config.get('collection_slices', 1) <= 1 or config.get('graph', False):
+        return []
+
+    field = config.get('slice_field')
+
+    def build_query_url(ql):
+        return collection_query_url_template.format(org=config.get('org'),
+                                                    app=app,
+                                                    collection=collection_name,
+                                                    limit=1,
+                                                    ql=ql,
+                                                    **config.get('source_endpoint'))
+
+    min_value, max_value = get_field_range(session_source, build_query_url, field)
+
+    time_slices = build_time_slices(min_value, max_value, config.get('collection_slices'), field)
+
+    logger.info('Split collection [%s / %s] into [%s] slices by [%s] from [%s] to [%s]' % (
+        app, collection_name, len(time_slices), field, min_value, max_value))
+
+    return time_slices
+
+
+def load_delta_watermarks(status_file_name):
+    """
+    Reads the status file of a previous run and determines the modified timestamp from which each app/collection needs
+    to be migrated again.  If every scan (or time slice) of a collection finished then this is the earliest bound the
+    scans recorded when they started (see get_delta_bound).  The highest modified timestamp seen is not used because
+    the scans are ordered by created, so an entity scanned early and modified later in the run may have a lower
+    modified timestamp.  Otherwise the scan may not have reached all modified entities, so the watermark the previous
+    run started from is kept instead (no watermark means a full scan).  A scan which was drained or stalled stopped
+    early, so it is treated as unfinished.
+
+    :return: a dict of app -> collection -> modified watermark
+    """
+    with open(status_file_name, 'r') as f:
+        org_results = json.load(f)
+
+    collection_entries = {}
+
+    for app, app_data in org_results.get('apps', {}).iteritems():
+        for status_key, collection_data in app_data.get('collections', {}).iteritems():
+            collection_name = collection_data.get('collection', status_key)
+            collection_entries.setdefault((app, collection_name), []).append(collection_data)
+
+    watermarks = {}
+
+    for (app, collection_name), entries in collection_entries.iteritems():
+        # status files written before the bound was recorded are treated like unfinished scans
+        if len([e for e in entries if 'iteration_finished' not in e or e.get('delta_until') is None
+                or e.get('drained')]) == 0:
+            watermark = min([e.get('delta_until') for e in entries])
+        else:
+            previous_watermarks = [e.get('delta_since') for e in entries]
+            watermark = None if None in previous_watermarks else min(previous_watermarks)
+
+        if watermark is not None and watermark >= 0:
+            watermarks.setdefault(app, {})[collection_name] = watermark
+
+    return watermarks
+
+
+def get_delta_bound():
+    """
+    :return: the modified timestamp up to which a scan starting now sees every modified entity, which is the bound of
+    its query or the current time less --delta_skew_margin for the clocks of the Usergrid nodes, whichever is lower
+    """
+    return min(config.get('max_modified'), long(time.time() * 1000) - config.get('delta_skew_margin', 0))
+
+
+def get_delta_watermark(app, collection_name):
+    """
+    :return: the modified timestamp after which entities of the app/collection are migrated, None for a full scan
+    """
+    watermark = config.get('delta_watermarks', {}).get(app, {}).get(collection_name)
+
+    if watermark is None and config.get('min_modified', 0) > 0:
+        watermark = config.get('min_modified')
+
+    return watermark
+
+
+def get_checkpoint_key(app, collection_name, time_slice=None):
+    return checkpoint_key(key_version, config.get('org'), config.get('migrate'), app, collection_name, time_slice)
+
+
+def load_checkpoint(app, collection_name, time_slice=None):
+    try:
+        return checkpoint_store.load(get_checkpoint_key(app, collection_name, time_slice))
+    except:
+        logger.exception('Error loading checkpoint for app/collection [%s / %s]' % (app, collection_name))
+
+    return None
+
+
+def save_checkpoint(app, collection_name, time_slice, checkpoint):
+    try:
+        checkpoint_store.save(get_checkpoint_key(app, collection_name, time_slice), checkpoint)
+        logger.debug('Saved checkpoint for app/collection [%s / %s]: %s' % (app, collection_name, checkpoint))
+    except:
+        logger.exception('Error saving checkpoint for app/collection [%s / %s]' % (app, collection_name))
+
+
+def complete_checkpoint(app, collection_name, time_slice=None):
+    checkpoint = load_checkpoint(app, collection_name, time_slice)
+
+    if checkpoint is None:
+        return
+
+    completed = mark_complete(checkpoint)
+
+    if completed is None:
+        logger.warning('The scan of app/collection [%s / %s] did not finish, use --resume to continue it from %s' % (
+            app, time_slice_label(collection_name, time_slice), checkpoint.get('watermark')))
+        return
+
+    save_checkpoint(app, collection_name, time_slice, completed)
+
+
+def get_ack_key(ack_channel):
+    return run_key(key_version, config.get('org'), config.get('migrate'), config.get('run_id'), 'acks:%s' % ack_channel)
+
+
+def send_ack(tag):
+    """
+    Acknowledges a batch whose entities have all been processed to the collection worker which sent it
+    """
+    ack_channel, scan_id, batch = tag
+
+    # the collection workers of a distributed run may be on another host
+    if isinstance(ack_channel, int):
+        ack_queues[ack_channel].put((scan_id, batch))
+    else:
+        redis_client.rpush(get_ack_key(ack_channel), json.dumps([scan_id, batch]))
+
+
+def read_acks(ack_channel):
+    """
+    :return: the (scan_id, batch) acknowledgements received by a collection worker since the last call
+    """
+    acks = []
+
+    if ack_channel is None:
+        return acks
+
+    if isinstance(ack_channel, int):
+        try:
+            while True:
+                acks.append(ack_queues[ack_channel].get_nowait())
+        except Empty:
+            pass
+
+        return acks
+
+    pipe = redis_client.pipeline()
+    pipe.lrange(get_ack_key(ack_channel), 0, -1)
+    pipe.delete(get_ack_key(ack_channel))
+
+    return [tuple(json.loads(value)) for value in pipe.execute()[0]]
+
+
+def get_entity_queue_depth(entity_queue):
+    """
+    :return: the approximate number of entities on the entity queue, each message of which is a batch of entities
+    """
+    if QSIZE_OK:
+        return entity_queue.qsize() * config.get('transport_batch_size', DEFAULT_TRANSPORT_BATCH_SIZE)
+
+    # assume the queue is full when the depth is not available
+    return config.get('queue_size_max')
+
+
+def get_query_iterator(query_url, page_delay=0, read_ahead=0):
+    return PrefetchingQueryIterator(query_url,
+                                    page_delay=page_delay,
+                                    sleep_time=config.get('error_retry_sleep'),
+                                    read_ahead=read_ahead,
+                                    max_attempts=config.get('page_max_attempts') or None,
+                                    session=session_source)
+
+
+def get_collection_iterator(source_collection_url):
+    # prefetch pages in the background when read-ahead is configured
+    return get_query_iterator(source_collection_url,
+                              page_delay=config.get('page_sleep_time'),
+                              read_ahead=config.get('read_ahead', 0))
+
 
 def use_name_for_collection(collection_name):
     return collection_name in config.get('use_name_for_collection', [])
@@ -586,13 +1301,13 @@ def confirm_user_entity(app, source_entity, attempts=0):
                                                        uuid=source_entity.get('username'),
                                                        **config.get('source_endpoint'))
 
-    if attempts >= 5:
+    if attempts >= config.get('max_attempts', 5):
         logger.warning('Punting after [%s] attempts to confirm user at URL [%s], will use the source entity...' % (
             attempts, source_entity_url))
 
         return source_entity
 
-    r = requests.get(url=source_entity_url)
+    r = session_source.get(url=source_entity_url)
 
     if r.status_code == 200:
         retrieved_entity = r.json().get('entities')[0]
@@ -615,14 +1330,23 @@ def confirm_user_entity(app, source_entity, attempts=0):
         logger.error('After [%s] attempts to confirm user at URL [%s], received status [%s] message: %s...' % (
             attempts, source_entity_url, r.status_code, r.text))
 
-        time.sleep(DEFAULT_RETRY_SLEEP)
+        raise TransientError('HTTP [%s] confirming user at URL [%s]' % (r.status_code, source_entity_url))
 
-        return confirm_user_entity(app, source_entity, attempts)
 
-
-def create_connection(app, collection_name, source_entity, edge_name, target_entity):
+def get_create_connection_url(app, collection_name, source_entity, edge_name, target_entity):
     target_app, target_collection, target_org = get_target_mapping(app, collection_name)
 
+    # records of the failure journal from the loader or the export diff only have the uuid of the target
+    if target_entity.get('type') is None:
+        return connection_create_by_uuid_url_template.format(
+                org=target_org,
+                app=target_app,
+                collection=target_collection,
+                uuid=source_entity.get('uuid'),
+                verb=edge_name,
+                target_uuid=target_entity.get('uuid'),
+                **config.get('target_endpoint'))
+
     source_identifier = get_source_identifier(source_entity)
     target_identifier = get_source_identifier(target_entity)
 
@@ -650,7 +1374,7 @@ def create_connection(app, collection_name, source_entity, edge_name, target_ent
         else:
             target_type_id = '%s/%s' % ('receipts', target_entity.get('uuid'))
 
-    create_connection_url = connection_create_by_pairs_url_template.format(
+    return connection_create_by_pairs_url_template.format(
             org=target_org,
             app=target_app,
             source_type_id=source_type_id,
@@ -658,6 +1382,14 @@ def create_connection(app, collection_name, source_entity, edge_name, target_ent
             target_type_id=target_type_id,
             **config.get('target_endpoint'))
 
+
+def create_connection(app, collection_name, source_entity, edge_name, target_entity):
+    target_app, target_collection, target_org = get_target_mapping(app, collection_name)
+
+    source_identifier = get_source_identifier(source_entity)
+
+    create_connection_url = get_create_connection_url(app, collection_name, source_entity, edge_name, target_entity)
+
     if not config.get('skip_cache_read', False):
         processed = cache.get(create_connection_url)
 
@@ -666,6 +1398,7 @@ def create_connection(app, collection_name, source_entity, edge_name, target_ent
                 app, collection_name, source_identifier, edge_name, target_app, target_entity.get('type'),
                 target_entity.get('name'), create_connection_url))
 
+            count_edge('skipped')
             return True
 
     logger.info('Connecting entity [%s / %s / %s] --[%s]--> [%s / %s / %s]: %s ' % (
@@ -684,23 +1417,34 @@ def create_connection(app, collection_name, source_entity, edge_name, target_ent
             if not config.get('skip_cache_write', False):
                 cache.set(create_connection_url, 1)
 
+            count_edge('created')
             return True
         else:
             if r_create.status_code >= 500:
 
                 if attempts < 5:
-                    logger.warning('FAILED [%s] (will retry) to create connection at URL=[%s]: %s' % (
-                        r_create.status_code, create_connection_url, r_create.text))
-                    time.sleep(DEFAULT_RETRY_SLEEP)
+                    backoff = get_retry_backoff(attempts)
+
+                    logger.warning('FAILED [%s] (will retry in [%.1f]s) to create connection at URL=[%s]: %s' % (
+                        r_create.status_code, backoff, create_connection_url, r_create.text))
+
+                    # only this edge waits, the other edges of the entity are created by other threads meanwhile
+                    time.sleep(backoff)
                 else:
                     logger.critical(
                             'FAILED [%s] (WILL NOT RETRY - max attempts) to create connection at URL=[%s]: %s' % (
                                 r_create.status_code, create_connection_url, r_create.text))
+
+                    write_failure(KIND_EDGE, 'create_connection', app, collection_name, source_entity,
+                                  'HTTP [%s] after [%s] attempts: %s' % (r_create.status_code, attempts, r_create.text),
+                                  attempts=attempts, edge_name=edge_name, target_entity=target_entity)
+                    count_edge('failed')
                     return False
 
             elif r_create.status_code in [401, 404]:
 
-                if config.get('repair_data', False):
+                # an entity reference from an export or diff record does not have the data to repair the target with
+                if config.get('repair_data', False) and target_entity.get('type') is not None:
                     logger.warning('FAILED [%s] (WILL attempt repair) to create connection at URL=[%s]: %s' % (
                         r_create.status_code, create_connection_url, r_create.text))
                     migrate_data(app, source_entity.get('type'), source_entity, force=True)
@@ -714,13 +1458,129 @@ def create_connection(app, collection_name, source_entity, edge_name, target_ent
                 logger.warning('FAILED [%s] (will retry) to create connection at URL=[%s]: %s' % (
                     r_create.status_code, create_connection_url, r_create.text))
 
+    write_failure(KIND_EDGE, 'create_connection', app, collection_name, source_entity,
+                  'HTTP [%s] after [%s] attempts: %s' % (r_create.status_code, attempts, r_create.text),
+                  attempts=attempts, edge_name=edge_name, target_entity=target_entity)
+    count_edge('failed')
     return False
 
 
+def get_retry_backoff(attempts):
+    return get_backoff(attempts, config.get('retry_backoff_base', 1.0), config.get('retry_backoff_max', 60.0))
+
+
+def count_edge(outcome):
+    with edge_stats_lock:
+        edge_stats[outcome] += 1
+
+    metrics.inc('usergrid_edges_total', outcome=outcome)
+
+
+def log_edge_stats(start_time):
+    with edge_stats_lock:
+        stats = edge_stats.copy()
+
+    if stats['created'] + stats['skipped'] + stats['failed'] == 0:
+        return
+
+    total_time = max(time.time() - start_time, 1)
+
+    worker_logger.info('Edge stats: created=[%s] skipped=[%s] failed=[%s] - [%.1f] edges created/sec' % (
+        stats['created'], stats['skipped'], stats['failed'], stats['created'] / total_time))
+
+
+def get_edge_pool():
+    pool = getattr(edge_pools, 'pool', None)
+
+    if pool is None:
+        pool = ThreadPool(config.get('edge_concurrency'))
+        edge_pools.pool = pool
+
+    return pool
+
+
+def create_pooled_connection(app, collection_name, source_entity, edge_name, target_entity):
+    """
+    Creates a connection on a thread of an edge pool.  An error is recorded as a failure of the edge instead of being
+    raised, since it would be raised by the map of the pool and discard the results of the other edges.
+    """
+    try:
+        return create_connection(app, collection_name, source_entity, edge_name, target_entity)
+
+    except Exception, e:
+        logger.exception('Error creating connection [%s / %s / %s] --[%s]--> [%s]' % (
+            app, collection_name, source_entity.get('uuid'), edge_name, target_entity.get('uuid')))
+
+        write_failure(KIND_EDGE, 'create_connection', app, collection_name, source_entity, str(e),
+                      edge_name=edge_name, target_entity=target_entity)
+        count_edge('failed')
+        return False
+
+
+class GraphResult(object):
+    """
+    Yielded by a graph traversal step as its final value, in place of a return value
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+def run_graph_steps(steps):
+    """
+    Runs a graph traversal using an explicit stack of generators instead of recursion.  Each step of the traversal is a
+    generator which yields the generator of a child step in order to run it, receiving the child's result as the value
+    of the yield, and finally yields a GraphResult.  Nodes and edges are visited in exactly the same depth-first order as
+    the equivalent recursive calls, but the Python stack does not grow with the graph depth.  The stack holds at most
+    one frame per node and edge type on the current path, so its size is bounded by 2 * graph_depth + 1 frames, each of
+    which holds at most one page of its connection query.
+
+    :param steps: the generator of the root step, such as migrate_graph_steps(...)
+    :return: the result of the root step
+    """
+    stack = [steps]
+    result = None
+    error = None
+
+    while len(stack) > 0:
+        try:
+            if error is not None:
+                # an exception in a child step is raised at the yield in its parent, as it would be by a call
+                step = stack[-1].throw(*error)
+                error = None
+            else:
+                step = stack[-1].send(result)
+
+        except StopIteration:
+            stack.pop()
+            result = True
+            continue
+
+        except Exception:
+            stack.pop()
+
+            if len(stack) == 0:
+                raise
+
+            error = sys.exc_info()
+            continue
+
+        if isinstance(step, GraphResult):
+            stack.pop().close()
+            result = step.value
+        else:
+            stack.append(step)
+            result = None
+
+    return result
+
+
 def process_edges(app, collection_name, source_entity, edge_name, connection_stack):
 
     source_identifier = get_source_identifier(source_entity)
 
+    target_entities = []
+
     while len(connection_stack) > 0:
 
         target_entity = connection_stack.pop()
@@ -730,12 +1590,35 @@ def process_edges(app, collection_name, source_entity, edge_name, connection_sta
                 app, collection_name, source_identifier, edge_name ))
             continue
 
-        create_connection(app, collection_name, source_entity, edge_name, target_entity)
+        target_entities.append(target_entity)
+
+    # load the visited markers for all the edges with a single round trip
+    if not config.get('skip_cache_read', False):
+        cache.prefetch([get_create_connection_url(app, collection_name, source_entity, edge_name, target_entity)
+                        for target_entity in target_entities])
+
+    if config.get('edge_concurrency', 1) <= 1 or len(target_entities) <= 1:
+        for target_entity in target_entities:
+            create_connection(app, collection_name, source_entity, edge_name, target_entity)
+
+        return
+
+    # the connections are created concurrently, so the order in which they are created is not preserved
+    get_edge_pool().map(
+            lambda target_entity: create_pooled_connection(app, collection_name, source_entity, edge_name,
+                                                           target_entity),
+            target_entities,
+            chunksize=1)
 
 
 def migrate_out_graph_edge_type(app, collection_name, source_entity, edge_name, depth=0):
+    return run_graph_steps(migrate_out_graph_edge_type_steps(app, collection_name, source_entity, edge_name, depth))
+
+
+def migrate_out_graph_edge_type_steps(app, collection_name, source_entity, edge_name, depth=0):
     if not include_edge(collection_name, edge_name):
-        return True
+        yield GraphResult(True)
+        return
 
     source_uuid = source_entity.get('uuid')
 
@@ -747,7 +1630,8 @@ def migrate_out_graph_edge_type(app, collection_name, source_entity, edge_name,
         if date_visited not in [None, 'None']:
             logger.info('Skipping EDGE [%s / %s --%s-->] - visited at %s' % (
                 collection_name, source_uuid, edge_name, date_visited))
-            return True
+            yield GraphResult(True)
+            return
         else:
             cache.delete(key)
 
@@ -777,15 +1661,18 @@ def migrate_out_graph_edge_type(app, collection_name, source_entity, edge_name,
             limit=config.get('limit'),
             **config.get('source_endpoint'))
 
-    connection_query = UsergridQueryIterator(connection_query_url, sleep_time=config.get('error_retry_sleep'))
+    connection_query = get_query_iterator(connection_query_url)
 
+    # targets are handed to process_edges in chunks of at most graph_edge_buffer entities as the scan proceeds rather
+    # than after all of the edges of the type have been read
+    edge_buffer_size = max(config.get('graph_edge_buffer', 1000), 1)
     connection_stack = []
 
     for target_entity in connection_query:
         target_connection_collection = config.get('collection_mapping', {}).get(target_entity.get('type'),
                                                                                 target_entity.get('type'))
 
-        target_ok = migrate_graph(app, target_entity.get('type'), source_entity=target_entity, depth=depth)
+        target_ok = yield migrate_graph_steps(app, target_entity.get('type'), source_entity=target_entity, depth=depth)
 
         if not target_ok:
             logger.critical(
@@ -796,9 +1683,12 @@ def migrate_out_graph_edge_type(app, collection_name, source_entity, edge_name,
         count_edges += 1
         connection_stack.append(target_entity)
 
+        if len(connection_stack) >= edge_buffer_size:
+            process_edges(app, collection_name, source_entity, edge_name, connection_stack)
+
     process_edges(app, collection_name, source_entity, edge_name, connection_stack)
 
-    return response
+    yield GraphResult(response)
 
 
 def get_source_identifier(source_entity):
@@ -847,6 +1737,10 @@ def exclude_collection(collection_name):
 
 
 def migrate_in_graph_edge_type(app, collection_name, source_entity, edge_name, depth=0):
+    return run_graph_steps(migrate_in_graph_edge_type_steps(app, collection_name, source_entity, edge_name, depth))
+
+
+def migrate_in_graph_edge_type_steps(app, collection_name, source_entity, edge_name, depth=0):
     source_uuid = source_entity.get('uuid')
     key = '%s:edges:in:%s:%s' % (key_version, source_uuid, edge_name)
 
@@ -856,7 +1750,8 @@ def migrate_in_graph_edge_type(app, collection_name, source_entity, edge_name, d
         if date_visited not in [None, 'None']:
             logger.info('Skipping EDGE [--%s--> %s / %s] - visited at %s' % (
                 collection_name, source_uuid, edge_name, date_visited))
-            return True
+            yield GraphResult(True)
+            return
         else:
             cache.delete(key)
 
@@ -870,10 +1765,12 @@ def migrate_in_graph_edge_type(app, collection_name, source_entity, edge_name, d
 
     if exclude_collection(collection_name):
         logger.debug('Excluding (Collection) entity [%s / %s / %s]' % (app, collection_name, source_uuid))
-        return True
+        yield GraphResult(True)
+        return
 
     if not include_edge(collection_name, edge_name):
-        return True
+        yield GraphResult(True)
+        return
 
     logger.debug(
             'Processing edge type=[%s] of entity [%s / %s / %s]' % (edge_name, app, collection_name, source_identifier))
@@ -890,7 +1787,7 @@ def migrate_in_graph_edge_type(app, collection_name, source_entity, edge_name, d
             limit=config.get('limit'),
             **config.get('source_endpoint'))
 
-    connection_query = UsergridQueryIterator(connecting_query_url, sleep_time=config.get('error_retry_sleep'))
+    connection_query = get_query_iterator(connecting_query_url)
 
     response = True
 
@@ -898,12 +1795,17 @@ def migrate_in_graph_edge_type(app, collection_name, source_entity, edge_name, d
         logger.debug('Triggering IN->OUT edge migration on entity [%s / %s / %s] ' % (
             app, e_connection.get('type'), e_connection.get('uuid')))
 
-        response = migrate_graph(app, e_connection.get('type'), e_connection, depth) and response
+        target_ok = yield migrate_graph_steps(app, e_connection.get('type'), e_connection, depth)
+        response = target_ok and response
 
-    return response
+    yield GraphResult(response)
 
 
 def migrate_graph(app, collection_name, source_entity, depth=0):
+    return run_graph_steps(migrate_graph_steps(app, collection_name, source_entity, depth))
+
+
+def migrate_graph_steps(app, collection_name, source_entity, depth=0):
     depth += 1
     source_uuid = source_entity.get('uuid')
 
@@ -911,13 +1813,15 @@ def migrate_graph(app, collection_name, source_entity, depth=0):
     if depth > config.get('graph_depth', 1):
         logger.debug(
                 'Reached Max Graph Depth, stopping after [%s] on [%s / %s]' % (depth, collection_name, source_uuid))
-        return True
+        yield GraphResult(True)
+        return
     else:
         logger.debug('Processing @ Graph Depth [%s]' % depth)
 
     if exclude_collection(collection_name):
         logger.warn('Ignoring entity in filtered collection [%s]' % collection_name)
-        return True
+        yield GraphResult(True)
+        return
 
     key = '%s:graph:%s' % (key_version, source_uuid)
     entity_tag = '[%s / %s / %s (%s)]' % (app, collection_name, source_uuid, get_uuid_time(source_uuid))
@@ -927,7 +1831,8 @@ def migrate_graph(app, collection_name, source_entity, depth=0):
 
         if date_visited not in [None, 'None']:
             logger.debug('Skipping GRAPH %s at %s' % (entity_tag, date_visited))
-            return True
+            yield GraphResult(True)
+            return
         else:
             cache.delete(key)
 
@@ -949,7 +1854,8 @@ def migrate_graph(app, collection_name, source_entity, depth=0):
     for edge_name in out_edge_names:
 
         if not exclude_edge(collection_name, edge_name):
-            response = migrate_out_graph_edge_type(app, collection_name, source_entity, edge_name, depth) and response
+            edge_ok = yield migrate_out_graph_edge_type_steps(app, collection_name, source_entity, edge_name, depth)
+            response = edge_ok and response
 
         if config.get('prune', False):
             prune_edge_by_name(edge_name, app, collection_name, source_entity)
@@ -963,10 +1869,10 @@ def migrate_graph(app, collection_name, source_entity, depth=0):
     for edge_name in in_edge_names:
 
         if not exclude_edge(collection_name, edge_name):
-            response = migrate_in_graph_edge_type(app, collection_name, source_entity, edge_name,
-                                                  depth) and response
+            edge_ok = yield migrate_in_graph_edge_type_steps(app, collection_name, source_entity, edge_name, depth)
+            response = edge_ok and response
 
-    return response
+    yield GraphResult(response)
 
 
 def collect_entities(q):
@@ -1008,10 +1914,10 @@ def prune_edge_by_name(edge_name, app, collection_name, source_entity):
             **config.get('source_endpoint'))
 
     source_connections = collect_entities(
-            UsergridQueryIterator(source_connection_query_url, sleep_time=config.get('error_retry_sleep')))
+            get_query_iterator(source_connection_query_url))
 
     target_connections = collect_entities(
-            UsergridQueryIterator(target_connection_query_url, sleep_time=config.get('error_retry_sleep')))
+            get_query_iterator(target_connection_query_url))
 
     delete_uuids = Set(target_connections.keys()) - Set(source_connections.keys())
 
@@ -1125,63 +2031,307 @@ def migrate_permissions(app, collection_name, source_entity, attempts=0):
 
     perm_response = r.json()
 
-    perms = perm_response.get('data', [])
+    perms = perm_response.get('data', [])
+
+    logger.info('Migrating [%s / %s] with permissions %s' % (collection_name, source_identifier, perms))
+
+    if len(perms) > 0:
+        target_permissions_url = permissions_url_template.format(org=target_org,
+                                                                 app=target_app,
+                                                                 collection=target_collection,
+                                                                 uuid=source_identifier,
+                                                                 **config.get('target_endpoint'))
+
+        for permission in perms:
+            data = {'permission': permission}
+
+            logger.info('Posting permission %s to %s' % (json.dumps(data), target_permissions_url))
+
+            r = session_target.post(target_permissions_url, json.dumps(data))
+
+            if r.status_code != 200:
+                logger.error(
+                        'ERROR posting permission %s to URL=[%s]: %s' % (
+                            json.dumps(data), target_permissions_url, r.text))
+
+    return True
+
+
+def is_entity_unchanged(app, collection_name, source_entity):
+    """
+    :return: True if the entity was migrated at its current modified timestamp or a later one, or with --content_hash
+    if its content is unchanged.  An entity modified since it was migrated, such as one selected by a delta scan, is
+    written again.
+    """
+    try:
+        value = cache.get(source_entity.get('uuid'))
+        modified = parse_cache_value(value)[0]
+
+        if modified is not None:
+
+            logger.debug('FOUND CACHE: %s = %s ' % (source_entity.get('uuid'), modified))
+
+            if is_cached_unchanged(value, source_entity, use_hash=config.get('content_hash', False)):
+
+                modified_date = datetime.datetime.utcfromtimestamp(modified / 1000)
+                e_uuid = source_entity.get('uuid')
+
+                uuid_datetime = time_uuid.TimeUUID(e_uuid).get_datetime()
+
+                logger.debug('Skipping ENTITY: %s / %s / %s / %s (%s) / %s (%s)' % (
+                    config.get('org'), app, collection_name, e_uuid, uuid_datetime, modified, modified_date))
+                return True
+
+            else:
+                logger.debug('DELETING CACHE: %s ' % (source_entity.get('uuid')))
+                cache.delete(source_entity.get('uuid'))
+    except:
+        logger.error('Error on checking cache for uuid=[%s]' % source_entity.get('uuid'))
+        logger.error(traceback.format_exc())
+
+    return False
+
+
+def cache_entity_modified(source_entity):
+    if not config.get('skip_cache_write', False):
+        logger.debug('SETTING CACHE | uuid=[%s] | modified=[%s]' % (
+            source_entity.get('uuid'), str(source_entity.get('modified'))))
+
+        cache.set(source_entity.get('uuid'), cache_value(source_entity, with_hash=config.get('content_hash', False)))
+
+
+def find_identical_in_target(app, collection_name, source_entities):
+    """
+    Fetches the target copies of the entities, content_hash_query_size at a time with a query on their uuids, and
+    compares their content hashes to those of the source entities
+
+    :return: the set of uuids of the source entities which are identical in the target
+    """
+    target_app, target_collection, target_org = get_target_mapping(app, collection_name)
+
+    source_hashes = dict([(e.get('uuid'), content_hash(e)) for e in source_entities])
+    uuids = source_hashes.keys()
+    identical = set()
+
+    for start in xrange(0, len(uuids), content_hash_query_size):
+        chunk = uuids[start:start + content_hash_query_size]
+
+        ql = 'select * where %s' % ' or '.join([uuid_predicate_template.format(uuid=u) for u in chunk])
+
+        target_query_url = collection_query_url_template.format(org=target_org,
+                                                                app=target_app,
+                                                                collection=target_collection,
+                                                                ql=ql,
+                                                                limit=len(chunk),
+                                                                **config.get('target_endpoint'))
+
+        try:
+            r = session_target.get(target_query_url)
+
+            if r.status_code != 200:
+                logger.warning('Failure [%s] comparing [%s] entities to the target at url=[%s]: %s' % (
+                    r.status_code, len(chunk), target_query_url, r.text))
+                continue
+
+            for target_entity in r.json().get('entities', []):
+                if source_hashes.get(target_entity.get('uuid')) == content_hash(target_entity):
+                    identical.add(target_entity.get('uuid'))
+
+        except:
+            logger.exception('Error comparing [%s] entities to the target at url=[%s]' % (
+                len(chunk), target_query_url))
+
+    logger.debug('find_identical_in_target | entities=[%s] | identical=[%s] | app/collection=[%s / %s]' % (
+        len(source_entities), len(identical), app, collection_name))
+
+    return identical
+
+
+def migrate_data_batch(app, collection_name, source_entities):
+    """
+    Writes a batch of entities from the same app/collection to the target with a single POST of an entity array.
+    Any entity which is not confirmed in the response of the bulk write falls back to migrate_data so that the
+    retry, conflict and repair handling still applies to it individually.
+
+    :return: the number of entities which were processed successfully
+    """
+    if config.get('skip_data'):
+        return len(source_entities)
+
+    if exclude_collection(collection_name):
+        logger.warn('Excluding [%s] entities in filtered collection [%s]' % (len(source_entities), collection_name))
+        return len(source_entities)
+
+    # users, roles and groups need confirmation, credentials or permissions per entity
+    if collection_name in ['users', 'user', 'roles', 'role', 'groups', 'group'] or len(source_entities) == 1:
+        return len([e for e in source_entities if migrate_data(app, collection_name, e)])
+
+    count_processed = 0
+    pending_entities = []
+
+    if not config.get('skip_cache_read', False):
+        cache.prefetch([e.get('uuid') for e in source_entities])
+
+    for source_entity in source_entities:
+        if not config.get('skip_cache_read', False) and is_entity_unchanged(app, collection_name, source_entity):
+            count_processed += 1
+        else:
+            pending_entities.append(source_entity)
+
+    if config.get('content_hash') and len(pending_entities) > 0:
+        identical = find_identical_in_target(app, collection_name, pending_entities)
+
+        for source_entity in [e for e in pending_entities if e.get('uuid') in identical]:
+            cache_entity_modified(source_entity)
+            count_processed += 1
+
+        pending_entities = [e for e in pending_entities if e.get('uuid') not in identical]
+
+    if len(pending_entities) == 0:
+        return count_processed
+
+    entity_copies = []
+
+    for source_entity in pending_entities:
+        entity_copy = source_entity.copy()
+
+        if 'metadata' in entity_copy:
+            entity_copy.pop('metadata')
+
+        entity_copies.append(entity_copy)
+
+    target_app, target_collection, target_org = get_target_mapping(app, collection_name)
+
+    target_collection_url = collection_url_template.format(org=target_org,
+                                                           app=target_app,
+                                                           collection=target_collection,
+                                                           **config.get('target_endpoint'))
+
+    written_uuids = set()
+
+    try:
+        r = session_target.post(url=target_collection_url, data=json.dumps(entity_copies))
+
+        if r.status_code == 200:
+            written_uuids = set([e.get('uuid') for e in r.json().get('entities', [])])
+        else:
+            logger.warning('Failure [%s] on bulk POST of [%s] entities to url=[%s], falling back to PUT: %s' % (
+                r.status_code, len(entity_copies), target_collection_url, r.text))
+
+    except:
+        logger.error(traceback.format_exc())
+        logger.error('error in migrate_data_batch on [%s] entities at url=[%s], falling back to PUT' % (
+            len(entity_copies), target_collection_url))
+
+    logger.info('migrate_data_batch | entities=[%s] | written=[%s] | app/collection=[%s / %s]' % (
+        len(pending_entities), len(written_uuids), app, collection_name))
+
+    for source_entity in pending_entities:
+        if source_entity.get('uuid') in written_uuids:
+            cache_entity_modified(source_entity)
+            count_processed += 1
+
+        elif migrate_data(app, collection_name, source_entity, defer=True, compared=True):
+            count_processed += 1
+
+    return count_processed
+
+
+def migrate_data(app, collection_name, source_entity, attempts=0, force=False, defer=False, compared=False):
+    """
+    Migrates the data of an entity.  A transient failure is retried after an exponential backoff.  With defer, inside
+    an entity worker, the retry is scheduled and False is returned so that the worker can continue with other
+    entities.  Otherwise this waits for the backoff, so that a caller such as migrate_graph or the repair of a
+    connection can rely on the entity having been written when this returns True.  Entities which exhaust
+    --max_attempts are written to the dead letter file.
+
+    With --content_hash the entity is compared with its target copy before the first attempt only, and not at all when
+    compared is set because the caller has already compared it.  Force bypasses the cache but not this comparison.
+    """
+    if attempts == 0 and not compared and is_identical_in_target(app, collection_name, source_entity, force=force):
+        logger.debug('Skipping ENTITY identical in target: %s / %s / %s' % (
+            config.get('org'), app, source_entity.get('uuid')))
+
+        cache_entity_modified(source_entity)
+        return True
+
+    while True:
+        try:
+            return migrate_data_attempt(app, collection_name, source_entity, attempts, force)
+
+        except TransientError, e:
+            attempts += 1
+
+            if attempts >= config.get('max_attempts', 5):
+                logger.critical(
+                        'ABORT migrate_data | success=[%s] | attempts=[%s] | created=[%s] | modified=[%s] %s / %s / %s' % (
+                            False, attempts, source_entity.get('created'), source_entity.get('modified'), app,
+                            collection_name, source_entity.get('uuid')))
+
+                write_failure(KIND_ENTITY, 'migrate_data', app, collection_name, source_entity, str(e),
+                              attempts=attempts)
+                return False
 
-    logger.info('Migrating [%s / %s] with permissions %s' % (collection_name, source_identifier, perms))
+            if defer and retry_scheduler is not None:
+                delay = retry_scheduler.schedule((app, collection_name, source_entity, attempts, force), attempts,
+                                                 key=id(source_entity))
 
-    if len(perms) > 0:
-        target_permissions_url = permissions_url_template.format(org=target_org,
-                                                                 app=target_app,
-                                                                 collection=target_collection,
-                                                                 uuid=source_identifier,
-                                                                 **config.get('target_endpoint'))
+                logger.warn('Scheduled attempt [%s] of migrate_data on [%s / %s / %s] in [%.1f]s: %s' % (
+                    attempts, app, collection_name, source_entity.get('uuid'), delay, e))
 
-        for permission in perms:
-            data = {'permission': permission}
+                return False
 
-            logger.info('Posting permission %s to %s' % (json.dumps(data), target_permissions_url))
+            time.sleep(get_retry_backoff(attempts))
 
-            r = session_target.post(target_permissions_url, json.dumps(data))
 
-            if r.status_code != 200:
-                logger.error(
-                        'ERROR posting permission %s to URL=[%s]: %s' % (
-                            json.dumps(data), target_permissions_url, r.text))
+def is_identical_in_target(app, collection_name, source_entity, force=False):
+    """
+    :return: True if --content_hash is set and the target copy of the entity has the same content.  Entities which
+    migrate_data_attempt would skip anyway are not compared, to save the query.  This is one query per entity, the
+    batch path of --batch_size compares up to content_hash_query_size entities per query.
+    """
+    # users, roles and groups are always written so that their credentials and permissions are migrated too
+    if not config.get('content_hash') or collection_name in ['users', 'user', 'roles', 'role', 'groups', 'group']:
+        return False
 
-    return True
+    if (config.get('skip_data') and not force) or exclude_collection(collection_name):
+        return False
 
+    # a forced write, such as a repair or a replay, ignores the cache but is still compared with the target
+    if not force and not config.get('skip_cache_read', False) and \
+            is_entity_unchanged(app, collection_name, source_entity):
+        return False
 
-def migrate_data(app, collection_name, source_entity, attempts=0, force=False):
-    if config.get('skip_data') and not force:
-        return True
+    return source_entity.get('uuid') in find_identical_in_target(app, collection_name, [source_entity])
 
-    # check the cache to see if this entity has changed
-    if not config.get('skip_cache_read', False) and not force:
-        try:
-            str_modified = cache.get(source_entity.get('uuid'))
 
-            if str_modified not in [None, 'None']:
+def write_failure(kind, operation, app, collection_name, source_entity, reason, **extra):
+    if failure_journal is None:
+        return
 
-                modified = long(str_modified)
+    try:
+        failure_journal.write(failure_record(kind, operation, config.get('org'), app, collection_name, source_entity,
+                                             reason, **extra))
 
-                logger.debug('FOUND CACHE: %s = %s ' % (source_entity.get('uuid'), modified))
+    except:
+        logger.exception('Error writing failure of [%s] on entity [%s / %s / %s] to the journal' % (
+            operation, app, collection_name, source_entity.get('uuid')))
 
-                if modified <= source_entity.get('modified'):
 
-                    modified_date = datetime.datetime.utcfromtimestamp(modified / 1000)
-                    e_uuid = source_entity.get('uuid')
+def migrate_data_attempt(app, collection_name, source_entity, attempts=0, force=False):
+    """
+    Makes a single attempt to migrate the data of an entity
 
-                    uuid_datetime = time_uuid.TimeUUID(e_uuid).get_datetime()
+    :return: True if the entity was migrated or skipped, False if it failed and should not be retried
+    :raises TransientError: if the attempt failed and should be retried
+    """
+    if config.get('skip_data') and not force:
+        return True
 
-                    logger.debug('Skipping ENTITY: %s / %s / %s / %s (%s) / %s (%s)' % (
-                        config.get('org'), app, collection_name, e_uuid, uuid_datetime, modified, modified_date))
-                    return True
-                else:
-                    logger.debug('DELETING CACHE: %s ' % (source_entity.get('uuid')))
-                    cache.delete(source_entity.get('uuid'))
-        except:
-            logger.error('Error on checking cache for uuid=[%s]' % source_entity.get('uuid'))
-            logger.error(traceback.format_exc())
+    # check the cache to see if this entity has changed
+    if not config.get('skip_cache_read', False) and not force:
+        if is_entity_unchanged(app, collection_name, source_entity):
+            return True
 
     if exclude_collection(collection_name):
         logger.warn('Excluding entity in filtered collection [%s]' % collection_name)
@@ -1189,7 +2339,7 @@ def migrate_data(app, collection_name, source_entity, attempts=0, force=False):
 
     # handle duplicate user case
     if collection_name in ['users', 'user']:
-        source_entity = confirm_user_entity(app, source_entity)
+        source_entity = confirm_user_entity(app, source_entity, attempts)
 
     source_identifier = get_source_identifier(source_entity)
 
@@ -1226,11 +2376,7 @@ def migrate_data(app, collection_name, source_entity, attempts=0, force=False):
                         True, attempts, config.get('org'), app, source_identifier, source_entity.get('created'),
                         source_entity.get('modified'),))
 
-            if not config.get('skip_cache_write', False):
-                logger.debug('SETTING CACHE | uuid=[%s] | modified=[%s]' % (
-                    source_entity.get('uuid'), str(source_entity.get('modified'))))
-
-                cache.set(source_entity.get('uuid'), str(source_entity.get('modified')))
+            cache_entity_modified(source_entity)
 
             if collection_name in ['role', 'group', 'roles', 'groups']:
                 migrate_permissions(app, collection_name, source_entity, attempts=0)
@@ -1244,13 +2390,7 @@ def migrate_data(app, collection_name, source_entity, attempts=0, force=False):
             logger.error('Failure [%s] on attempt [%s] to PUT url=[%s], entity=[%s] response=[%s]' % (
                 r.status_code, attempts, target_entity_url_by_name, json.dumps(source_entity), r.text))
 
-            if attempts >= 5:
-                logger.critical(
-                        'ABORT migrate_data | success=[%s] | attempts=[%s] | created=[%s] | modified=[%s] %s / %s / %s' % (
-                            True, attempts, source_entity.get('created'), source_entity.get('modified'), app,
-                            collection_name, source_identifier))
-
-                return False
+            failure = 'HTTP [%s] on PUT url=[%s]: %s' % (r.status_code, target_entity_url_by_name, r.text)
 
             if r.status_code == 400:
 
@@ -1265,6 +2405,8 @@ def migrate_data(app, collection_name, source_entity, attempts=0, force=False):
                             'WILL NOT RETRY (duplicate) [%s] attempts to PUT url=[%s], entity=[%s] response=[%s]' % (
                                 attempts, target_entity_url_by_name, json.dumps(source_entity), r.text))
 
+                    write_failure(KIND_ENTITY, 'migrate_data', app, collection_name, source_entity,
+                                  'duplicate: %s' % failure, attempts=attempts + 1)
                     return False
 
             elif r.status_code == 403:
@@ -1272,18 +2414,26 @@ def migrate_data(app, collection_name, source_entity, attempts=0, force=False):
                         'ABORT migrate_data | success=[%s] | attempts=[%s] | created=[%s] | modified=[%s] %s / %s / %s' % (
                             False, attempts, source_entity.get('created'), source_entity.get('modified'), app,
                             collection_name, source_identifier))
+
+                write_failure(KIND_ENTITY, 'migrate_data', app, collection_name, source_entity, failure,
+                              attempts=attempts + 1)
                 return False
 
+    except TransientError:
+        raise
+
     except:
         logger.error(traceback.format_exc())
         logger.error('error in migrate_data on entity: %s' % json.dumps(source_entity))
 
+        failure = traceback.format_exc().strip().splitlines()[-1]
+
     logger.warn(
             'UNSUCCESSFUL migrate_data | success=[%s] | attempts=[%s] | entity=[%s / %s / %s] | created=[%s] | modified=[%s]' % (
                 True, attempts, config.get('org'), app, source_identifier, source_entity.get('created'),
                 source_entity.get('modified'),))
 
-    return migrate_data(app, collection_name, source_entity, attempts=attempts + 1)
+    raise TransientError(failure)
 
 
 def handle_user_migration_conflict(app, collection_name, source_entity, attempts=0, depth=0):
@@ -1319,9 +2469,7 @@ def handle_user_migration_conflict(app, collection_name, source_entity, attempts
                 'CONFLICT: handle_user_migration_conflict failed attempt [%s] GET [%s] on TARGET URL=[%s] - : %s' % (
                     attempts, r.status_code, target_entity_url, r.text))
 
-        time.sleep(DEFAULT_RETRY_SLEEP)
-
-        return handle_user_migration_conflict(app, collection_name, source_entity, attempts)
+        raise TransientError('HTTP [%s] auditing user conflict at URL [%s]' % (r.status_code, target_entity_url))
 
     else:
         audit_logger.error(
@@ -1372,7 +2520,7 @@ def get_best_source_entity(app, collection_name, source_entity, depth=0):
 
         logger.info('Attempting to determine best entity from query on URL %s' % source_entity_query_url)
 
-        q = UsergridQueryIterator(source_entity_query_url, sleep_time=config.get('error_retry_sleep'))
+        q = get_query_iterator(source_entity_query_url)
 
         desired_entity = None
 
@@ -1529,10 +2677,16 @@ def parse_args():
                             'reput',
                             'credentials',
                             'graph',
-                            'permissions'
+                            'permissions',
+                            'replay'
                         ],
                         default='data')
 
+    parser.add_argument('--replay_file',
+                        help='The failure journal of a previous run to replay with -m replay.  Only the entities and '
+                             'edges recorded in it are migrated again',
+                        type=str)
+
     parser.add_argument('-s', '--source_config',
                         help='The path to the source endpoint/org configuration file',
                         type=str,
@@ -1547,6 +2701,47 @@ def parse_args():
                         help='The path to the socket for redis to use',
                         type=str)
 
+    parser.add_argument('--redis_host',
+                        help='The host of the Redis server, which must be shared by the hosts of a --distributed run',
+                        type=str,
+                        default='localhost')
+
+    parser.add_argument('--redis_port',
+                        help='The port of the Redis server',
+                        type=int,
+                        default=6379)
+
+    parser.add_argument('--distributed',
+                        help='Share the collections to process with other hosts running with the same --run_id through '
+                             'Redis',
+                        action='store_true')
+
+    parser.add_argument('--run_id',
+                        help='The name of a distributed run, which must be the same on all of its hosts and new for '
+                             'each run',
+                        type=str)
+
+    parser.add_argument('--distribute_entities',
+                        help='With --distributed, also share the entities to process through Redis rather than '
+                             'processing them on the host which scanned them',
+                        action='store_true')
+
+    parser.add_argument('--lease_time',
+                        help='With --distributed, the number of seconds after which an item held by a host which '
+                             'stopped renewing its lease is returned to the queue',
+                        type=float,
+                        default=DEFAULT_LEASE_TIME)
+
+    parser.add_argument('--cache_lru_size',
+                        help='The number of recently seen cache keys to hold in memory in each worker, 0 to disable',
+                        type=int,
+                        default=100000)
+
+    parser.add_argument('--cache_write_batch_size',
+                        help='The number of cache writes to send to Redis in a single pipeline',
+                        type=int,
+                        default=50)
+
     parser.add_argument('--limit',
                         help='The number of entities to return per query request',
                         type=int,
@@ -1557,6 +2752,49 @@ def parse_args():
                         type=int,
                         default=16)
 
+    parser.add_argument('--entity_worker_threads',
+                        help='The number of operations each entity worker process runs concurrently in threads. This '
+                             'allows many requests in flight without a process per request',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--edge_concurrency',
+                        help='The number of connections of a single entity which each entity worker thread creates '
+                             'concurrently, using a pool of this many threads of its own.  Up to '
+                             '--entity_worker_threads x --edge_concurrency connections are created at once by each '
+                             'entity worker process.  Values above 1 do not preserve the order in which connections are '
+                             'created',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--retry_backoff_base',
+                        help='The number of seconds to wait before the first retry of a failed request, doubled on each '
+                             'further attempt and randomized',
+                        type=float,
+                        default=1.0)
+
+    parser.add_argument('--retry_backoff_max',
+                        help='The maximum number of seconds to wait before retrying a failed request',
+                        type=float,
+                        default=60.0)
+
+    parser.add_argument('--max_attempts',
+                        help='The number of attempts to migrate the data of an entity before it is written to the dead '
+                             'letter file',
+                        type=int,
+                        default=5)
+
+    parser.add_argument('--failure_journal',
+                        help='The file to append failed entities and edges to, one JSON record per line, which can be '
+                             'replayed with -m replay. Defaults to a file in --log_dir',
+                        type=str)
+
+    parser.add_argument('--batch_size',
+                        help='The number of entities from the same app/collection to write to the target in a single '
+                             'bulk request when migrating data, 1 disables bulk writes',
+                        type=int,
+                        default=1)
+
     parser.add_argument('--visit_cache_ttl',
                         help='The TTL of the cache of visiting nodes in the graph for connections',
                         type=int,
@@ -1567,21 +2805,100 @@ def parse_args():
                         type=float,
                         default=30)
 
+    parser.add_argument('--page_max_attempts',
+                        help='The maximum number of attempts to retrieve a page of a query before the scan fails.  '
+                             'Client (4xx) errors then fail the scan without retrying.  By default, 0, every error is '
+                             'retried indefinitely',
+                        type=int,
+                        default=0)
+
     parser.add_argument('--page_sleep_time',
                         help='The number of seconds to wait between retrieving pages from the UsergridQueryIterator',
                         type=float,
                         default=0)
 
+    parser.add_argument('--http_pool_size',
+                        help='The number of HTTP connections each worker process keeps open to each host',
+                        type=int,
+                        default=10)
+
+    parser.add_argument('--disable_keep_alive',
+                        help='Open a new HTTP connection for every request instead of reusing pooled connections',
+                        action='store_true')
+
+    parser.add_argument('--disable_gzip',
+                        help='Do not request gzip compressed HTTP responses',
+                        action='store_true')
+
+    parser.add_argument('--read_ahead',
+                        help='The number of collection pages to request in the background while the current page is '
+                             'processed, 0 to request each page after the previous one is processed',
+                        type=int,
+                        default=0)
+
     parser.add_argument('--entity_sleep_time',
                         help='The number of seconds to wait between retrieving pages from the UsergridQueryIterator',
                         type=float,
                         default=0)
 
+    parser.add_argument('--metrics_port',
+                        help='Serve live metrics of all of the worker processes in the Prometheus text format at '
+                             'http://<host>:<port>/metrics, 0 to disable',
+                        type=int,
+                        default=0)
+
+    parser.add_argument('--target_rate',
+                        help='The initial number of requests/sec to send to the target across all workers. The rate is '
+                             'adjusted between --target_rate_min and --target_rate_max based on the latency and errors '
+                             'of the target. 0 disables rate limiting',
+                        type=float,
+                        default=0)
+
+    parser.add_argument('--target_rate_min',
+                        help='The lowest number of requests/sec the target rate limit will back off to',
+                        type=float,
+                        default=10)
+
+    parser.add_argument('--target_rate_max',
+                        help='The highest number of requests/sec the target rate limit will increase to',
+                        type=float,
+                        default=1000)
+
+    parser.add_argument('--latency_budget_ms',
+                        help='The p99 latency of target requests above which the target rate limit is decreased',
+                        type=int,
+                        default=1000)
+
+    parser.add_argument('--error_budget',
+                        help='The fraction of target requests which may fail with a 5xx or connection error before '
+                             'the target rate limit is decreased',
+                        type=float,
+                        default=0.01)
+
+    parser.add_argument('--rate_adjust_interval',
+                        help='The number of seconds between adjustments of the target rate limit',
+                        type=float,
+                        default=10)
+
     parser.add_argument('--collection_workers',
                         help='The number of worker processes to do the migration',
                         type=int,
                         default=2)
 
+    parser.add_argument('--collection_slices',
+                        help='The number of time ranges to split each collection into so that the ranges can be '
+                             'scanned in parallel by the collection workers, 1 to scan each collection as a whole.  '
+                             'Each range is scanned with a QL filter on --slice_field which is added to the where '
+                             'clause of --ql',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--slice_field',
+                        help='The timestamp field used to split collections into time ranges',
+                        type=str,
+                        choices=['created', 'modified'],
+                        default='created')
+
     parser.add_argument('--queue_size_max',
                         help='The max size of entities to allow in the queue',
                         type=int,
@@ -1592,32 +2909,76 @@ def parse_args():
                         type=int,
                         default=3)
 
+    parser.add_argument('--graph_edge_buffer',
+                        help='The maximum number of target entities of an edge type which are held in memory before '
+                             'their connections are created during graph traversal',
+                        type=int,
+                        default=1000)
+
     parser.add_argument('--queue_watermark_high',
                         help='The point at which publishing to the queue will PAUSE until it is at or below low watermark',
                         type=int,
                         default=25000)
 
+    parser.add_argument('--max_queue_pause',
+                        help='The number of seconds a collection worker waits for the entity queue to go down while '
+                             'paused at the high watermark before it checkpoints its scan and stops, 0 to wait '
+                             'indefinitely',
+                        type=float,
+                        default=1800)
+
     parser.add_argument('--min_modified',
-                        help='Break when encountering a modified date before this, per collection',
-                        type=int,
+                        help='Only migrate entities modified after this timestamp, for collections which do not have '
+                             'a watermark in the --delta_status_file',
+                        type=long,
                         default=0)
 
     parser.add_argument('--max_modified',
-                        help='Break when encountering a modified date after this, per collection',
+                        help='Only migrate entities modified at or before this timestamp when migrating deltas',
                         type=long,
                         default=3793805526000)
 
+    parser.add_argument('--delta_status_file',
+                        help='The status JSON file of a previous run.  Only entities modified after the start of the '
+                             'scan of each collection in that run are migrated, and the status file of this run '
+                             'records the new watermark',
+                        type=str)
+
+    parser.add_argument('--delta_skew_margin',
+                        help='The number of milliseconds before the start of each scan which the next delta run '
+                             'starts from, to allow for differences between the clocks of the Usergrid nodes',
+                        type=long,
+                        default=300000)
+
     parser.add_argument('--queue_watermark_low',
                         help='The point at which publishing to the queue will RESUME after it has reached the high watermark',
                         type=int,
                         default=5000)
 
     parser.add_argument('--ql',
-                        help='The QL to use in the filter for reading data from collections',
+                        help='The QL to use in the filter for reading data from collections.  The filters of '
+                             '--resume, --collection_slices and --delta_status_file are added to its where clause, '
+                             'and with --resume or --collection_slices its order by must be created asc or '
+                             '--slice_field asc',
                         type=str,
                         default='select * order by created asc')
     # default='select * order by created asc')
 
+    parser.add_argument('--resume',
+                        help='Resume the scan of each app/collection from the checkpoint of a previous run of the same '
+                             'org and operation, skipping collections which were completed',
+                        action='store_true')
+
+    parser.add_argument('--checkpoint_interval',
+                        help='The number of entities between saving the checkpoint of a collection scan',
+                        type=int,
+                        default=1000)
+
+    parser.add_argument('--checkpoint_dir',
+                        help='A local directory to store scan checkpoints in instead of Redis.  Defaults to the '
+                             'checkpoints directory under --log_dir when Redis is not available',
+                        type=str)
+
     parser.add_argument('--repair_data',
                         help='Repair data when iterating/migrating graph but skipping data',
                         action='store_true')
@@ -1644,11 +3005,35 @@ def parse_args():
                         dest='skip_cache_write',
                         action='store_true')
 
+    parser.add_argument('--content_hash',
+                        help='Store a hash of the content of each entity in the cache along with its modified '
+                             'timestamp, and before writing an entity compare its hash to that of the entity in the '
+                             'target, skipping entities which are identical, including those written by --repair_data '
+                             'or -m replay. Useful for repair or verification passes; costs an extra GET per entity '
+                             'unless --batch_size is greater than 1, which compares up to 50 entities per GET',
+                        action='store_true')
+
     parser.add_argument('--create_apps',
                         help='Create apps at the target if they do not exist',
                         dest='create_apps',
                         action='store_true')
 
+    parser.add_argument('--transport_batch_size',
+                        help='The number of entities sent from the collection workers to the entity workers in each '
+                             'message of the entity queue',
+                        type=int,
+                        default=DEFAULT_TRANSPORT_BATCH_SIZE)
+
+    parser.add_argument('--keep_metadata',
+                        help='Send the metadata of each entity to the entity workers even if the operation does not '
+                             'use it',
+                        action='store_true')
+
+    parser.add_argument('--status_interval',
+                        help='The minimum number of seconds between writes of the status of the org to the log and status file',
+                        type=float,
+                        default=10)
+
     parser.add_argument('--nohup',
                         help='specifies not to use stdout for logging',
                         action='store_true')
@@ -1747,6 +3132,14 @@ def init():
     if config['exclude_collection'] is None:
         config['exclude_collection'] = []
 
+    config['delta_watermarks'] = {}
+
+    if config.get('delta_status_file') is not None:
+        config['delta_watermarks'] = load_delta_watermarks(config.get('delta_status_file'))
+
+        logger.info('Loaded delta watermarks from [%s]: %s' % (
+            config.get('delta_status_file'), json.dumps(config['delta_watermarks'])))
+
     config['source_endpoint'] = config['source_config'].get('endpoint').copy()
     config['source_endpoint'].update(config['source_config']['credentials'][config['org']])
 
@@ -1755,6 +3148,16 @@ def init():
     config['target_endpoint'] = config['target_config'].get('endpoint').copy()
     config['target_endpoint'].update(config['target_config']['credentials'][target_org])
 
+    init_sessions()
+
+
+def init_sessions():
+    # sessions are created on first use in each process, so this only sets the options they are created with
+    for session in [session_source, session_target]:
+        session.configure(pool_size=config.get('http_pool_size', DEFAULT_POOL_SIZE),
+                          keep_alive=not config.get('disable_keep_alive', False),
+                          gzip=not config.get('disable_gzip', False))
+
 
 def wait_for(threads, label, sleep_time=60):
     wait = True
@@ -1774,20 +3177,15 @@ def wait_for(threads, label, sleep_time=60):
         if alive_count > 0:
             wait = True
             logger.info('Continuing to wait for [%s] threads with sleep time=[%s]' % (alive_count, sleep_time))
-            time.sleep(sleep_time)
-
-    logger.warn('All workers [%s] done!' % label)
-
 
-def count_bytes(entity):
-    entity_copy = entity.copy()
+            # return as soon as the last one finishes rather than at the end of the sleep time
+            wait_until = time.time() + sleep_time
 
-    if 'metadata' in entity_copy:
-        del entity_copy['metadata']
-
-    entity_str = json.dumps(entity_copy)
+            for t in threads:
+                if t.is_alive():
+                    t.join(max(wait_until - time.time(), 0))
 
-    return len(entity_str)
+    logger.warn('All workers [%s] done!' % label)
 
 
 def migrate_user_credentials(app, collection_name, source_entity, attempts=0):
@@ -1813,7 +3211,7 @@ def migrate_user_credentials(app, collection_name, source_entity, attempts=0):
                                                       **config.get('target_endpoint'))
 
     # this endpoint for some reason uses basic auth...
-    r = requests.get(source_url, auth=HTTPBasicAuth(config.get('su_username'), config.get('su_password')))
+    r = session_source.get(source_url, auth=HTTPBasicAuth(config.get('su_username'), config.get('su_password')))
 
     if r.status_code != 200:
         logger.error('Unable to migrate credentials due to HTTP [%s] on GET URL [%s]: %s' % (
@@ -1825,9 +3223,9 @@ def migrate_user_credentials(app, collection_name, source_entity, attempts=0):
 
     logger.info('Putting credentials to [%s]...' % target_url)
 
-    r = requests.put(target_url,
-                     data=json.dumps(source_credentials),
-                     auth=HTTPBasicAuth(config.get('su_username'), config.get('su_password')))
+    r = session_target.put(target_url,
+                           data=json.dumps(source_credentials),
+                           auth=HTTPBasicAuth(config.get('su_username'), config.get('su_password')))
 
     if r.status_code != 200:
         logger.error(
@@ -1841,6 +3239,25 @@ def migrate_user_credentials(app, collection_name, source_entity, attempts=0):
     return True
 
 
+def init_session_pools(pool_size):
+    # allow at least one pooled connection per concurrent operation
+    for session in [session_source, session_target]:
+        session.configure(pool_size=max(pool_size, config.get('http_pool_size', DEFAULT_POOL_SIZE)))
+
+
+def flush_cache():
+    if isinstance(cache, VisitCache) and not config.get('skip_cache_write', False):
+        try:
+            cache.flush()
+        except:
+            logger.exception('Error flushing pending writes to the cache')
+
+
+def log_cache_stats():
+    if isinstance(cache, VisitCache):
+        worker_logger.info('Cache stats: %s' % json.dumps(cache.get_stats()))
+
+
 def check_response_status(r, url, exit_on_error=True):
     if r.status_code != 200:
         logger.critical('HTTP [%s] on URL=[%s]' % (r.status_code, url))
@@ -1850,14 +3267,43 @@ def check_response_status(r, url, exit_on_error=True):
             exit()
 
 
+def get_entity_queue_size_max():
+    """
+    :return: the maximum number of messages on the entity queue, such that it holds about --queue_size_max entities
+    """
+    return max(config.get('queue_size_max') / config.get('transport_batch_size', DEFAULT_TRANSPORT_BATCH_SIZE), 1)
+
+
+def get_strip_fields(operation):
+    """
+    :return: the fields of the source entities which are not sent to the entity workers for the operation
+    """
+    # the graph operations follow the edges listed in the metadata
+    if config.get('keep_metadata', False) or operation in [migrate_graph, prune_graph]:
+        return []
+
+    return ['metadata']
+
+
+def get_work_queue(name):
+    """
+    :return: a queue shared through Redis by the hosts of a --distributed run
+    """
+    return RedisWorkQueue(redis_client,
+                          run_key(key_version, config.get('org'), config.get('migrate'), config.get('run_id'), name),
+                          lease_time=config.get('lease_time'))
+
+
 def do_operation(apps_and_collections, operation):
+    global ack_queues
+
     status_map = {}
 
     logger.info('Creating queues...')
 
     # Mac, for example, does not support the max_size for a queue in Python
     if _platform == "linux" or _platform == "linux2":
-        entity_queue = Queue(maxsize=config.get('queue_size_max'))
+        entity_queue = Queue(maxsize=get_entity_queue_size_max())
         collection_queue = Queue(maxsize=config.get('queue_size_max'))
         collection_response_queue = Queue(maxsize=config.get('queue_size_max'))
     else:
@@ -1865,18 +3311,50 @@ def do_operation(apps_and_collections, operation):
         collection_queue = Queue()
         collection_response_queue = Queue()
 
+    # the collections of a distributed run are published once by one of its hosts, then shared by all of them
+    publish_collections = True
+
+    if config.get('distributed', False):
+        collection_queue = get_work_queue('collections')
+
+        if config.get('distribute_entities', False):
+            entity_queue = get_work_queue('entities')
+
+        publish_collections = False
+
     logger.info('Starting entity_workers...')
 
     collection_count = 0
+    work_items = []
+
     # create the entity workers, but only start them (later) if there is work to do
-    entity_workers = [EntityWorker(entity_queue, operation) for x in xrange(config.get('entity_workers'))]
+    batch_operation = migrate_data_batch if operation == migrate_data else None
+
+    entity_workers = [EntityWorker(entity_queue, operation, batch_operation, config.get('batch_size'),
+                                   threads=config.get('entity_worker_threads'))
+                      for x in xrange(config.get('entity_workers'))]
 
     # create the collection workers, but only start them (later) if there is work to do
-    collection_workers = [CollectionWorker(collection_queue, entity_queue, collection_response_queue) for x in
-                          xrange(config.get('collection_workers'))]
+    # the entities of a distributed run may be processed on another host, which acknowledges them through Redis
+    if config.get('distribute_entities', False):
+        ack_channels = ['%s-%s' % (ECID, x) for x in xrange(config.get('collection_workers'))]
+    else:
+        ack_queues = [Queue() for x in xrange(config.get('collection_workers'))]
+        ack_channels = range(config.get('collection_workers'))
+
+    collection_workers = [CollectionWorker(collection_queue, entity_queue, collection_response_queue,
+                                           strip_fields=get_strip_fields(operation), ack_channel=ack_channels[x])
+                          for x in xrange(config.get('collection_workers'))]
 
     status_listener = StatusListener(collection_response_queue, entity_queue)
 
+    if metrics_aggregator is not None:
+        metrics_aggregator.add_gauge('usergrid_queue_depth', lambda: get_entity_queue_depth(entity_queue),
+                                     queue='entity')
+        metrics_aggregator.add_gauge('usergrid_queue_depth', lambda: collection_queue.qsize(), queue='collection')
+        metrics_aggregator.add_gauge('usergrid_queue_depth', lambda: collection_response_queue.qsize(),
+                                     queue='collection_response')
+
     try:
         # for each app, publish the (app_name, collection_name) to the queue.
         # this is received by a collection worker who iterates the collection and publishes
@@ -1899,13 +3377,50 @@ def do_operation(apps_and_collections, operation):
 
             # iterate the collections which are returned.
             for collection_name in app_data.get('collections'):
-                logger.info('Publishing app / collection: %s / %s' % (app, collection_name))
+                # the hosts of a distributed run may list the collections in different orders, so they are not shared
+                if not config.get('distribute_entities', False):
+                    collection_table.add(app, collection_name)
+
+                time_slices = get_collection_slices(app, collection_name)
+
+                if len(time_slices) == 0:
+                    logger.info('Publishing app / collection: %s / %s' % (app, collection_name))
+
+                    collection_count += 1
+                    work_items.append((app, collection_name, None))
+
+                    if publish_collections:
+                        collection_queue.put((app, collection_name))
 
-                collection_count += 1
-                collection_queue.put((app, collection_name))
+                for time_slice in time_slices:
+                    logger.info('Publishing app / collection / slice: %s / %s / %s' % (
+                        app, collection_name, time_slice_label(collection_name, time_slice)))
+
+                    collection_count += 1
+                    work_items.append((app, collection_name, time_slice))
+
+                    if publish_collections:
+                        collection_queue.put((app, collection_name, time_slice))
 
             logger.info('Finished publishing [%s] collections for app [%s] !' % (collection_count, app))
 
+        if config.get('distributed', False):
+            seeder = RunSeeder(redis_client, run_key(key_version, config.get('org'), config.get('migrate'),
+                                                     config.get('run_id'), 'seeded'),
+                                timeout=config.get('lease_time'))
+
+            if seeder.seed(collection_queue, work_items):
+                logger.warn('This host published the [%s] collections of run [%s]' % (
+                    len(work_items), config.get('run_id')))
+            else:
+                logger.warn('The collections of run [%s] were published by another host' % config.get('run_id'))
+
+        # mark the end of the collections for each collection worker.  The collections of a distributed run have all
+        # been published by now, so their workers stop once the queue is empty
+        if not isinstance(collection_queue, RedisWorkQueue):
+            for w in collection_workers:
+                collection_queue.put(None)
+
         # only start the threads if there is work to do
         if collection_count > 0:
             status_listener.start()
@@ -1919,28 +3434,129 @@ def do_operation(apps_and_collections, operation):
             # allow collection workers to finish
             wait_for(collection_workers, label='collection_workers', sleep_time=60)
 
+            end_entity_stream(entity_queue, entity_workers)
+
             # allow entity workers to finish
             wait_for(entity_workers, label='entity_workers', sleep_time=60)
 
-            status_listener.terminate()
+            # every entity has been processed, so the scans do not need to be resumed.  The other hosts of a
+            # distributed run may still be processing entities of these collections
+            if not config.get('graph', False) and not config.get('distributed', False):
+                for app, collection_name, time_slice in work_items:
+                    complete_checkpoint(app, collection_name, time_slice)
+
+            stop_status_listener(status_listener, collection_response_queue)
 
     except KeyboardInterrupt:
-        logger.warning('Keyboard Interrupt, aborting...')
-        entity_queue.close()
-        collection_queue.close()
-        collection_response_queue.close()
+        logger.warning('Keyboard Interrupt, draining...  Press Ctrl-C again to abort')
 
-        [os.kill(super(EntityWorker, p).pid, signal.SIGINT) for p in entity_workers]
-        [os.kill(super(CollectionWorker, p).pid, signal.SIGINT) for p in collection_workers]
-        os.kill(super(StatusListener, status_listener).pid, signal.SIGINT)
+        try:
+            # the scans stop at their next page and the entity workers finish the entities which are queued
+            drain_event.set()
 
-        [w.terminate() for w in entity_workers]
-        [w.terminate() for w in collection_workers]
-        status_listener.terminate()
+            wait_for(collection_workers, label='collection_workers', sleep_time=10)
+
+            end_entity_stream(entity_queue, entity_workers)
+
+            wait_for(entity_workers, label='entity_workers', sleep_time=10)
+
+            stop_status_listener(status_listener, collection_response_queue)
+
+            logger.warning('Drained!  Use --resume to continue the scans and -m replay for the failure journal')
+
+        except KeyboardInterrupt:
+            logger.warning('Keyboard Interrupt, aborting...')
+            entity_queue.close()
+            collection_queue.close()
+            collection_response_queue.close()
+
+            [w.terminate() for w in entity_workers if w.is_alive()]
+            [w.terminate() for w in collection_workers if w.is_alive()]
+
+            if status_listener.is_alive():
+                status_listener.terminate()
 
     logger.info('entity_workers DONE!')
 
 
+def end_entity_stream(entity_queue, entity_workers):
+    """
+    Marks the end of the entities for each thread of each entity worker, once all of the producers have finished
+    """
+    # the other hosts of a distributed run may still be publishing entities, so the workers stop once it is empty
+    if isinstance(entity_queue, RedisWorkQueue):
+        return
+
+    for x in xrange(len(entity_workers) * max(config.get('entity_worker_threads', 1), 1)):
+        entity_queue.put(None)
+
+
+def stop_status_listener(status_listener, status_queue, timeout=60):
+    """
+    Lets the status listener write the final status before it exits
+    """
+    if not status_listener.is_alive():
+        return
+
+    status_queue.put(None)
+    status_listener.join(timeout)
+
+    if status_listener.is_alive():
+        status_listener.terminate()
+
+
+def do_replay(replay_file_name):
+    logger.info('Replaying failures from [%s]...' % replay_file_name)
+
+    if _platform == "linux" or _platform == "linux2":
+        entity_queue = Queue(maxsize=get_entity_queue_size_max())
+    else:
+        entity_queue = Queue()
+
+    entity_workers = [EntityWorker(entity_queue, replay_record, threads=config.get('entity_worker_threads'))
+                      for x in xrange(config.get('entity_workers'))]
+
+    replay_worker = ReplayWorker(replay_file_name, entity_queue)
+
+    try:
+        replay_worker.start()
+        [w.start() for w in entity_workers]
+
+        wait_for([replay_worker], label='replay_worker', sleep_time=10)
+        end_entity_stream(entity_queue, entity_workers)
+        wait_for(entity_workers, label='entity_workers', sleep_time=60)
+
+    except KeyboardInterrupt:
+        logger.warning('Keyboard Interrupt, draining...  Press Ctrl-C again to abort')
+
+        try:
+            drain_event.set()
+
+            wait_for([replay_worker], label='replay_worker', sleep_time=10)
+            end_entity_stream(entity_queue, entity_workers)
+            wait_for(entity_workers, label='entity_workers', sleep_time=10)
+
+        except KeyboardInterrupt:
+            logger.warning('Keyboard Interrupt, aborting...')
+            entity_queue.close()
+
+            [w.terminate() for w in entity_workers if w.is_alive()]
+
+            if replay_worker.is_alive():
+                replay_worker.terminate()
+
+
+def replay_record(app, collection_name, record):
+    """
+    Drives a record of the failure journal through the operation which failed
+    """
+    if record.get('kind') == KIND_EDGE:
+        return create_connection(app, collection_name, record.get('entity'), record.get('edge_name'),
+                                 record.get('target_entity'))
+
+    return migrate_data(app, collection_name, record.get('entity'), force=True, defer=True)
+
+
 def filter_apps_and_collections(org_apps):
     app_collecitons = {
         'apps': {
@@ -2050,7 +3666,8 @@ def confirm_target_org_apps(apps_and_collections):
 
 
 def main():
-    global config, cache
+    global config, cache, checkpoint_store, rate_limiter, session_source, session_target, failure_journal, \
+        metrics_aggregator, redis_client, status_board
 
     config = parse_args()
     init()
@@ -2058,17 +3675,90 @@ def main():
 
     logger.warn('Script starting')
 
+    failure_journal_file_name = config.get('failure_journal') or os.path.join(
+            config.get('log_dir'), '%s-%s-%s-failures.json' % (config.get('org'), config.get('migrate'), ECID))
+
+    if config.get('migrate') == 'replay':
+        if config.get('replay_file') is None or not os.path.isfile(config.get('replay_file')):
+            logger.critical('ABORT: -m replay requires an existing --replay_file')
+            exit()
+
+        if os.path.abspath(config.get('replay_file')) == os.path.abspath(failure_journal_file_name):
+            logger.critical('ABORT: the --failure_journal of a replay must not be the --replay_file')
+            exit()
+
+    if not config.get('graph', False):
+        try:
+            parse_ql(config.get('ql'))
+
+        except ValueError, e:
+            logger.critical('ABORT: %s' % e)
+            exit()
+
+        order_field = config.get('slice_field') if config.get('collection_slices', 1) > 1 else 'created'
+
+        if (config.get('resume', False) or config.get('collection_slices', 1) > 1) and \
+                not is_scan_order(config.get('ql'), order_field):
+            logger.critical('ABORT: --resume and --collection_slices order each scan by %s, which conflicts with the '
+                            'order by clause of --ql' % order_field)
+            exit()
+
+    failure_journal = FailureJournalWriter(failure_journal_file_name)
+
+    logger.warn('Failed entities and edges will be written to [%s]' % failure_journal_file_name)
+
+    if config.get('content_hash') and config.get('batch_size', 1) <= 1:
+        logger.warn('--content_hash compares each entity with a GET of its own, use --batch_size greater than 1 to '
+                    'compare up to %s entities per GET' % content_hash_query_size)
+
+    # the metrics queue is created before the workers are started so that they all send their metrics to it
+    if config.get('metrics_port', 0) > 0:
+        metrics_queue = Queue()
+        metrics.configure(metrics_queue)
+
+        metrics_aggregator = MetricsAggregator(metrics_queue)
+        metrics_aggregator.start()
+
+        start_metrics_server(config.get('metrics_port'), metrics_aggregator)
+
+        # the rate limiter wraps this so that the time waiting for the limiter is not recorded as request latency
+        session_source = InstrumentedSession(session_source, 'source')
+        session_target = InstrumentedSession(session_target, 'target')
+
+    # the limiter is created before the workers are started so that they all share its state
+    if config.get('target_rate', 0) > 0:
+        rate_limiter = AdaptiveRateLimiter(config.get('target_rate'),
+                                           min_rate=config.get('target_rate_min'),
+                                           max_rate=config.get('target_rate_max'),
+                                           latency_budget_ms=config.get('latency_budget_ms'),
+                                           error_budget=config.get('error_budget'),
+                                           adjust_interval=config.get('rate_adjust_interval'))
+
+        session_target = RateLimitedSession(session_target, rate_limiter)
+
+        logger.warn('Limiting requests to the target to [%s] requests/sec, adjusting within [%s - %s]' % (
+            config.get('target_rate'), config.get('target_rate_min'), config.get('target_rate_max')))
+
     try:
         if config.get('redis_socket') is not None:
             cache = redis.Redis(unix_socket_path=config.get('redis_socket'))
 
         else:
             # this does not try to connect to redis
-            cache = redis.StrictRedis(host='localhost', port=6379, db=0)
+            cache = redis.StrictRedis(host=config.get('redis_host'), port=config.get('redis_port'), db=0)
 
         # this is necessary to test the connection to redis
         cache.get('usergrid')
 
+        redis_client = cache
+
+        cache = VisitCache(cache,
+                           lru_size=config.get('cache_lru_size'),
+                           write_batch_size=config.get('cache_write_batch_size'),
+                           remote_ttl=config.get('visit_cache_ttl'))
+
+        checkpoint_store = RedisCheckpointStore(cache.client)
+
     except:
         logger.error(
                 'Error connecting to Redis cache, consider using Redis to be able to optimize the migration process...')
@@ -2081,6 +3771,30 @@ def main():
         config['skip_cache_read'] = True
         config['skip_cache_write'] = True
 
+    if config.get('distributed', False):
+        if redis_client is None:
+            logger.critical('ABORT: --distributed requires a Redis server shared by all of the hosts')
+            exit()
+
+        if config.get('run_id') is None or config.get('migrate') == 'replay':
+            logger.critical('ABORT: --distributed requires a --run_id and can not be used with -m replay')
+            exit()
+
+        status_board = RedisStatusBoard(redis_client, run_key(key_version, config.get('org'), config.get('migrate'),
+                                                              config.get('run_id'), 'status'))
+
+        logger.warn('Distributing the work of run [%s] through Redis' % config.get('run_id'))
+
+    if config.get('checkpoint_dir') is not None or checkpoint_store is None:
+        checkpoint_store = FileCheckpointStore(config.get('checkpoint_dir') or
+                                               os.path.join(config.get('log_dir'), 'checkpoints'))
+
+    # a replay only processes the items in the journal, so the apps and collections are not listed
+    if config.get('migrate') == 'replay':
+        do_replay(config.get('replay_file'))
+        logger.warn('Script finished')
+        return
+
     org_apps = {
     }
 
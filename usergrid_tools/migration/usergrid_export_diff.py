@@ -0,0 +1,422 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import uuid
+
+from usergrid_tools.migration.export_files import ENTITY_FILES, EDGE_FILES, find_collection_files, read_lines, \
+    read_records
+from usergrid_tools.migration.external_sort import external_sort, unique_by_key, DEFAULT_BUFFER_SIZE
+from usergrid_tools.migration.failure_journal import KIND_ENTITY, KIND_EDGE, failure_record
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+ECID = str(uuid.uuid1())
+
+logger = logging.getLogger('ExportDiff')
+
+# fields which are expected to differ between a source entity and the entity migrated to the target
+DEFAULT_IGNORE_FIELDS = ['metadata', 'modified']
+
+config = {}
+
+
+class DiffWriter(object):
+    """
+    Writes the records of a diff to a file in the format of the failure journal, so that the file of missing and
+    changed entities and edges can be replayed with usergrid_data_migrator -m replay
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = open(file_name, 'w')
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def get_target_mapping(app, collection_name):
+    target_app = config.get('app_mapping', {}).get(app, app)
+    target_collection = config.get('collection_mapping', {}).get(collection_name, collection_name)
+    return target_app, target_collection
+
+
+def include_collection(collection_name):
+    if collection_name in config.get('exclude_collection', []):
+        return False
+
+    collections = config.get('collection', [])
+
+    return len(collections) == 0 or collection_name in collections
+
+
+def entity_items(file_names):
+    """
+    :return: a generator of (uuid, line) for the records of entity files
+    """
+    for file_name in file_names:
+        for line in read_lines(file_name):
+            if len(line.strip()) == 0:
+                continue
+
+            entity = json.loads(line)
+
+            yield entity.get('uuid').encode('utf-8'), line
+
+
+def edge_items(file_names):
+    """
+    :return: a generator of (source uuid/edge name/target uuid, source entity reference) for each edge in edge files
+    """
+    for file_name in file_names:
+        for record in read_records(file_name):
+            entity_ref = record.get('entity', {})
+            value = json.dumps(entity_ref)
+
+            for target_uuid in record.get('target_uuids', []):
+                key = u'%s/%s/%s' % (entity_ref.get('uuid'), record.get('edge_name'), target_uuid)
+
+                yield key.encode('utf-8'), value
+
+
+def sorted_items(items):
+    return unique_by_key(external_sort(items, config.get('sort_buffer_size'), config.get('temp_dir')))
+
+
+def merge_join(source_items, target_items):
+    """
+    Joins two iterables of (key, value) pairs which are sorted by unique keys
+
+    :return: a generator of (key, source value, target value) where the value is None if the key is not on that side
+    """
+    source_items = iter(source_items)
+    target_items = iter(target_items)
+
+    source = next(source_items, None)
+    target = next(target_items, None)
+
+    while source is not None or target is not None:
+        if target is None or (source is not None and source[0] < target[0]):
+            yield source[0], source[1], None
+            source = next(source_items, None)
+
+        elif source is None or target[0] < source[0]:
+            yield target[0], None, target[1]
+            target = next(target_items, None)
+
+        else:
+            yield source[0], source[1], target[1]
+            source = next(source_items, None)
+            target = next(target_items, None)
+
+
+def changed_fields(source_entity, target_entity, ignore_fields):
+    fields = set(source_entity.keys()) | set(target_entity.keys())
+
+    return sorted([field for field in fields
+                   if field not in ignore_fields and source_entity.get(field) != target_entity.get(field)])
+
+
+def diff_entities(app, collection_name, target_app, target_collection, source_files, target_files, writer,
+                  extra_writer):
+    counts = {
+        'entities_missing': 0,
+        'entities_extra': 0,
+        'entities_changed': 0,
+        'entities_same': 0
+    }
+
+    ignore_fields = set(config.get('ignore_fields'))
+
+    # the type is the singular of the collection name, so it differs when the collection is mapped
+    if target_collection != collection_name:
+        ignore_fields.add('type')
+
+    for key, source_line, target_line in merge_join(sorted_items(entity_items(source_files)),
+                                                    sorted_items(entity_items(target_files))):
+        if target_line is None:
+            counts['entities_missing'] += 1
+            writer.write(failure_record(KIND_ENTITY, 'diff_missing', config.get('org'), app, collection_name,
+                                        json.loads(source_line), 'Entity not in the target'))
+
+        elif source_line is None:
+            counts['entities_extra'] += 1
+            extra_writer.write(failure_record(KIND_ENTITY, 'diff_extra', config.get('org'), target_app,
+                                              target_collection, json.loads(target_line), 'Entity not in the source'))
+
+        else:
+            source_entity = json.loads(source_line)
+            fields = changed_fields(source_entity, json.loads(target_line), ignore_fields)
+
+            if len(fields) > 0:
+                counts['entities_changed'] += 1
+                writer.write(failure_record(KIND_ENTITY, 'diff_changed', config.get('org'), app, collection_name,
+                                            source_entity, 'Fields differ in the target: %s' % ', '.join(fields),
+                                            fields=fields))
+            else:
+                counts['entities_same'] += 1
+
+    return counts
+
+
+def diff_edges(app, collection_name, target_app, target_collection, source_files, target_files, writer,
+               extra_writer):
+    counts = {
+        'edges_missing': 0,
+        'edges_extra': 0,
+        'edges_same': 0
+    }
+
+    for key, source_value, target_value in merge_join(sorted_items(edge_items(source_files)),
+                                                      sorted_items(edge_items(target_files))):
+        source_uuid, edge_name, target_uuid = key.decode('utf-8').split('/', 2)
+
+        if target_value is None:
+            counts['edges_missing'] += 1
+            writer.write(failure_record(KIND_EDGE, 'diff_missing', config.get('org'), app, collection_name,
+                                        json.loads(source_value), 'Edge not in the target',
+                                        edge_name=edge_name, target_entity={'uuid': target_uuid}))
+
+        elif source_value is None:
+            counts['edges_extra'] += 1
+            extra_writer.write(failure_record(KIND_EDGE, 'diff_extra', config.get('org'), target_app,
+                                              target_collection, json.loads(target_value), 'Edge not in the source',
+                                              edge_name=edge_name, target_entity={'uuid': target_uuid}))
+
+        else:
+            counts['edges_same'] += 1
+
+    return counts
+
+
+def diff_collection(app, collection_name, target_app, target_collection, source_files, target_files, writer,
+                    extra_writer):
+    """
+    :param source_files: the {ENTITY_FILES: [...], EDGE_FILES: [...]} of the collection in the source snapshot
+    :param target_files: the {ENTITY_FILES: [...], EDGE_FILES: [...]} of the collection in the target snapshot
+    :return: the counts of missing, extra, changed and identical entities and edges
+    """
+    logger.info('Comparing [%s / %s] to [%s / %s]...' % (app, collection_name, target_app, target_collection))
+
+    counts = diff_entities(app, collection_name, target_app, target_collection, source_files[ENTITY_FILES],
+                           target_files[ENTITY_FILES], writer, extra_writer)
+
+    if not config.get('skip_edges'):
+        counts.update(diff_edges(app, collection_name, target_app, target_collection, source_files[EDGE_FILES],
+                                 target_files[EDGE_FILES], writer, extra_writer))
+
+    logger.warning('Compared [%s / %s] to [%s / %s]: %s' % (
+        app, collection_name, target_app, target_collection, json.dumps(counts)))
+
+    return counts
+
+
+def find_snapshot_files(path, app):
+    app_directory = os.path.join(path, app)
+
+    if not os.path.isdir(app_directory):
+        return {}
+
+    return find_collection_files(app_directory)
+
+
+def list_apps(path):
+    return sorted([app for app in os.listdir(path) if os.path.isdir(os.path.join(path, app))])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Usergrid Export Diff')
+
+    parser.add_argument('--log_level',
+                        help='log level - DEBUG, INFO, WARN, ERROR, CRITICAL',
+                        default='INFO',
+                        type=str,
+                        required=False)
+
+    parser.add_argument('-o', '--org',
+                        help='Name of the source org, used in the records so that they can be replayed',
+                        type=str,
+                        required=True)
+
+    parser.add_argument('--source',
+                        help='The path to the export of the source org, <export_path>/<id>/<org>',
+                        type=str,
+                        required=True)
+
+    parser.add_argument('--target',
+                        help='The path to the export of the target org, <export_path>/<id>/<org>',
+                        type=str,
+                        required=True)
+
+    parser.add_argument('-a', '--app',
+                        help='Name of one or more source apps to include, specify none to include all apps',
+                        required=False,
+                        action='append')
+
+    parser.add_argument('-c', '--collection',
+                        help='Name of one or more source collections to include, specify none to include all '
+                             'collections',
+                        default=[],
+                        action='append')
+
+    parser.add_argument('--exclude_collection',
+                        help='Name of one or more collections to EXCLUDE, specify none to include all collections',
+                        default=[],
+                        action='append')
+
+    parser.add_argument('--ignore_field',
+                        help='One or more entity fields to ignore when comparing entities, in addition to %s' %
+                             DEFAULT_IGNORE_FIELDS,
+                        default=[],
+                        action='append')
+
+    parser.add_argument('--skip_edges',
+                        help='Compare only the entities',
+                        action='store_true')
+
+    parser.add_argument('--sort_buffer_size',
+                        help='The number of records to sort in memory before spilling a sorted run to --temp_dir',
+                        type=int,
+                        default=DEFAULT_BUFFER_SIZE)
+
+    parser.add_argument('--temp_dir',
+                        help='The directory for the sorted runs of collections which do not fit in memory',
+                        type=str)
+
+    parser.add_argument('--output',
+                        help='The file to write the entities and edges which are missing or changed in the target '
+                             'to, which can be replayed with usergrid_data_migrator -m replay',
+                        type=str)
+
+    parser.add_argument('--extra_output',
+                        help='The file to write the entities and edges which are in the target but not the source to',
+                        type=str)
+
+    parser.add_argument('--map_app',
+                        help="Multiple allowed: A colon-separated string such as 'apples:oranges' which indicates that "
+                             "the app named 'apples' in the source was migrated to the app named 'oranges' in the "
+                             "target",
+                        default=[],
+                        action='append')
+
+    parser.add_argument('--map_collection',
+                        help="One or more colon-separated string such as 'cats:dogs' which indicates that collections "
+                             "named 'cats' in the source were migrated to collections named 'dogs' in the target, "
+                             "applicable globally to all apps",
+                        default=[],
+                        action='append')
+
+    my_args = parser.parse_args(sys.argv[1:])
+
+    return vars(my_args)
+
+
+def init():
+    global config
+
+    config['collection_mapping'] = {}
+    config['app_mapping'] = {}
+
+    for mapping in config.get('map_collection', []):
+        parts = mapping.split(':')
+
+        if len(parts) == 2:
+            config['collection_mapping'][parts[0]] = parts[1]
+        else:
+            logger.warning('Skipping Collection mapping: [%s]' % mapping)
+
+    for mapping in config.get('map_app', []):
+        parts = mapping.split(':')
+
+        if len(parts) == 2:
+            config['app_mapping'][parts[0]] = parts[1]
+        else:
+            logger.warning('Skipping App mapping: [%s]' % mapping)
+
+    config['ignore_fields'] = DEFAULT_IGNORE_FIELDS + config.get('ignore_field', [])
+
+    if config.get('output') is None:
+        config['output'] = '%s-diff-%s.json' % (config.get('org'), ECID)
+
+    if config.get('extra_output') is None:
+        config['extra_output'] = '%s-diff-%s-extra.json' % (config.get('org'), ECID)
+
+
+def main():
+    global config
+
+    config = parse_args()
+
+    logging.basicConfig(level=logging.getLevelName(config.get('log_level')), stream=sys.stderr,
+                        format='%(asctime)s | %(name)s | %(levelname)s | %(message)s')
+
+    init()
+
+    writer = DiffWriter(config.get('output'))
+    extra_writer = DiffWriter(config.get('extra_output'))
+
+    apps_to_process = config.get('app')
+    empty_files = {ENTITY_FILES: [], EDGE_FILES: []}
+    totals = {}
+
+    # the (app, collection) of the target which have been compared to a source collection
+    compared = set()
+
+    def add_counts(counts):
+        for key, value in counts.iteritems():
+            totals[key] = totals.get(key, 0) + value
+
+    try:
+        for app in list_apps(config.get('source')):
+            if apps_to_process and len(apps_to_process) > 0 and app not in apps_to_process:
+                logger.warning('Skipping app [%s] not included in process list [%s]' % (app, apps_to_process))
+                continue
+
+            target_app, _ = get_target_mapping(app, None)
+            target_collections = find_snapshot_files(config.get('target'), target_app)
+
+            for collection_name, source_files in sorted(find_snapshot_files(config.get('source'), app).iteritems()):
+                if not include_collection(collection_name):
+                    logger.warning('Skipping collection=[%s]' % collection_name)
+                    continue
+
+                _, target_collection = get_target_mapping(app, collection_name)
+                compared.add((target_app, target_collection))
+
+                add_counts(diff_collection(app, collection_name, target_app, target_collection, source_files,
+                                           target_collections.get(target_collection, empty_files), writer,
+                                           extra_writer))
+
+        # everything in a target collection without a source collection is extra, unless the source was filtered out
+        if not apps_to_process and len(config.get('collection')) == 0:
+            for target_app in list_apps(config.get('target')):
+                for target_collection, target_files in sorted(
+                        find_snapshot_files(config.get('target'), target_app).iteritems()):
+
+                    if (target_app, target_collection) in compared or \
+                            target_collection in config.get('exclude_collection'):
+                        continue
+
+                    add_counts(diff_collection(target_app, target_collection, target_app, target_collection,
+                                               empty_files, target_files, writer, extra_writer))
+
+    finally:
+        writer.close()
+        extra_writer.close()
+
+    logger.warning('Finished comparing [%s] to [%s]: %s' % (config.get('source'), config.get('target'),
+                                                           json.dumps(totals)))
+
+    print json.dumps(totals, indent=2)
+    print 'Missing/changed (replay with usergrid_data_migrator -m replay --replay_file): %s' % config.get('output')
+    print 'Extra in target: %s' % config.get('extra_output')
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ import signal
 
 from requests.auth import HTTPBasicAuth
 from usergrid import UsergridQueryIterator
+from usergrid_tools.migration.failure_journal import FailureJournalWriter
 import urllib3
 
 __author__ = 'Jeff West @ ApigeeCorporation'
@@ -262,6 +263,8 @@ class ErrorListener(Process):
         empty_count = 0
         error_count = 0
 
+        journal = FailureJournalWriter(os.path.join(config.get('log_dir'), '%s-failures.json' % ECID))
+
         while keep_going:
 
             try:
@@ -271,8 +274,7 @@ class ErrorListener(Process):
 
                 status_logger.error('ErrorListener - errors=[%s] Writing...' % error_count)
 
-                with open('/mnt/raid/logs/%s_errors.txt' % ECID, 'a') as f:
-                    f.write(json.dumps(error_object))
+                journal.write(error_object)
 
             except KeyboardInterrupt, e:
                 status_logger.error('ErrorListener - errors=[%s] Interrupted!' % error_count)
@@ -284,6 +286,7 @@ class ErrorListener(Process):
 
                 if empty_count >= 24:
                     status_logger.error('STOPPING! empty_count=[%s], error_count=[%s]' % (empty_count, error_count))
+                    keep_going = False
 
             except:
                 print traceback.format_exc()
@@ -947,11 +950,13 @@ def migrate_data(app, collection_name, source_entity, attempts=0):
 
             if str_modified not in [None, 'None']:
 
-                modified = long(str_modified)
+                # the data migrator caches 'modified:hash' when run with --content_hash
+                modified = long(str_modified.split(':', 1)[0])
 
                 logger.debug('FOUND CACHE: %s = %s ' % (source_entity.get('uuid'), modified))
 
-                if modified <= source_entity.get('modified'):
+                # only an entity modified since it was migrated is written again
+                if modified >= source_entity.get('modified'):
 
                     modified_date = datetime.datetime.utcfromtimestamp(modified / 1000)
                     e_uuid = source_entity.get('uuid')
@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from usergrid_tools.general.metrics import registry as metrics
+
+__author__ = 'Jeff West @ ApigeeCorporation'
+
+logger = logging.getLogger('VisitCache')
+
+
+class VisitCache(object):
+    """
+    A cache layer in front of Redis which is used for the visited node/edge markers and modified timestamps of the
+    migrator.  Recently seen keys are kept in a bounded in-process LRU so that repeated visits in the same worker do not
+    reach Redis.  Writes are buffered and sent in a single pipeline once write_batch_size writes are pending, and pages
+    of keys can be loaded with a single MGET using prefetch()
+
+    Keys set with an expiry are held locally until the same time, after which they are treated as not found.  Values
+    read from Redis are held for at most remote_ttl seconds, since the key may expire or be changed by another worker.
+
+    The get/set/delete signatures match the redis client so that this can be used anywhere the client was used.  It is
+    safe to share between the threads of a worker process.
+    """
+
+    def __init__(self, client, lru_size=100000, write_batch_size=50, remote_ttl=3600):
+        """
+        :param client: the redis.StrictRedis/redis.Redis client
+        :param lru_size: the maximum number of keys to keep in the in-process LRU, 0 disables the LRU
+        :param write_batch_size: the number of pending set/delete operations which triggers a pipeline flush
+        :param remote_ttl: the maximum number of seconds to hold a value read from Redis locally, which should not be
+        more than the expiry the keys are set with
+        """
+        self.client = client
+        self.lru_size = lru_size
+        self.write_batch_size = write_batch_size
+        self.remote_ttl = remote_ttl
+
+        self.lock = threading.RLock()
+        self.lru = OrderedDict()
+        self.pending_writes = OrderedDict()
+
+        self.stats = {
+            'local_hits': 0,
+            'remote_hits': 0,
+            'misses': 0,
+            'remote_reads': 0,
+            'remote_read_seconds': 0.0,
+            'remote_writes': 0,
+            'remote_write_seconds': 0.0,
+        }
+
+    def _remember(self, key, value, ex=None):
+        if self.lru_size <= 0:
+            return
+
+        if key in self.lru:
+            del self.lru[key]
+
+        # each entry holds the value and the time it expires, None if it does not
+        self.lru[key] = (value, time.time() + ex if ex is not None else None)
+
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def _forget(self, key):
+        if key in self.lru:
+            del self.lru[key]
+
+    def _lookup_local(self, key):
+        now = time.time()
+
+        if key in self.pending_writes:
+            operation, value, ex, expires_at = self.pending_writes[key]
+
+            # a key which has expired before its write was sent is gone, as it would be in Redis
+            if operation == 'set' and (expires_at is None or expires_at > now):
+                return True, value
+
+            return True, None
+
+        if key in self.lru:
+            value, expires_at = self.lru.pop(key)
+
+            if expires_at is not None and expires_at <= now:
+                return False, None
+
+            self.lru[key] = (value, expires_at)
+            return True, value
+
+        return False, None
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def get(self, name):
+        with self.lock:
+            found, value = self._lookup_local(name)
+
+        if found:
+            self._count('local_hits')
+            return value
+
+        start_time = time.time()
+        value = self.client.get(name)
+        elapsed = time.time() - start_time
+
+        metrics.observe('usergrid_cache_seconds', elapsed, operation='get')
+
+        with self.lock:
+            self.stats['remote_reads'] += 1
+            self.stats['remote_read_seconds'] += elapsed
+
+            if value is None:
+                self.stats['misses'] += 1
+            else:
+                self.stats['remote_hits'] += 1
+                self._remember(name, value, self.remote_ttl)
+
+        return value
+
+    def get_many(self, names):
+        """
+        Gets the values of multiple keys, using a single MGET for the keys which are not held locally
+
+        :param names: the keys to retrieve
+        :return: a dict of key -> value (None if not found)
+        """
+        response = {}
+        remote_names = []
+
+        with self.lock:
+            for name in names:
+                found, value = self._lookup_local(name)
+
+                if found:
+                    self.stats['local_hits'] += 1
+                    response[name] = value
+                elif name not in response:
+                    remote_names.append(name)
+                    response[name] = None
+
+        if len(remote_names) > 0:
+            start_time = time.time()
+            values = self.client.mget(remote_names)
+            elapsed = time.time() - start_time
+
+            metrics.observe('usergrid_cache_seconds', elapsed, operation='mget')
+
+            with self.lock:
+                self.stats['remote_reads'] += 1
+                self.stats['remote_read_seconds'] += elapsed
+
+                for name, value in zip(remote_names, values):
+                    response[name] = value
+
+                    if value is None:
+                        self.stats['misses'] += 1
+                    else:
+                        self.stats['remote_hits'] += 1
+                        self._remember(name, value, self.remote_ttl)
+
+        return response
+
+    def prefetch(self, names):
+        """
+        Loads the values of a page of keys into the LRU with a single MGET so that the following get() calls are local.
+        Keys which are not found are not cached since another worker may set them.
+        """
+        if self.lru_size > 0 and len(names) > 0:
+            self.get_many(names)
+
+    def set(self, name, value, ex=None):
+        value = str(value)
+
+        with self.lock:
+            self._remember(name, value, ex)
+            flush_needed = self._queue_write(name, ('set', value, ex, time.time() + ex if ex is not None else None))
+
+        if flush_needed:
+            self.flush()
+
+    def set_many(self, mapping, ex=None):
+        for name, value in mapping.iteritems():
+            self.set(name, value, ex=ex)
+
+    def delete(self, name):
+        with self.lock:
+            self._forget(name)
+            flush_needed = self._queue_write(name, ('delete', None, None, None))
+
+        if flush_needed:
+            self.flush()
+
+    def _queue_write(self, name, write):
+        if name in self.pending_writes:
+            del self.pending_writes[name]
+
+        self.pending_writes[name] = write
+
+        return len(self.pending_writes) >= self.write_batch_size
+
+    def flush(self):
+        """
+        Sends all pending set/delete operations to Redis in a single pipeline
+        """
+        with self.lock:
+            if len(self.pending_writes) == 0:
+                return
+
+            pending_writes = self.pending_writes
+            self.pending_writes = OrderedDict()
+
+        start_time = time.time()
+        pipe = self.client.pipeline(transaction=False)
+
+        for name, (operation, value, ex, expires_at) in pending_writes.iteritems():
+            if operation == 'set':
+                pipe.set(name, value, ex=ex)
+            else:
+                pipe.delete(name)
+
+        pipe.execute()
+        elapsed = time.time() - start_time
+
+        metrics.observe('usergrid_cache_seconds', elapsed, operation='set')
+
+        with self.lock:
+            self.stats['remote_writes'] += 1
+            self.stats['remote_write_seconds'] += elapsed
+
+    def get_stats(self):
+        """
+        :return: a copy of the hit/miss/latency counters along with the hit ratio and average latencies in ms
+        """
+        with self.lock:
+            stats = self.stats.copy()
+            stats['lru_size'] = len(self.lru)
+
+        lookups = stats['local_hits'] + stats['remote_hits'] + stats['misses']
+
+        stats['hit_ratio'] = (stats['local_hits'] + stats['remote_hits']) / float(lookups) if lookups > 0 else 0.0
+        stats['local_hit_ratio'] = stats['local_hits'] / float(lookups) if lookups > 0 else 0.0
+
+        stats['avg_remote_read_ms'] = 1000 * stats['remote_read_seconds'] / stats['remote_reads'] \
+            if stats['remote_reads'] > 0 else 0.0
+
+        stats['avg_remote_write_ms'] = 1000 * stats['remote_write_seconds'] / stats['remote_writes'] \
+            if stats['remote_writes'] > 0 else 0.0
+
+        return stats